@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Context Engineering ベンチマーク
+
+LLMを呼び出さない経路（ローカル分析・最適化）の性能を計測します。
+
+    python benchmarks.py offload
+    python benchmarks.py compression
+    python benchmarks.py extractive
+    python benchmarks.py relevance
+    python benchmarks.py structure
+
+LLMを呼び出す経路は応答遅延を模擬したモデル（SimulatedModel）で計測します。
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import List
+
+from context_models import ContextWindow, ContextElement, ContextType
+
+WORDS = (
+    "context window token prompt model system user assistant summary memory retrieval "
+    "document query answer analysis optimization cache latency budget priority element "
+    "コンテキスト 最適化 要約 検索 応答 品質 分析 圧縮 優先度 トークン"
+).split() + [f"term{i}" for i in range(5000)]
+
+# 自然文に近いZipf分布の語彙頻度
+WORD_WEIGHTS = [1.0 / (rank + 1) for rank in range(len(WORDS))]
+
+def build_window(element_count: int, words_per_element: int, seed: int = 0) -> ContextWindow:
+    """ランダムな語彙でベンチマーク用ウィンドウを作成"""
+    rng = random.Random(seed)
+    types = [ContextType.SYSTEM, ContextType.USER, ContextType.ASSISTANT]
+    window = ContextWindow(max_tokens=10 ** 9)
+    for i in range(element_count):
+        window.elements.append(ContextElement(
+            content=" ".join(rng.choices(WORDS, WORD_WEIGHTS, k=words_per_element)) + ".",
+            type=types[0] if i == 0 else types[1 + i % 2],
+            priority=rng.randint(1, 10)
+        ))
+    return window
+
+class SimulatedResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class SimulatedModel:
+    """固定の往復遅延と出力トークン数に比例する生成時間を模擬するモデル"""
+
+    def __init__(self, base_latency: float, seconds_per_token: float):
+        self.base_latency = base_latency
+        self.seconds_per_token = seconds_per_token
+        self.calls = 0
+
+    @staticmethod
+    def _halve(text: str) -> str:
+        words = text.split()
+        return " ".join(words[:max(1, len(words) // 2)])
+
+    def _respond(self, prompt: str) -> str:
+        from context_optimizer import BATCH_INPUT_MARKER
+
+        if BATCH_INPUT_MARKER in prompt:
+            data = json.loads(prompt.split(BATCH_INPUT_MARKER, 1)[1])
+            for item in data["items"]:
+                item["text"] = self._halve(item["text"])
+            return json.dumps(data, ensure_ascii=False)
+        if "元のテキスト:" in prompt:
+            content = prompt.split("元のテキスト:", 1)[1].rsplit("圧縮されたテキスト:", 1)[0]
+            return self._halve(content)
+        return "0.0"
+
+    async def generate_content_async(self, prompt: str) -> SimulatedResponse:
+        self.calls += 1
+        text = self._respond(prompt)
+        await asyncio.sleep(self.base_latency + len(text.split()) * 1.3 * self.seconds_per_token)
+        return SimulatedResponse(text)
+
+def build_document(sentence_count: int, rng: random.Random) -> str:
+    """英語・日本語の終止符が混在する複数文のテキストを作成"""
+    sentences = []
+    for _ in range(sentence_count):
+        words = rng.choices(WORDS, WORD_WEIGHTS, k=rng.randint(8, 20))
+        sentences.append(" ".join(words) + rng.choice((". ", "。", "! ", "？")))
+    return "".join(sentences)
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def _small_request_latencies(analyzer,
+                                  large: ContextWindow,
+                                  smalls: List[ContextWindow],
+                                  interval: float) -> List[float]:
+    """大きな分析の実行中に一定間隔で小さな分析を投げ、予定時刻からのレイテンシを計測"""
+    latencies: List[float] = []
+
+    async def timed(window: ContextWindow, scheduled: float):
+        await analyzer.analyze_context_window(window, "fast")
+        latencies.append((time.perf_counter() - scheduled) * 1000)
+
+    started = time.perf_counter()
+    large_task = asyncio.create_task(analyzer.analyze_context_window(large, "fast"))
+    pending = []
+    issued = 0
+    while not large_task.done():
+        # イベントループが塞がれていた間の遅延も計上するため予定時刻を基準にする
+        scheduled = started + issued * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        pending.append(asyncio.create_task(timed(smalls[issued % len(smalls)], scheduled)))
+        issued += 1
+
+    await large_task
+    await asyncio.gather(*pending)
+    return latencies
+
+def bench_offload(args):
+    """大きなウィンドウの分析中における小さな分析リクエストのレイテンシ（プロセスプール有無の比較）"""
+    from context_analyzer import ContextAnalyzer
+
+    large = build_window(args.large_elements, 60, seed=1)
+    smalls = [build_window(10, 30, seed=100 + i) for i in range(args.concurrency)]
+    print(f"large window: {len(large.elements)} elements, {sum(len(e.content) for e in large.elements) / 1e6:.1f} MB")
+
+    for label, threshold in (("in-process", float("inf")), ("process pool", args.threshold)):
+        analyzer = ContextAnalyzer("benchmark", offload_threshold_chars=threshold)
+        try:
+            started = time.perf_counter()
+            latencies = asyncio.run(_small_request_latencies(analyzer, large, smalls, args.interval))
+            elapsed = time.perf_counter() - started
+        finally:
+            analyzer.close()
+
+        print(
+            f"{label:>12}: large analysis {elapsed:6.2f}s | small requests n={len(latencies):4d} "
+            f"p50={statistics.median(latencies):8.1f}ms p95={percentile(latencies, 0.95):8.1f}ms "
+            f"max={max(latencies):8.1f}ms"
+        )
+
+def bench_compression(args):
+    """要素ごとの圧縮とバッチ圧縮のLLM呼び出し回数・所要時間の比較（遅延模擬モデル）"""
+    from context_optimizer import ContextOptimizer
+
+    results = {}
+    for label, batching in (("per-element", False), ("batched", True)):
+        window = build_window(args.elements, args.words, seed=2)
+        optimizer = ContextOptimizer("benchmark", llm_concurrency=args.concurrency)
+        optimizer.model = SimulatedModel(args.latency, args.seconds_per_token)
+        original_tokens = window.current_tokens
+
+        started = time.perf_counter()
+        # 全要素を圧縮対象にする（要素の削除は候補にしない）
+        result = asyncio.run(optimizer._optimize_for_token_reduction(window, {
+            "target_token_reduction": 1.0,
+            "min_tokens": 0,
+            "preserve_element_types": [context_type.value for context_type in ContextType],
+            "compression_batching": batching,
+            "compression_batch_tokens": args.batch_tokens
+        }))
+        elapsed = time.perf_counter() - started
+        results[label] = elapsed
+
+        print(
+            f"{label:>12}: {elapsed:6.2f}s | llm calls {optimizer.model.calls:4d} "
+            f"(saved {result['llm_calls_saved']:4d}, fallbacks {result['fallback_calls']}) | "
+            f"tokens {original_tokens:.0f} -> {window.current_tokens:.0f}"
+        )
+
+    print(f"speedup: {results['per-element'] / results['batched']:.2f}x")
+
+def bench_extractive(args):
+    """ローカル抽出型圧縮の圧縮率とスループット"""
+    from context_heuristics import ExtractiveCompressor
+
+    rng = random.Random(3)
+    documents = [build_document(args.sentences, rng) for _ in range(args.elements)]
+    input_bytes = sum(len(document.encode("utf-8")) for document in documents)
+    compressor = ExtractiveCompressor()
+
+    started = time.perf_counter()
+    outputs = [compressor.compress(document, args.ratio) or document for document in documents]
+    elapsed = time.perf_counter() - started
+
+    output_chars = sum(len(output) for output in outputs)
+    input_chars = sum(len(document) for document in documents)
+    print(
+        f"{len(documents)} elements x {args.sentences} sentences ({input_bytes / 1e6:.2f} MB): "
+        f"ratio {output_chars / input_chars:.3f} (target {args.ratio}) | "
+        f"{elapsed:.2f}s | {input_bytes / 1e6 / elapsed:.2f} MB/s"
+    )
+
+def bench_relevance(args):
+    """ローカルBM25による関連性並び替えの所要時間（LLM呼び出しなし）"""
+    from context_optimizer import ContextOptimizer
+
+    optimizer = ContextOptimizer("benchmark")
+    optimizer.model = SimulatedModel(0.05, 0.0001)
+    for query in (None, "context window token budget"):
+        timings = []
+        for repeat in range(args.repeats):
+            window = build_window(args.elements, args.words, seed=5 + repeat)
+            constraints = {"relevance_mode": "bm25", "query": query}
+            started = time.perf_counter()
+            asyncio.run(optimizer._optimize_for_relevance(window, constraints))
+            timings.append((time.perf_counter() - started) * 1000)
+
+        print(
+            f"{'topics' if query is None else 'query':>6}: {args.elements} elements | "
+            f"p50={statistics.median(timings):7.1f}ms max={max(timings):7.1f}ms | llm calls {optimizer.model.calls}"
+        )
+
+def bench_structure(args):
+    """構造最適化（複数キーの安定ソート）の所要時間と結果の一貫性"""
+    from context_optimizer import ContextOptimizer
+
+    window = build_window(args.elements, args.words, seed=7)
+    rng = random.Random(7)
+    for element in rng.sample(window.elements, args.elements // 100):
+        element.tags.append("pinned")
+    original = list(window.elements)
+    optimizer = ContextOptimizer("benchmark")
+
+    for order in (["type", "-priority", "-created_at"], ["pinned", "type", "-priority", "-created_at"], ["-priority"]):
+        constraints = {"structure_order": order}
+        timings = []
+        orders = []
+        for _ in range(args.repeats):
+            window.elements = list(original)
+            started = time.perf_counter()
+            result = asyncio.run(optimizer._optimize_for_structure(window, constraints))
+            timings.append((time.perf_counter() - started) * 1000)
+            orders.append([element.id for element in window.elements])
+
+        # 並べ替え済みのウィンドウを再度並べても順序は変わらない
+        asyncio.run(optimizer._optimize_for_structure(window, constraints))
+        stable = orders[-1] == [element.id for element in window.elements]
+        print(
+            f"{','.join(order):>32}: {args.elements} elements | p50={statistics.median(timings):7.1f}ms "
+            f"max={max(timings):7.1f}ms | moved {result['moved_elements']} | "
+            f"identical across runs: {all(ids == orders[0] for ids in orders)} | idempotent: {stable}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Context Engineering benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    offload = subparsers.add_parser("offload", help=bench_offload.__doc__)
+    offload.add_argument("--large-elements", type=int, default=20000)
+    offload.add_argument("--concurrency", type=int, default=8, help="number of distinct small windows")
+    offload.add_argument("--interval", type=float, default=0.01, help="seconds between small requests")
+    offload.add_argument("--threshold", type=int, default=500_000)
+    offload.set_defaults(func=bench_offload)
+
+    compression = subparsers.add_parser("compression", help=bench_compression.__doc__)
+    compression.add_argument("--elements", type=int, default=100)
+    compression.add_argument("--words", type=int, default=120, help="words per element")
+    compression.add_argument("--batch-tokens", type=int, default=3000)
+    compression.add_argument("--concurrency", type=int, default=4, help="concurrent LLM calls")
+    compression.add_argument("--latency", type=float, default=0.05, help="simulated round-trip seconds per call")
+    compression.add_argument("--seconds-per-token", type=float, default=0.0001, help="simulated generation time")
+    compression.set_defaults(func=bench_compression)
+
+    extractive = subparsers.add_parser("extractive", help=bench_extractive.__doc__)
+    extractive.add_argument("--elements", type=int, default=2000)
+    extractive.add_argument("--sentences", type=int, default=20, help="sentences per element")
+    extractive.add_argument("--ratio", type=float, default=0.5)
+    extractive.set_defaults(func=bench_extractive)
+
+    relevance = subparsers.add_parser("relevance", help=bench_relevance.__doc__)
+    relevance.add_argument("--elements", type=int, default=1000)
+    relevance.add_argument("--words", type=int, default=60, help="words per element")
+    relevance.add_argument("--repeats", type=int, default=5)
+    relevance.set_defaults(func=bench_relevance)
+
+    structure = subparsers.add_parser("structure", help=bench_structure.__doc__)
+    structure.add_argument("--elements", type=int, default=100_000)
+    structure.add_argument("--words", type=int, default=8, help="words per element")
+    structure.add_argument("--repeats", type=int, default=5)
+    structure.set_defaults(func=bench_structure)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
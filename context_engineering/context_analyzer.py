@@ -1,7 +1,12 @@
 import logging
 import re
 import json
-from typing import Dict, List, Any, Optional, Tuple
+import math
+import time
+import copy
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator
 from datetime import datetime
 import google.generativeai as genai
 from collections import Counter
@@ -11,110 +16,357 @@ from context_models import (
     ContextWindow, ContextElement, ContextAnalysis, 
     ContextQuality, MultimodalContext, RAGContext
 )
+from context_heuristics import LocalContextScorer
+from context_profiler import AnalysisProfiler, ProfileRegistry, record_llm_call
+from context_stats import (
+    PackedWindow, pack_window, basic_metrics, structure_metrics,
+    token_efficiency_metrics, compute_window_metrics, score_packed_window
+)
 
 logger = logging.getLogger(__name__)
 
+# fast: ローカル推定のみ / llm: Gemini分析 / hybrid: ローカル推定の信頼度が低い場合のみGemini分析
+ANALYSIS_MODES = ("fast", "llm", "hybrid")
+
+def validate_analysis_mode(mode: str):
+    """分析モードの検証"""
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode: {mode} (expected one of {', '.join(ANALYSIS_MODES)})")
+
+# 意味分析プロンプトの指示文ぶんのトークン見積もり
+SEMANTIC_PROMPT_OVERHEAD_TOKENS = 400
+
+SEMANTIC_METRICS = (
+    "topic_consistency", "logical_flow", "information_redundancy",
+    "context_clarity", "goal_alignment"
+)
+
+RETRIEVAL_METRICS = ("query_relevance", "result_redundancy", "coverage_completeness")
+
+def estimate_prompt_tokens(text: str) -> float:
+    """プロンプト用の保守的なトークン数見積もり（空白区切りでない言語も考慮）"""
+    return max(len(text.split()) * 1.3, len(text) / 2)
+
+def _metric_value(result: Any, metric: str, default: float) -> float:
+    """LLM応答のメトリクス値（応答が辞書でない・値が数値でない場合は default）"""
+    metrics = result.get("metrics") if isinstance(result, dict) else None
+    if not isinstance(metrics, dict):
+        return default
+    try:
+        value = float(metrics.get(metric, default))
+    except (TypeError, ValueError):
+        return default
+    return value if math.isfinite(value) else default
+
+def _insights(result: Any) -> List[str]:
+    """LLM応答の洞察（リストでなければ空）"""
+    insights = result.get("insights") if isinstance(result, dict) else None
+    return [str(insight) for insight in insights] if isinstance(insights, list) else []
+
+def _needs_llm(local_result: Dict[str, Any], mode: str, confidence_threshold: float) -> bool:
+    """ローカル推定結果に対してLLM分析が必要か判定"""
+    if mode == "fast":
+        return False
+    return local_result["confidence"] < confidence_threshold
+
 class ContextAnalyzer:
     """コンテキスト分析エンジン"""
     
-    def __init__(self, gemini_api_key: str):
+    def __init__(self,
+                 gemini_api_key: str,
+                 hybrid_confidence_threshold: float = 0.6,
+                 max_prompt_tokens: int = 6000,
+                 chunk_concurrency: int = 4,
+                 offload_threshold_chars: int = 500_000,
+                 process_pool_workers: Optional[int] = None):
         genai.configure(api_key=gemini_api_key)
         self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.local_scorer = LocalContextScorer()
+        self.hybrid_confidence_threshold = hybrid_confidence_threshold
+        self.max_prompt_tokens = max_prompt_tokens
+        self.chunk_concurrency = chunk_concurrency
+        self.profile_registry = ProfileRegistry()
+        # この文字数以上のウィンドウはCPU負荷の高い処理をプロセスプールで実行
+        self.offload_threshold_chars = offload_threshold_chars
+        self.process_pool_workers = process_pool_workers
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+    
+    def close(self):
+        """プロセスプールを終了"""
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+    
+    async def _run_cpu_bound(self, offload: bool, func, *args):
+        """CPU負荷の高い処理を実行（offload時はプロセスプールでイベントループを塞がない）"""
+        if not offload:
+            return func(*args)
+        
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.process_pool_workers)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._process_pool, func, *args)
         
-    async def analyze_context_window(self, window: ContextWindow) -> ContextAnalysis:
+    async def analyze_context_window(self, window: ContextWindow, mode: str = "llm") -> ContextAnalysis:
         """コンテキストウィンドウの包括的分析"""
+        validate_analysis_mode(mode)
         
         analysis = ContextAnalysis(
             context_id=window.id,
             analysis_type="comprehensive"
         )
-        
-        # 基本メトリクス計算
-        basic_metrics = self._calculate_basic_metrics(window)
-        analysis.metrics.update(basic_metrics)
-        
-        # 構造分析
-        structure_analysis = self._analyze_structure(window)
-        analysis.metrics.update(structure_analysis)
+        profiler = AnalysisProfiler()
+        
+        with profiler.stage("packing"):
+            packed = pack_window(window)
+        offload = len(packed.text) >= self.offload_threshold_chars
+        
+        if offload:
+            # 大きなウィンドウは統計メトリクスをまとめてプロセスプールで計算
+            with profiler.stage("local_metrics") as stage:
+                stage["offloaded"] = True
+                local_metrics = await self._run_cpu_bound(True, compute_window_metrics, packed)
+            analysis.metrics.update(local_metrics["basic"])
+            analysis.metrics.update(local_metrics["structure"])
+        else:
+            contents = packed.contents()
+            
+            # 基本メトリクス計算
+            with profiler.stage("basic_metrics"):
+                basic_analysis = basic_metrics(packed, contents)
+            analysis.metrics.update(basic_analysis)
+            
+            # 構造分析
+            with profiler.stage("structure"):
+                structure_analysis = structure_metrics(packed)
+            analysis.metrics.update(structure_analysis)
         
         # 意味的一貫性分析
-        semantic_analysis = await self._analyze_semantic_consistency(window)
+        with profiler.stage("semantic"):
+            semantic_analysis = await self._analyze_semantics(window, mode, packed, offload)
         analysis.metrics.update(semantic_analysis["metrics"])
         analysis.insights.extend(semantic_analysis["insights"])
         
         # トークン効率性分析
-        efficiency_analysis = self._analyze_token_efficiency(window)
+        if offload:
+            efficiency_analysis = local_metrics["efficiency"]
+        else:
+            with profiler.stage("token_efficiency"):
+                efficiency_analysis = token_efficiency_metrics(contents)
         analysis.metrics.update(efficiency_analysis)
         
         # 品質評価
-        quality_assessment = await self._assess_quality(window, analysis.metrics)
+        with profiler.stage("quality"):
+            quality_assessment = await self._assess_quality(window, analysis.metrics)
         analysis.quality_score = quality_assessment["score"]
         analysis.issues.extend(quality_assessment["issues"])
         analysis.strengths.extend(quality_assessment["strengths"])
         analysis.recommendations.extend(quality_assessment["recommendations"])
         
+        analysis.profile = profiler.to_dict()
+        analysis.profile["mode"] = mode
+        self.profile_registry.record(analysis.profile)
+        
         return analysis
     
-    def _calculate_basic_metrics(self, window: ContextWindow) -> Dict[str, float]:
-        """基本メトリクス計算"""
-        if not window.elements:
-            return {
-                "total_elements": 0,
-                "total_tokens": 0,
-                "avg_element_length": 0,
-                "token_utilization": 0
-            }
-        
-        element_lengths = [len(elem.content) for elem in window.elements]
+    async def analyze_context_windows(self,
+                                      windows: List[ContextWindow],
+                                      concurrency: int = 4,
+                                      mode: str = "llm") -> AsyncIterator[Dict[str, Any]]:
+        """複数ウィンドウの一括分析（同時実行数制限付き、完了順に結果を返す）"""
+        validate_analysis_mode(mode)
+        
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        # 同一内容のウィンドウはフィンガープリントでまとめて1回だけ分析
+        groups: Dict[str, List[ContextWindow]] = {}
+        for window in windows:
+            groups.setdefault(window.fingerprint, []).append(window)
+        
+        async def run_group(fingerprint: str, group: List[ContextWindow]):
+            async with semaphore:
+                try:
+                    return fingerprint, group, await self.analyze_context_window(group[0], mode), None
+                except Exception as e:
+                    return fingerprint, group, None, e
+        
+        pending = [
+            asyncio.create_task(run_group(fingerprint, group))
+            for fingerprint, group in groups.items()
+        ]
+        
+        analyzed = 0
+        deduplicated = 0
+        failed = 0
         
-        return {
-            "total_elements": len(window.elements),
-            "total_tokens": window.current_tokens,
-            "avg_element_length": statistics.mean(element_lengths),
-            "max_element_length": max(element_lengths),
-            "min_element_length": min(element_lengths),
-            "token_utilization": window.utilization_ratio,
-            "available_tokens": window.available_tokens
+        try:
+            for future in asyncio.as_completed(pending):
+                fingerprint, group, analysis, error = await future
+                
+                for index, window in enumerate(group):
+                    if error is not None:
+                        failed += 1
+                        logger.error(f"Batch analysis failed for window {window.id}: {str(error)}")
+                        yield {
+                            "type": "error",
+                            "window_id": window.id,
+                            "fingerprint": fingerprint,
+                            "error": str(error)
+                        }
+                        continue
+                    
+                    if index == 0:
+                        analyzed += 1
+                        window_analysis = analysis
+                    else:
+                        deduplicated += 1
+                        window_analysis = copy.deepcopy(analysis)
+                        window_analysis.context_id = window.id
+                        window_analysis.profile["cache_hit"] = True
+                        self.profile_registry.record(window_analysis.profile)
+                    
+                    yield {
+                        "type": "result",
+                        "window_id": window.id,
+                        "fingerprint": fingerprint,
+                        "deduplicated": index > 0,
+                        "analysis": window_analysis
+                    }
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        elapsed = time.perf_counter() - started
+        yield {
+            "type": "summary",
+            "total_windows": len(windows),
+            "unique_windows": len(groups),
+            "analyzed": analyzed,
+            "deduplicated": deduplicated,
+            "failed": failed,
+            "concurrency": max(1, concurrency),
+            "elapsed_seconds": elapsed,
+            "windows_per_second": len(windows) / elapsed if elapsed > 0 else 0.0
         }
     
-    def _analyze_structure(self, window: ContextWindow) -> Dict[str, float]:
-        """構造分析"""
-        if not window.elements:
-            return {}
-        
-        # 要素タイプの分布
-        type_counts = Counter(elem.type.value for elem in window.elements)
-        total_elements = len(window.elements)
-        
-        # 優先度分析
-        priorities = [elem.priority for elem in window.elements]
-        
-        # 時系列分析
-        creation_times = [elem.created_at for elem in window.elements]
-        time_span = (max(creation_times) - min(creation_times)).total_seconds() if len(creation_times) > 1 else 0
-        
+    async def _analyze_semantics(self,
+                                 window: ContextWindow,
+                                 mode: str,
+                                 packed: PackedWindow,
+                                 offload: bool = False) -> Dict[str, Any]:
+        """分析モードに応じた意味メトリクスの算出"""
+        if mode == "llm":
+            return await self._analyze_semantic_consistency(window)
+        
+        local_result = await self._run_cpu_bound(offload, score_packed_window, self.local_scorer, packed)
+        local_result["metrics"]["local_confidence"] = local_result["confidence"]
+        
+        if not _needs_llm(local_result, mode, self.hybrid_confidence_threshold):
+            return local_result
+        
+        # 信頼度が低い場合はLLM分析で上書きし、ローカルのみの指標は残す
+        llm_result = await self._analyze_semantic_consistency(window)
         return {
-            "type_diversity": len(type_counts) / max(len(type_counts), 1),
-            "avg_priority": statistics.mean(priorities),
-            "priority_std": statistics.stdev(priorities) if len(priorities) > 1 else 0,
-            "time_span_hours": time_span / 3600,
-            "system_ratio": type_counts.get("system", 0) / total_elements,
-            "user_ratio": type_counts.get("user", 0) / total_elements,
-            "assistant_ratio": type_counts.get("assistant", 0) / total_elements
+            "metrics": {**local_result["metrics"], **llm_result["metrics"]},
+            "insights": llm_result["insights"]
         }
     
     async def _analyze_semantic_consistency(self, window: ContextWindow) -> Dict[str, Any]:
-        """意味的一貫性分析"""
+        """意味的一貫性分析（プロンプト上限を超える場合はチャンク分割してmap-reduce）"""
         if not window.elements:
             return {"metrics": {}, "insights": []}
         
+        chunks = self._chunk_elements(window.elements)
+        if len(chunks) == 1:
+            return await self._analyze_semantic_chunk(chunks[0])
+        
+        # map: チャンクごとに並行分析
+        semaphore = asyncio.Semaphore(self.chunk_concurrency)
+        
+        async def analyze_chunk(segments: List[Tuple[str, str]]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._analyze_semantic_chunk(segments, summarize=True)
+        
+        chunk_results = await asyncio.gather(*(analyze_chunk(chunk) for chunk in chunks))
+        
+        # トークン数で重み付けしてメトリクスを統合
+        weights = [
+            sum(estimate_prompt_tokens(content) for _, content in chunk)
+            for chunk in chunks
+        ]
+        total_weight = sum(weights) or 1.0
+        metrics = {
+            metric: sum(
+                weight * _metric_value(result, metric, 0.5)
+                for weight, result in zip(weights, chunk_results)
+            ) / total_weight
+            for metric in SEMANTIC_METRICS
+        }
+        metrics["semantic_chunks"] = len(chunks)
+        
+        # reduce: チャンク要約からチャンク間の一貫性を評価
+        summaries = [str(result.get("summary", ""))[:300] for result in chunk_results]
+        reduced = await self._reduce_semantic_chunks(summaries)
+        
+        insights = []
+        if reduced:
+            cross_consistency = _metric_value(reduced, "cross_chunk_consistency", metrics["topic_consistency"])
+            cross_flow = _metric_value(reduced, "cross_chunk_flow", metrics["logical_flow"])
+            metrics["cross_chunk_consistency"] = cross_consistency
+            metrics["cross_chunk_flow"] = cross_flow
+            metrics["topic_consistency"] = (metrics["topic_consistency"] + cross_consistency) / 2
+            metrics["logical_flow"] = (metrics["logical_flow"] + cross_flow) / 2
+            insights.extend(_insights(reduced))
+        
+        for result in chunk_results:
+            for insight in _insights(result):
+                if insight not in insights:
+                    insights.append(insight)
+        
+        return {"metrics": metrics, "insights": insights[:10]}
+    
+    def _chunk_elements(self, elements: List[ContextElement]) -> List[List[Tuple[str, str]]]:
+        """要素境界でトークン予算内のチャンクに分割（予算を超える単一要素は文字数で分割）"""
+        budget = max(self.max_prompt_tokens - SEMANTIC_PROMPT_OVERHEAD_TOKENS, 1)
+        slice_chars = max(int(budget * 1.5), 1)
+        
+        chunks: List[List[Tuple[str, str]]] = []
+        current: List[Tuple[str, str]] = []
+        current_tokens = 0.0
+        
+        for elem in elements:
+            content = elem.content
+            parts = [content] if estimate_prompt_tokens(content) <= budget else [
+                content[i:i + slice_chars] for i in range(0, len(content), slice_chars)
+            ]
+            
+            for part in parts:
+                part_tokens = estimate_prompt_tokens(part)
+                if current and current_tokens + part_tokens > budget:
+                    chunks.append(current)
+                    current, current_tokens = [], 0.0
+                current.append((elem.type.value, part))
+                current_tokens += part_tokens
+        
+        if current:
+            chunks.append(current)
+        return chunks
+    
+    async def _analyze_semantic_chunk(self,
+                                      segments: List[Tuple[str, str]],
+                                      summarize: bool = False) -> Dict[str, Any]:
+        """単一チャンク（またはウィンドウ全体）の意味的一貫性分析"""
         try:
             # コンテキスト要素をテキストとして結合
             context_text = "\n\n".join([
-                f"[{elem.type.value}] {elem.content}" 
-                for elem in window.elements
+                f"[{element_type}] {content}" 
+                for element_type, content in segments
             ])
             
+            summary_field = ''',
+                "summary": "このチャンクの内容の要約（1-2文）"''' if summarize else ""
+            
             prompt = f"""
             以下のコンテキストの意味的一貫性を分析してください:
 
@@ -144,13 +396,21 @@ class ContextAnalyzer:
                 "insights": [
                     "主要テーマは...",
                     "改善点は..."
-                ]
+                ]{summary_field}
             }}
             """
             
-            response = self.model.generate_content(prompt)
-            result = json.loads(response.text)
+            response = await self.model.generate_content_async(prompt)
+            record_llm_call(len(prompt), len(response.text))
+            raw = json.loads(response.text)
             
+            # 不正な応答・値は中立値（0.5）として扱う
+            result = {
+                "metrics": {metric: _metric_value(raw, metric, 0.5) for metric in SEMANTIC_METRICS},
+                "insights": _insights(raw)
+            }
+            if summarize and isinstance(raw, dict):
+                result["summary"] = str(raw.get("summary", ""))
             return result
             
         except Exception as e:
@@ -166,46 +426,40 @@ class ContextAnalyzer:
                 "insights": [f"分析エラー: {str(e)}"]
             }
     
-    def _analyze_token_efficiency(self, window: ContextWindow) -> Dict[str, float]:
-        """トークン効率性分析"""
-        if not window.elements:
-            return {}
-        
-        # 情報密度計算
-        total_chars = sum(len(elem.content) for elem in window.elements)
-        total_words = sum(len(elem.content.split()) for elem in window.elements)
-        
-        # 冗長性分析
-        redundancy_score = self._calculate_redundancy(window)
-        
-        return {
-            "chars_per_token": total_chars / max(window.current_tokens, 1),
-            "words_per_token": total_words / max(window.current_tokens, 1),
-            "information_density": total_words / max(total_chars, 1),
-            "redundancy_score": redundancy_score,
-            "efficiency_score": 1.0 - redundancy_score
-        }
-    
-    def _calculate_redundancy(self, window: ContextWindow) -> float:
-        """冗長性計算"""
-        if len(window.elements) < 2:
-            return 0.0
-        
-        contents = [elem.content.lower() for elem in window.elements]
-        
-        # 単語レベルでの重複計算
-        all_words = []
-        for content in contents:
-            words = re.findall(r'\w+', content)
-            all_words.extend(words)
-        
-        if not all_words:
-            return 0.0
-        
-        word_counts = Counter(all_words)
-        duplicate_words = sum(count - 1 for count in word_counts.values() if count > 1)
-        
-        return duplicate_words / len(all_words)
+    async def _reduce_semantic_chunks(self, summaries: List[str]) -> Optional[Dict[str, Any]]:
+        """チャンク要約間の一貫性・流れを評価"""
+        try:
+            summaries_text = "\n".join(
+                f"{i + 1}. {summary}" for i, summary in enumerate(summaries)
+            )
+            
+            prompt = f"""
+            以下は長いコンテキストを順番に分割した各チャンクの要約です:
+
+            {summaries_text}
+
+            チャンク間の話題の一貫性（0-1）と、チャンクの並びの論理的流れ（0-1）を評価してください。
+
+            JSON形式で回答してください:
+            {{
+                "metrics": {{
+                    "cross_chunk_consistency": 0.8,
+                    "cross_chunk_flow": 0.7
+                }},
+                "insights": ["全体を通した洞察"]
+            }}
+            """
+            
+            response = await self.model.generate_content_async(prompt)
+            record_llm_call(len(prompt), len(response.text))
+            result = json.loads(response.text)
+            if not isinstance(result, dict) or not isinstance(result.get("metrics"), dict):
+                raise ValueError("reduce response has no metrics")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Semantic reduce failed: {str(e)}")
+            return None
     
     async def _assess_quality(self, window: ContextWindow, metrics: Dict[str, float]) -> Dict[str, Any]:
         """品質評価"""
@@ -271,19 +525,26 @@ class ContextAnalyzer:
 class MultimodalAnalyzer:
     """マルチモーダルコンテキスト分析"""
     
-    def __init__(self, gemini_api_key: str):
+    def __init__(self, gemini_api_key: str, hybrid_confidence_threshold: float = 0.6):
         genai.configure(api_key=gemini_api_key)
         self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.local_scorer = LocalContextScorer()
+        self.hybrid_confidence_threshold = hybrid_confidence_threshold
+        self.profile_registry = ProfileRegistry()
     
-    async def analyze_multimodal_context(self, context: MultimodalContext) -> ContextAnalysis:
+    async def analyze_multimodal_context(self, context: MultimodalContext, mode: str = "llm") -> ContextAnalysis:
         """マルチモーダルコンテキストの分析"""
+        validate_analysis_mode(mode)
         
         analysis = ContextAnalysis(
             context_id=context.id,
             analysis_type="multimodal"
         )
+        profiler = AnalysisProfiler()
         
         # 基本メトリクス
+        with profiler.stage("basic_metrics"):
+            modality_diversity = self._calculate_modality_diversity(context)
         analysis.metrics.update({
             "text_token_estimate": len(context.text_content.split()) * 1.3,
             "image_count": len(context.image_urls),
@@ -291,12 +552,13 @@ class MultimodalAnalyzer:
             "video_count": len(context.video_urls),
             "document_count": len(context.document_urls),
             "total_token_estimate": context.total_token_estimate,
-            "modality_diversity": self._calculate_modality_diversity(context)
+            "modality_diversity": modality_diversity
         })
         
         # モダリティ間の整合性分析
         if context.text_content and context.extracted_content:
-            consistency_score = await self._analyze_cross_modal_consistency(context)
+            with profiler.stage("cross_modal"):
+                consistency_score = await self._cross_modal_consistency(context, mode, analysis)
             analysis.metrics["cross_modal_consistency"] = consistency_score
         
         # 推奨事項
@@ -306,8 +568,29 @@ class MultimodalAnalyzer:
         if context.total_token_estimate > 8000:
             analysis.recommendations.append("総トークン数が多すぎます。コンテンツを圧縮してください")
         
+        analysis.profile = profiler.to_dict()
+        analysis.profile["mode"] = mode
+        self.profile_registry.record(analysis.profile)
+        
         return analysis
     
+    async def _cross_modal_consistency(self,
+                                       context: MultimodalContext,
+                                       mode: str,
+                                       analysis: ContextAnalysis) -> float:
+        """分析モードに応じたモダリティ間整合性の算出"""
+        if mode == "llm":
+            return await self._analyze_cross_modal_consistency(context)
+        
+        local_result = self.local_scorer.score_cross_modal(
+            context.text_content, list(context.extracted_content.values())
+        )
+        analysis.metrics["local_confidence"] = local_result["confidence"]
+        
+        if _needs_llm(local_result, mode, self.hybrid_confidence_threshold):
+            return await self._analyze_cross_modal_consistency(context)
+        return local_result["metrics"]["cross_modal_consistency"]
+    
     def _calculate_modality_diversity(self, context: MultimodalContext) -> float:
         """モダリティの多様性計算"""
         modalities = []
@@ -341,7 +624,8 @@ class MultimodalAnalyzer:
             数値のみで回答してください。
             """
             
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(prompt)
+            record_llm_call(len(prompt), len(response.text))
             score = float(response.text.strip())
             return max(0.0, min(1.0, score))  # 0-1に正規化
             
@@ -352,41 +636,77 @@ class MultimodalAnalyzer:
 class RAGAnalyzer:
     """RAGコンテキスト分析"""
     
-    def __init__(self, gemini_api_key: str):
+    def __init__(self, gemini_api_key: str, hybrid_confidence_threshold: float = 0.6):
         genai.configure(api_key=gemini_api_key)
         self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.local_scorer = LocalContextScorer()
+        self.hybrid_confidence_threshold = hybrid_confidence_threshold
+        self.profile_registry = ProfileRegistry()
     
-    async def analyze_rag_context(self, rag_context: RAGContext) -> ContextAnalysis:
+    async def analyze_rag_context(self, rag_context: RAGContext, mode: str = "llm") -> ContextAnalysis:
         """RAGコンテキストの分析"""
+        validate_analysis_mode(mode)
         
         analysis = ContextAnalysis(
             context_id=rag_context.id,
             analysis_type="rag"
         )
+        profiler = AnalysisProfiler()
         
         # 基本メトリクス
-        analysis.metrics.update({
-            "retrieved_documents_count": len(rag_context.retrieved_documents),
-            "avg_similarity_score": statistics.mean(rag_context.similarity_scores) if rag_context.similarity_scores else 0,
-            "max_similarity_score": max(rag_context.similarity_scores) if rag_context.similarity_scores else 0,
-            "min_similarity_score": min(rag_context.similarity_scores) if rag_context.similarity_scores else 0,
-            "similarity_variance": statistics.variance(rag_context.similarity_scores) if len(rag_context.similarity_scores) > 1 else 0
-        })
+        with profiler.stage("basic_metrics"):
+            analysis.metrics.update({
+                "retrieved_documents_count": len(rag_context.retrieved_documents),
+                "avg_similarity_score": statistics.mean(rag_context.similarity_scores) if rag_context.similarity_scores else 0,
+                "max_similarity_score": max(rag_context.similarity_scores) if rag_context.similarity_scores else 0,
+                "min_similarity_score": min(rag_context.similarity_scores) if rag_context.similarity_scores else 0,
+                "similarity_variance": statistics.variance(rag_context.similarity_scores) if len(rag_context.similarity_scores) > 1 else 0
+            })
         
         # 関連性分析
         if rag_context.retrieved_documents:
-            relevance_analysis = await self._analyze_retrieval_relevance(rag_context)
+            with profiler.stage("relevance"):
+                relevance_analysis = await self._analyze_relevance(rag_context, mode)
             analysis.metrics.update(relevance_analysis["metrics"])
             analysis.insights.extend(relevance_analysis["insights"])
         
         # 多様性分析
-        diversity_score = self._calculate_retrieval_diversity(rag_context)
+        with profiler.stage("diversity"):
+            diversity_score = self._calculate_retrieval_diversity(rag_context)
         analysis.metrics["retrieval_diversity"] = diversity_score
         
+        analysis.profile = profiler.to_dict()
+        analysis.profile["mode"] = mode
+        self.profile_registry.record(analysis.profile)
+        
         return analysis
     
-    async def _analyze_retrieval_relevance(self, rag_context: RAGContext) -> Dict[str, Any]:
-        """検索結果の関連性分析"""
+    async def _analyze_relevance(self, rag_context: RAGContext, mode: str) -> Dict[str, Any]:
+        """分析モードに応じた関連性メトリクスの算出"""
+        if mode == "llm":
+            return await self._analyze_retrieval_relevance(rag_context)
+        
+        local_result = self.local_scorer.score_query_documents(
+            rag_context.query,
+            [doc.get('content', str(doc)) for doc in rag_context.retrieved_documents]
+        )
+        local_result["metrics"]["local_confidence"] = local_result["confidence"]
+        
+        if not _needs_llm(local_result, mode, self.hybrid_confidence_threshold):
+            return local_result
+        
+        # LLMの応答が不正な場合はローカル推定の値を使う
+        llm_result = await self._analyze_retrieval_relevance(rag_context, local_result["metrics"])
+        return {
+            "metrics": {**local_result["metrics"], **llm_result["metrics"]},
+            "insights": llm_result["insights"] or local_result["insights"]
+        }
+    
+    async def _analyze_retrieval_relevance(self,
+                                           rag_context: RAGContext,
+                                           defaults: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """検索結果の関連性分析（不正な応答・値は defaults、未指定なら中立値 0.5）"""
+        defaults = {metric: (defaults or {}).get(metric, 0.5) for metric in RETRIEVAL_METRICS}
         try:
             documents_text = "\n\n".join([
                 f"Document {i+1}: {doc.get('content', str(doc))[:200]}..."
@@ -415,17 +735,18 @@ class RAGAnalyzer:
             }}
             """
             
-            response = self.model.generate_content(prompt)
-            return json.loads(response.text)
+            response = await self.model.generate_content_async(prompt)
+            record_llm_call(len(prompt), len(response.text))
+            raw = json.loads(response.text)
+            return {
+                "metrics": {metric: _metric_value(raw, metric, defaults[metric]) for metric in RETRIEVAL_METRICS},
+                "insights": _insights(raw)
+            }
             
         except Exception as e:
             logger.error(f"RAG relevance analysis failed: {str(e)}")
             return {
-                "metrics": {
-                    "query_relevance": 0.5,
-                    "result_redundancy": 0.5,
-                    "coverage_completeness": 0.5
-                },
+                "metrics": defaults,
                 "insights": [f"分析エラー: {str(e)}"]
             }
     
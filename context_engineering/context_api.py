@@ -5,18 +5,27 @@ from typing import Dict, List, Any, Optional
 from datetime import datetime
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 import asyncio
 from contextlib import asynccontextmanager
 
 from context_models import (
     ContextWindow, ContextElement, ContextType, ContextSession,
-    PromptTemplate, PromptTemplateType, MultimodalContext, RAGContext
+    PromptTemplate, PromptTemplateType, MultimodalContext, RAGContext, CompactionPolicy,
+    OptimizationStatus, SessionBudget, MemoryPolicy
 )
-from context_analyzer import ContextAnalyzer, MultimodalAnalyzer, RAGAnalyzer
+from context_analyzer import ContextAnalyzer, MultimodalAnalyzer, RAGAnalyzer, ANALYSIS_MODES
 from template_manager import TemplateManager, ContextTemplateIntegrator
-from context_optimizer import ContextOptimizer
+from context_optimizer import ContextOptimizer, COMPRESS_MODES
+from context_compaction import WindowCompactor
+from context_budget import SessionBudgetAllocator, EVICTION_STRATEGIES
+from context_memory import SummaryMemory, SUMMARIZE_MODES
+from context_scheduler import OptimizationScheduler, TaskStore, PRIORITY_CLASSES
+from context_events import ProgressEventBus
+from context_task_registry import ArchivedTask
+from context_profiler import AnalysisProfiler
+from context_timeseries import QualityTimeSeriesStore
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,6 +43,28 @@ class ContextWindowRequest(BaseModel):
     max_tokens: int = 8192
     reserved_tokens: int = 512
 
+class CompactionPolicyRequest(BaseModel):
+    enabled: bool = True
+    high_water: float = 0.85
+    low_water: float = 0.7
+    compress_mode: str = "local"
+    evict_on_add: bool = True
+    preserve_element_types: List[str] = ["system"]
+
+class MemoryPolicyRequest(BaseModel):
+    enabled: bool = True
+    working_set: int = 12
+    chunk_size: int = 6
+    fan_in: int = 4
+    summarize_mode: str = "llm"
+
+class SessionBudgetRequest(BaseModel):
+    enabled: bool = True
+    total_tokens: int = 32768
+    weights: Dict[str, float] = {}
+    eviction: str = "priority"
+    preserve_element_types: List[str] = ["system"]
+
 class TemplateRequest(BaseModel):
     name: str
     description: str
@@ -46,9 +77,19 @@ class TemplateRenderRequest(BaseModel):
     template_id: str
     variables: Dict[str, Any]
 
+class BatchAnalysisRequest(BaseModel):
+    window_ids: List[str] = []
+    session_id: Optional[str] = None
+    min_elements: int = 0
+    min_utilization: float = 0.0
+    concurrency: int = 4
+    mode: str = "llm"
+
 class OptimizationRequest(BaseModel):
     goals: List[str]
     constraints: Dict[str, Any] = {}
+    priority: str = "normal"
+    timeout_seconds: Optional[float] = None
 
 class MultimodalContextRequest(BaseModel):
     text_content: str = ""
@@ -90,15 +131,21 @@ class WebSocketManager:
 # グローバル変数
 sessions_storage: Dict[str, ContextSession] = {}
 websocket_manager = WebSocketManager()
+quality_store = QualityTimeSeriesStore()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # アプリケーション起動時
     logger.info("Context Engineering API Server starting...")
     await initialize_components()
+    await context_optimizer.events.start()
+    await context_optimizer.scheduler.start()
     yield
     # アプリケーション終了時
     logger.info("Context Engineering API Server shutting down...")
+    await context_optimizer.scheduler.stop()
+    await context_optimizer.events.stop()
+    context_analyzer.close()
 
 app = FastAPI(
     title="Context Engineering API",
@@ -110,7 +157,8 @@ app = FastAPI(
 # コンポーネント初期化
 async def initialize_components():
     global context_analyzer, template_manager, context_optimizer
-    global multimodal_analyzer, rag_analyzer, template_integrator
+    global multimodal_analyzer, rag_analyzer, template_integrator, window_compactor, budget_allocator
+    global summary_memory
     
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     if not gemini_api_key:
@@ -119,6 +167,18 @@ async def initialize_components():
     context_analyzer = ContextAnalyzer(gemini_api_key)
     template_manager = TemplateManager(gemini_api_key)
     context_optimizer = ContextOptimizer(gemini_api_key)
+    context_optimizer.scheduler = OptimizationScheduler(
+        context_optimizer,
+        TaskStore(os.getenv("OPTIMIZATION_TASK_DB", "optimization_tasks.db")),
+        find_window_by_id,
+        max_workers=int(os.getenv("OPTIMIZATION_WORKERS", "4"))
+    )
+    # 最適化の進捗イベントをWebSocketへ配信（進捗は間隔ごとに間引く）
+    context_optimizer.events = ProgressEventBus(float(os.getenv("OPTIMIZATION_PROGRESS_INTERVAL", "0.5")))
+    context_optimizer.events.subscribe(websocket_manager.broadcast)
+    window_compactor = WindowCompactor(context_optimizer)
+    budget_allocator = SessionBudgetAllocator(context_optimizer)
+    summary_memory = SummaryMemory(context_optimizer)
     multimodal_analyzer = MultimodalAnalyzer(gemini_api_key)
     rag_analyzer = RAGAnalyzer(gemini_api_key)
     template_integrator = ContextTemplateIntegrator(template_manager)
@@ -262,10 +322,73 @@ async def get_session(session_id: str) -> Dict[str, Any]:
             for window in session.windows
         ],
         "active_window_id": session.active_window_id,
+        "token_budget": session.token_budget.to_dict() if session.token_budget else None,
         "created_at": session.created_at.isoformat(),
         "last_accessed": session.last_accessed.isoformat()
     }
 
+@app.post("/api/sessions/{session_id}/budget")
+async def set_session_budget(session_id: str, request: SessionBudgetRequest) -> Dict[str, Any]:
+    """セッションのウィンドウで共有するトークン予算を設定して配分（enabled=false で解除）"""
+    if session_id not in sessions_storage:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    session = sessions_storage[session_id]
+    if not request.enabled:
+        session.token_budget = None
+        return {"session_id": session_id, "budget": None}
+    
+    if request.eviction not in EVICTION_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Invalid eviction: {request.eviction}")
+    unknown = set(request.weights) - {window.id for window in session.windows}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown window ids in weights: {', '.join(sorted(unknown))}")
+    
+    try:
+        session.token_budget = SessionBudget(
+            total_tokens=request.total_tokens,
+            weights=request.weights,
+            eviction=request.eviction,
+            preserve_element_types=request.preserve_element_types
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return await rebalance_session_budget(session_id)
+
+@app.get("/api/sessions/{session_id}/budget")
+async def get_session_budget(session_id: str) -> Dict[str, Any]:
+    """現在のトークン予算の配分"""
+    if session_id not in sessions_storage:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    session = sessions_storage[session_id]
+    if session.token_budget is None:
+        raise HTTPException(status_code=404, detail="Session has no token budget")
+    return budget_allocator.describe(session)
+
+@app.post("/api/sessions/{session_id}/budget/rebalance")
+async def rebalance_session_budget(session_id: str) -> Dict[str, Any]:
+    """全ウィンドウの需要を計算し直して再配分（配分を超えたウィンドウは削減）"""
+    if session_id not in sessions_storage:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    session = sessions_storage[session_id]
+    if session.token_budget is None:
+        raise HTTPException(status_code=404, detail="Session has no token budget")
+    
+    allocation = await budget_allocator.rebalance(session)
+    if allocation is None:
+        return budget_allocator.describe(session)
+    
+    await websocket_manager.broadcast({
+        "type": "budget_rebalanced",
+        "session_id": session_id,
+        "allocated_tokens": allocation["allocated_tokens"],
+        "trimmed_windows": [entry["window_id"] for entry in allocation["trimmed"]]
+    })
+    return allocation
+
 # コンテキストウィンドウ管理
 @app.post("/api/sessions/{session_id}/windows")
 async def create_context_window(session_id: str, request: ContextWindowRequest) -> Dict[str, Any]:
@@ -276,6 +399,8 @@ async def create_context_window(session_id: str, request: ContextWindowRequest)
     session = sessions_storage[session_id]
     window = session.create_window(request.max_tokens)
     window.reserved_tokens = request.reserved_tokens
+    # 予算を設定したセッションでは max_tokens は配分で決まる
+    await budget_allocator.rebalance(session, [window])
     
     await websocket_manager.broadcast({
         "type": "window_created",
@@ -307,8 +432,22 @@ async def add_context_element(window_id: str, request: ContextElementRequest) ->
         priority=request.priority
     )
     
+    # 上限を超える場合は、セッション予算の再配分、コンパクションポリシーによるローカルの削減の順に空きを作る
+    session = find_session_by_window_id(window_id)
+    eviction = None
     if not window.add_element(element):
-        raise HTTPException(status_code=400, detail="Cannot add element: token limit exceeded")
+        if session and session.token_budget:
+            await budget_allocator.rebalance(session, [window], pending={window.id: element.token_count})
+        if not window.add_element(element):
+            eviction = await window_compactor.make_room(window, element)
+            if eviction is None or not window.add_element(element):
+                raise HTTPException(status_code=400, detail="Cannot add element: token limit exceeded")
+    if session and session.token_budget:
+        await budget_allocator.rebalance(session, [window])
+    
+    compaction_task = await window_compactor.maybe_compact(window, session.id if session else None)
+    # 作業セットからあふれた古いターンを要約へ畳み込む
+    summary_memory.schedule(window)
     
     await websocket_manager.broadcast({
         "type": "element_added",
@@ -317,11 +456,19 @@ async def add_context_element(window_id: str, request: ContextElementRequest) ->
         "current_tokens": window.current_tokens
     })
     
-    return {
+    response = {
         "element_id": element.id,
         "current_tokens": window.current_tokens,
         "utilization_ratio": window.utilization_ratio
     }
+    if eviction is not None:
+        response["eviction"] = {
+            "tokens_freed": eviction["original_tokens"] - eviction["final_tokens"],
+            "actions": eviction["actions"]
+        }
+    if compaction_task is not None:
+        response["compaction_task_id"] = compaction_task.id
+    return response
 
 @app.get("/api/contexts/{window_id}")
 async def get_context_window(window_id: str) -> Dict[str, Any]:
@@ -339,19 +486,207 @@ async def get_context_window(window_id: str) -> Dict[str, Any]:
         "reserved_tokens": window.reserved_tokens,
         "elements": [element.to_dict() for element in window.elements],
         "quality_metrics": window.quality_metrics,
+        "compaction_policy": window.compaction_policy.to_dict() if window.compaction_policy else None,
+        "memory_policy": window.memory_policy.to_dict() if window.memory_policy else None,
+        "optimization_history": window.optimization_history,
         "created_at": window.created_at.isoformat()
     }
 
+@app.post("/api/contexts/{window_id}/prompt")
+async def assemble_context_prompt(window_id: str) -> Dict[str, Any]:
+    """現在の順序でプロンプトを組み立て、安定した接頭辞のトークン数と指紋を返す
+    
+    組み立てた要素は次回以降、内容が変わらない限り ordering_mode=prefix_stable の並び替えで先頭に固定される。
+    """
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    return context_optimizer.prefix_tracker.assemble(window)
+
+@app.post("/api/contexts/{window_id}/snapshots")
+async def create_context_snapshot(window_id: str) -> Dict[str, Any]:
+    """現在のウィンドウのスナップショットを作成"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    return context_optimizer.snapshots.take(window).to_dict()
+
+@app.get("/api/contexts/{window_id}/snapshots")
+async def list_context_snapshots(window_id: str) -> Dict[str, Any]:
+    """ウィンドウのスナップショット一覧（新しい順。最適化タスクの実行前に自動で作成される）"""
+    if not find_window_by_id(window_id):
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    return {
+        "window_id": window_id,
+        "snapshots": [snapshot.to_dict() for snapshot in context_optimizer.snapshots.list(window_id)]
+    }
+
+@app.get("/api/contexts/{window_id}/snapshots/{snapshot_id}/diff")
+async def diff_context_snapshot(window_id: str, snapshot_id: str, against: Optional[str] = None) -> Dict[str, Any]:
+    """スナップショットから現在のウィンドウ（against 指定時は別のスナップショット）への差分"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    snapshots = context_optimizer.snapshots
+    snapshot = snapshots.get(window_id, snapshot_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    
+    other = None
+    if against is not None:
+        other = snapshots.get(window_id, against)
+        if other is None:
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+    
+    return {
+        "snapshot_id": snapshot_id,
+        "against": against or "current",
+        **snapshots.diff(snapshot, other, window)
+    }
+
+@app.post("/api/contexts/{window_id}/snapshots/{snapshot_id}/restore")
+async def restore_context_snapshot(window_id: str, snapshot_id: str, restore_limits: bool = False) -> Dict[str, Any]:
+    """ウィンドウをスナップショットの状態に戻す（戻す前の状態はスナップショットとして残る。restore_limits で上限も戻す）"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    running = [
+        task for task in context_optimizer.list_optimization_tasks(window_id)
+        if task.status == OptimizationStatus.IN_PROGRESS
+    ]
+    if running:
+        raise HTTPException(status_code=409, detail=f"Optimization task {running[0].id} is running on this window")
+    
+    try:
+        before, diff = context_optimizer.snapshots.restore(window, snapshot_id, restore_limits)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    
+    await websocket_manager.broadcast({
+        "type": "snapshot_restored",
+        "window_id": window_id,
+        "snapshot_id": snapshot_id,
+        "current_tokens": window.current_tokens
+    })
+    
+    return {
+        "window_id": window_id,
+        "restored_snapshot_id": snapshot_id,
+        "undo_snapshot_id": before.id,
+        "current_tokens": window.current_tokens,
+        "diff": diff
+    }
+
+@app.post("/api/contexts/{window_id}/compaction-policy")
+async def set_compaction_policy(window_id: str, request: CompactionPolicyRequest) -> Dict[str, Any]:
+    """自動コンパクションのポリシーを設定（enabled=false で解除）"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    if not request.enabled:
+        window.compaction_policy = None
+        return await get_compaction_policy(window_id)
+    
+    if request.compress_mode not in COMPRESS_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid compress_mode: {request.compress_mode}")
+    
+    try:
+        window.compaction_policy = CompactionPolicy(
+            high_water=request.high_water,
+            low_water=request.low_water,
+            compress_mode=request.compress_mode,
+            evict_on_add=request.evict_on_add,
+            preserve_element_types=request.preserve_element_types
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 既に high_water を超えていればすぐに削減を始める
+    session = find_session_by_window_id(window_id)
+    await window_compactor.maybe_compact(window, session.id if session else None)
+    return await get_compaction_policy(window_id)
+
+@app.get("/api/contexts/{window_id}/compaction-policy")
+async def get_compaction_policy(window_id: str) -> Dict[str, Any]:
+    """自動コンパクションのポリシーと実行中のバックグラウンド削減"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    job = window_compactor.running_job(window_id)
+    return {
+        "window_id": window_id,
+        "compaction_policy": window.compaction_policy.to_dict() if window.compaction_policy else None,
+        "budget_utilization": window.current_tokens / max(window.token_budget, 1),
+        "compaction_task_id": job.id if job else None
+    }
+
+@app.post("/api/contexts/{window_id}/memory-policy")
+async def set_memory_policy(window_id: str, request: MemoryPolicyRequest) -> Dict[str, Any]:
+    """階層要約メモリのポリシーを設定（enabled=false で解除。既存の要約はそのまま残す）"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    if not request.enabled:
+        window.memory_policy = None
+        return summary_memory.describe(window)
+    
+    if request.summarize_mode not in SUMMARIZE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid summarize_mode: {request.summarize_mode}")
+    
+    try:
+        window.memory_policy = MemoryPolicy(
+            working_set=request.working_set,
+            chunk_size=request.chunk_size,
+            fan_in=request.fan_in,
+            summarize_mode=request.summarize_mode
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 既にあふれているターンをすぐに畳み込む
+    return await summary_memory.fold(window)
+
+@app.get("/api/contexts/{window_id}/memory")
+async def get_memory(window_id: str) -> Dict[str, Any]:
+    """要約の階層と作業セット"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    return summary_memory.describe(window)
+
+@app.post("/api/contexts/{window_id}/memory/fold")
+async def fold_memory(window_id: str) -> Dict[str, Any]:
+    """あふれたターンと要約をすぐに畳み込む"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    if window.memory_policy is None:
+        raise HTTPException(status_code=400, detail="Memory policy is not set for this window")
+    
+    return await summary_memory.fold(window)
+
 # コンテキスト分析
 @app.post("/api/contexts/{window_id}/analyze")
-async def analyze_context(window_id: str) -> Dict[str, Any]:
-    """コンテキスト分析を実行"""
+async def analyze_context(window_id: str, mode: str = "llm") -> Dict[str, Any]:
+    """コンテキスト分析を実行（mode: fast | llm | hybrid）"""
     window = find_window_by_id(window_id)
     if not window:
         raise HTTPException(status_code=404, detail="Context window not found")
+    if mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(ANALYSIS_MODES)}")
     
     try:
-        analysis = await context_analyzer.analyze_context_window(window)
+        analysis = await context_analyzer.analyze_context_window(window, mode)
+        quality_store.record(window, analysis)
         
         await websocket_manager.broadcast({
             "type": "analysis_completed",
@@ -359,12 +694,72 @@ async def analyze_context(window_id: str) -> Dict[str, Any]:
             "quality_score": analysis.quality_score
         })
         
-        return analysis.to_dict()
+        return serialize_analysis(analysis, context_analyzer.profile_registry)
         
     except Exception as e:
         logger.error(f"Context analysis failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/analysis/batch")
+async def batch_analyze_contexts(request: BatchAnalysisRequest) -> StreamingResponse:
+    """複数ウィンドウの一括分析（結果をNDJSONで完了順にストリーミング）"""
+    if request.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+    if request.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(ANALYSIS_MODES)}")
+    
+    windows = select_windows(request)
+    if request.window_ids:
+        found_ids = {window.id for window in windows}
+        missing = [window_id for window_id in request.window_ids if window_id not in found_ids]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Context windows not found: {', '.join(missing)}")
+    
+    windows_by_id = {window.id: window for window in windows}
+    
+    async def stream_results():
+        async for item in context_analyzer.analyze_context_windows(windows, request.concurrency, request.mode):
+            if item["type"] == "result":
+                analysis = item["analysis"]
+                quality_store.record(windows_by_id[item["window_id"]], analysis)
+                item = {**item, "analysis": serialize_analysis(analysis, context_analyzer.profile_registry)}
+            elif item["type"] == "summary":
+                await websocket_manager.broadcast({
+                    "type": "batch_analysis_completed",
+                    "total_windows": item["total_windows"],
+                    "windows_per_second": item["windows_per_second"]
+                })
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/api/contexts/{window_id}/quality")
+async def get_context_quality(window_id: str, limit: Optional[int] = None, since: Optional[datetime] = None) -> Dict[str, Any]:
+    """記録済みの品質メトリクス（最新値と履歴）を再分析なしで取得"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    series = quality_store.get(window_id)
+    if not series:
+        return {"window_id": window_id, "points": 0, "latest": None, "history": None}
+    
+    return {
+        "window_id": window_id,
+        "points": len(series),
+        "latest": series.latest(),
+        "history": series.history(since=since, limit=limit)
+    }
+
+@app.get("/api/analysis/profile")
+async def get_analysis_profile() -> Dict[str, Any]:
+    """分析ステージ別の所要時間・LLM呼び出し量のヒストグラムを取得"""
+    return {
+        "context": context_analyzer.profile_registry.to_dict(),
+        "multimodal": multimodal_analyzer.profile_registry.to_dict(),
+        "rag": rag_analyzer.profile_registry.to_dict()
+    }
+
 # テンプレート管理
 @app.post("/api/templates")
 async def create_template(request: TemplateRequest) -> Dict[str, Any]:
@@ -453,9 +848,19 @@ async def optimize_context(window_id: str, request: OptimizationRequest) -> Dict
     if not window:
         raise HTTPException(status_code=404, detail="Context window not found")
     
+    if request.priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Invalid priority: {request.priority}")
+    
+    if request.timeout_seconds is not None and request.timeout_seconds <= 0:
+        raise HTTPException(status_code=400, detail="timeout_seconds must be positive")
+    
     try:
+        session = find_session_by_window_id(window_id)
         task = await context_optimizer.optimize_context_window(
-            window, request.goals, request.constraints
+            window, request.goals, request.constraints,
+            session_id=session.id if session else None,
+            priority=request.priority,
+            timeout_seconds=request.timeout_seconds
         )
         
         await websocket_manager.broadcast({
@@ -467,6 +872,7 @@ async def optimize_context(window_id: str, request: OptimizationRequest) -> Dict
         return {
             "task_id": task.id,
             "status": task.status.value,
+            "priority": task.priority,
             "goals": request.goals
         }
         
@@ -474,6 +880,84 @@ async def optimize_context(window_id: str, request: OptimizationRequest) -> Dict
         logger.error(f"Context optimization failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/contexts/{window_id}/optimize/plan")
+async def plan_context_optimization(window_id: str, request: OptimizationRequest) -> Dict[str, Any]:
+    """最適化のドライラン（ウィンドウを変更せずにコストを見積もる）"""
+    window = find_window_by_id(window_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    if request.priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Invalid priority: {request.priority}")
+    
+    try:
+        session = find_session_by_window_id(window_id)
+        plan = context_optimizer.plan_optimization(
+            window, request.goals, request.constraints,
+            session_id=session.id if session else None,
+            priority=request.priority,
+            timeout_seconds=request.timeout_seconds
+        )
+        return plan.to_dict()
+        
+    except Exception as e:
+        logger.error(f"Optimization planning failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/optimization/plans/{plan_id}")
+async def get_optimization_plan(plan_id: str) -> Dict[str, Any]:
+    """最適化計画を取得"""
+    plan = context_optimizer.optimization_plans.get(plan_id)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Optimization plan not found")
+    
+    return plan.to_dict()
+
+@app.post("/api/optimization/plans/{plan_id}/execute")
+async def execute_optimization_plan(plan_id: str, force: bool = False) -> Dict[str, Any]:
+    """最適化計画を実行（計画後にウィンドウが変更された場合は force=true が必要）"""
+    plan = context_optimizer.optimization_plans.get(plan_id)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Optimization plan not found")
+    
+    window = find_window_by_id(plan.context_id)
+    if not window:
+        raise HTTPException(status_code=404, detail="Context window not found")
+    
+    if window.fingerprint != plan.window_fingerprint and not force:
+        raise HTTPException(status_code=409, detail="Context window changed since planning")
+    
+    try:
+        task = await context_optimizer.execute_plan(plan_id, window)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    await websocket_manager.broadcast({
+        "type": "optimization_started",
+        "window_id": plan.context_id,
+        "task_id": task.id
+    })
+    
+    return {
+        "plan_id": plan.id,
+        "task_id": task.id,
+        "status": task.status.value,
+        "priority": task.priority,
+        "goals": plan.goals
+    }
+
+@app.post("/api/optimization/plans/{plan_id}/reject")
+async def reject_optimization_plan(plan_id: str) -> Dict[str, Any]:
+    """最適化計画を却下"""
+    try:
+        plan = context_optimizer.reject_plan(plan_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Optimization plan not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return plan.to_dict()
+
 @app.post("/api/contexts/{window_id}/auto-optimize")
 async def auto_optimize_context(window_id: str) -> Dict[str, Any]:
     """コンテキストの自動最適化"""
@@ -482,7 +966,8 @@ async def auto_optimize_context(window_id: str) -> Dict[str, Any]:
         raise HTTPException(status_code=404, detail="Context window not found")
     
     try:
-        result = await context_optimizer.auto_optimize_context(window)
+        session = find_session_by_window_id(window_id)
+        result = await context_optimizer.auto_optimize_context(window, session.id if session else None)
         
         await websocket_manager.broadcast({
             "type": "auto_optimization_started",
@@ -501,19 +986,58 @@ async def get_optimization_task(task_id: str) -> Dict[str, Any]:
     """最適化タスクの状態を取得"""
     task = context_optimizer.get_optimization_task(task_id)
     if not task:
+        archived = context_optimizer.get_archived_optimization_task(task_id)
+        if archived:
+            return archived.to_dict()
         raise HTTPException(status_code=404, detail="Optimization task not found")
     
+    return serialize_task(task)
+
+@app.get("/api/contexts/{window_id}/optimizations")
+async def list_context_optimization_tasks(window_id: str, include_archived: bool = True) -> Dict[str, Any]:
+    """コンテキストウィンドウの最適化タスク履歴（新しい順）"""
+    tasks = context_optimizer.list_optimization_tasks(window_id, include_archived)
     return {
-        "id": task.id,
-        "context_id": task.context_id,
-        "optimization_type": task.optimization_type,
-        "status": task.status.value,
-        "progress": task.progress,
-        "result": task.result,
-        "error_message": task.error_message,
-        "created_at": task.created_at.isoformat(),
-        "started_at": task.started_at.isoformat() if task.started_at else None,
-        "completed_at": task.completed_at.isoformat() if task.completed_at else None
+        "window_id": window_id,
+        "tasks": [
+            task.to_dict() if isinstance(task, ArchivedTask) else serialize_task(task)
+            for task in tasks
+        ]
+    }
+
+@app.post("/api/optimization/{task_id}/cancel")
+async def cancel_optimization_task(task_id: str) -> Dict[str, Any]:
+    """待機中または実行中の最適化タスクをキャンセル"""
+    task = context_optimizer.get_optimization_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Optimization task not found")
+    
+    if not context_optimizer.scheduler.cancel(task_id):
+        raise HTTPException(status_code=409, detail=f"Optimization task already {task.status.value}")
+    
+    return serialize_task(task)
+
+@app.post("/api/optimization/{task_id}/timeout")
+async def set_optimization_task_timeout(task_id: str, seconds: float) -> Dict[str, Any]:
+    """最適化タスクのタイムアウト（開始からの秒数）を設定"""
+    task = context_optimizer.get_optimization_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Optimization task not found")
+    
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds must be positive")
+    
+    if not context_optimizer.scheduler.set_timeout(task_id, seconds):
+        raise HTTPException(status_code=409, detail=f"Optimization task already {task.status.value}")
+    
+    return serialize_task(task)
+
+@app.get("/api/optimization/scheduler/stats")
+async def get_optimization_scheduler_stats() -> Dict[str, Any]:
+    """最適化スケジューラの状態（実行中・優先度別の待機数）"""
+    return {
+        **context_optimizer.scheduler.get_stats(),
+        "events": context_optimizer.events.get_stats()
     }
 
 # マルチモーダル機能
@@ -597,7 +1121,12 @@ async def get_stats() -> Dict[str, Any]:
             "avg_elements_per_window": total_elements / max(total_windows, 1)
         },
         "templates": template_stats,
-        "optimization_tasks": len(context_optimizer.optimization_tasks)
+        "optimization_tasks": context_optimizer.optimization_tasks.get_stats(),
+        "rewrite_cache": context_optimizer.rewrite_cache.get_stats(),
+        "compaction": window_compactor.get_stats(),
+        "snapshots": context_optimizer.snapshots.get_stats(),
+        "session_budgets": budget_allocator.get_stats(),
+        "memory": summary_memory.get_stats()
     }
 
 # ヘルパー関数
@@ -609,6 +1138,66 @@ def find_window_by_id(window_id: str) -> Optional[ContextWindow]:
                 return window
     return None
 
+def find_session_by_window_id(window_id: str) -> Optional[ContextSession]:
+    """ウィンドウIDから所属セッションを検索"""
+    for session in sessions_storage.values():
+        if any(window.id == window_id for window in session.windows):
+            return session
+    return None
+
+def serialize_task(task) -> Dict[str, Any]:
+    """最適化タスクをシリアライズ"""
+    return {
+        "id": task.id,
+        "context_id": task.context_id,
+        "session_id": task.session_id,
+        "optimization_type": task.optimization_type,
+        "priority": task.priority,
+        "timeout_seconds": task.timeout_seconds,
+        "status": task.status.value,
+        "progress": task.progress,
+        "result": task.result,
+        "error_message": task.error_message,
+        "created_at": task.created_at.isoformat(),
+        "started_at": task.started_at.isoformat() if task.started_at else None,
+        "completed_at": task.completed_at.isoformat() if task.completed_at else None
+    }
+
+def serialize_analysis(analysis, profile_registry) -> Dict[str, Any]:
+    """分析結果をシリアライズし、シリアライズ時間もプロファイルに記録"""
+    profiler = AnalysisProfiler()
+    with profiler.stage("serialization") as stage:
+        result = analysis.to_dict()
+    
+    result["profile"] = {**result["profile"], "stages": result["profile"].get("stages", []) + [stage]}
+    profile_registry.record_stage(stage)
+    return result
+
+def select_windows(request: BatchAnalysisRequest) -> List[ContextWindow]:
+    """一括分析の対象ウィンドウをIDまたはフィルタ条件で選択"""
+    if request.window_ids:
+        windows = []
+        for window_id in dict.fromkeys(request.window_ids):
+            window = find_window_by_id(window_id)
+            if window:
+                windows.append(window)
+        return windows
+    
+    if request.session_id:
+        if request.session_id not in sessions_storage:
+            raise HTTPException(status_code=404, detail="Session not found")
+        sessions = [sessions_storage[request.session_id]]
+    else:
+        sessions = list(sessions_storage.values())
+    
+    return [
+        window
+        for session in sessions
+        for window in session.windows
+        if len(window.elements) >= request.min_elements
+        and window.utilization_ratio >= request.min_utilization
+    ]
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=9001)
\ No newline at end of file
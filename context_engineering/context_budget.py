@@ -0,0 +1,167 @@
+import logging
+import math
+from typing import Dict, List, Any, Optional
+
+from context_models import ContextSession, ContextWindow, SessionBudget
+
+logger = logging.getLogger(__name__)
+
+# 予算を超えたウィンドウの削減方式: priority（低優先度の要素から削除）, local（LLMを使わない削減計画）
+EVICTION_STRATEGIES = ("priority", "local")
+
+def water_fill(total: float, demands: Dict[str, float], weights: Dict[str, float]) -> Dict[str, float]:
+    """重み付きの水位合わせによる配分
+
+    重みあたりの需要が小さいウィンドウから順に、需要か重みに比例した公平な取り分の小さい方を割り当てる
+    （需要を満たしたウィンドウの余りは残りのウィンドウで分ける）。全需要を満たして余った分は
+    重みに比例して上乗せし、各ウィンドウが増える余地にする。
+    """
+    allocation: Dict[str, float] = {}
+    remaining = float(total)
+    remaining_weight = sum(weights[key] for key in demands)
+    order = sorted(demands, key=lambda key: demands[key] / weights[key])
+    for position, key in enumerate(order):
+        fair_share = remaining * weights[key] / remaining_weight
+        if demands[key] > fair_share:
+            # 以降のウィンドウはすべて公平な取り分を超える需要を持つ
+            for rest in order[position:]:
+                allocation[rest] = remaining * weights[rest] / remaining_weight
+            return allocation
+        allocation[key] = demands[key]
+        remaining -= demands[key]
+        remaining_weight -= weights[key]
+
+    total_weight = sum(weights[key] for key in demands)
+    for key in demands:
+        allocation[key] += remaining * weights[key] / total_weight
+    return allocation
+
+class SessionBudgetAllocator:
+    """セッションのトークン予算をウィンドウに配分し、各ウィンドウの max_tokens に反映
+
+    ウィンドウの需要（現在のトークン数 + レスポンス用予約）はセッションごとに保持し、再配分では
+    変更のあったウィンドウの需要だけを計算し直す。配分を超えたウィンドウは1回の再配分の中で削減する。
+    """
+
+    def __init__(self, optimizer=None):
+        self.optimizer = optimizer
+        # セッションID -> ウィンドウID -> 需要
+        self._demands: Dict[str, Dict[str, float]] = {}
+        self.rebalances = 0
+        self.windows_trimmed = 0
+        self.tokens_evicted = 0.0
+
+    @staticmethod
+    def _demand(window: ContextWindow) -> float:
+        return window.current_tokens + window.reserved_tokens
+
+    async def rebalance(self,
+                        session: ContextSession,
+                        changed: Optional[List[ContextWindow]] = None,
+                        pending: Optional[Dict[str, float]] = None) -> Optional[Dict[str, Any]]:
+        """予算を再配分（changed 省略時は全ウィンドウの需要を再計算。pending は追加予定のトークン数）"""
+        budget = session.token_budget
+        if budget is None or not session.windows:
+            return None
+
+        pending = pending or {}
+        cached = self._demands.setdefault(session.id, {})
+        window_ids = {window.id for window in session.windows}
+        for window_id in list(cached):
+            if window_id not in window_ids:
+                del cached[window_id]
+        changed_ids = window_ids if changed is None else {window.id for window in changed}
+        for window in session.windows:
+            if window.id in changed_ids or window.id not in cached:
+                cached[window.id] = self._demand(window)
+
+        demands = {window_id: demand + pending.get(window_id, 0.0) for window_id, demand in cached.items()}
+        weights = {window_id: budget.weight(window_id) for window_id in demands}
+        allocation = water_fill(budget.total_tokens, demands, weights)
+
+        trimmed = []
+        for window in session.windows:
+            # 配分がレスポンス用予約に満たない場合も、要素に使える予算が負にならないようにする
+            # （トークン数は小数の概算のため切り上げ、需要を満たしたウィンドウを削らない）
+            window.max_tokens = max(math.ceil(allocation[window.id]), window.reserved_tokens)
+            if window.current_tokens + pending.get(window.id, 0.0) > window.token_budget:
+                trimmed.append(await self._trim(window, budget, pending.get(window.id, 0.0)))
+                cached[window.id] = self._demand(window)
+
+        self.rebalances += 1
+        return {**self.describe(session), "trimmed": trimmed}
+
+    async def _trim(self, window: ContextWindow, budget: SessionBudget, pending: float) -> Dict[str, Any]:
+        """配分を超えたウィンドウを削減方式に従って削減（要素に使える予算がない場合は削減しない）"""
+        original_tokens = window.current_tokens
+        if window.token_budget <= 0:
+            logger.error(f"Budget allocation for window {window.id} does not cover its reserved tokens")
+            return {
+                "window_id": window.id,
+                "tokens_evicted": 0.0,
+                "within_budget": False,
+                "infeasible": True
+            }
+
+        target_tokens = max(window.token_budget - pending, 0)
+        if budget.eviction == "local" and self.optimizer is not None:
+            try:
+                await self.optimizer._optimize_for_token_reduction(window, {
+                    "target_tokens": target_tokens,
+                    "min_tokens": 0,
+                    "compress_mode": "local",
+                    "preserve_element_types": list(budget.preserve_element_types)
+                })
+            except Exception as e:
+                logger.error(f"Budget eviction failed for window {window.id}: {str(e)}")
+        else:
+            # 保持するタイプ以外を低優先度の要素から削除
+            preserved_types = set(budget.preserve_element_types)
+            candidates = [element for element in window.elements if element.type.value not in preserved_types]
+            for element in sorted(candidates, key=lambda element: element.priority):
+                if window.current_tokens <= target_tokens:
+                    break
+                window.remove_element(element.id)
+
+        tokens_evicted = original_tokens - window.current_tokens
+        self.windows_trimmed += 1
+        self.tokens_evicted += tokens_evicted
+        return {
+            "window_id": window.id,
+            "tokens_evicted": tokens_evicted,
+            "within_budget": window.current_tokens <= target_tokens,
+            "infeasible": False
+        }
+
+    def describe(self, session: ContextSession) -> Dict[str, Any]:
+        """現在の配分"""
+        budget = session.token_budget
+        demands = self._demands.get(session.id, {})
+        windows = [
+            {
+                "window_id": window.id,
+                "weight": budget.weight(window.id),
+                "demand": demands.get(window.id, self._demand(window)),
+                "allocated_tokens": window.max_tokens,
+                "current_tokens": window.current_tokens,
+                "reserved_tokens": window.reserved_tokens,
+                "utilization_ratio": window.current_tokens / max(window.max_tokens, 1),
+                "infeasible": window.token_budget <= 0
+            }
+            for window in session.windows
+        ]
+        return {
+            "session_id": session.id,
+            "budget": budget.to_dict(),
+            "allocated_tokens": sum(window["allocated_tokens"] for window in windows),
+            "demand": sum(window["demand"] for window in windows),
+            "windows": windows
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._demands),
+            "rebalances": self.rebalances,
+            "windows_trimmed": self.windows_trimmed,
+            "tokens_evicted": self.tokens_evicted
+        }
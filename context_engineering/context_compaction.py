@@ -0,0 +1,108 @@
+import logging
+from typing import Dict, Any, Optional
+
+from context_models import ContextWindow, ContextElement, CompactionPolicy, OptimizationTask, OptimizationStatus
+from context_task_registry import FINISHED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+class WindowCompactor:
+    """コンパクションポリシーを設定したウィンドウの事前削減
+
+    使用率が high_water を超えたら low_water までのトークン削減を低優先度の最適化タスクとして投入し
+    （ウィンドウごとに同時に1つまで）、以降の追加がすぐに成功するようにする。追加が上限を超える場合は、
+    LLMを使わない重複除去・削除・抽出型圧縮で必要な分だけ同期的に空きを作る。
+    """
+
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+        # ウィンドウID -> 投入したバックグラウンドの削減タスク
+        self._jobs: Dict[str, OptimizationTask] = {}
+        self.background_jobs = 0
+        self.sync_evictions = 0
+        self.sync_tokens_freed = 0.0
+
+    def _constraints(self, policy: CompactionPolicy, target_tokens: int, compress_mode: str) -> Dict[str, Any]:
+        return {
+            "target_tokens": target_tokens,
+            "min_tokens": 0,
+            "compress_mode": compress_mode,
+            "preserve_element_types": list(policy.preserve_element_types)
+        }
+
+    def running_job(self, window_id: str) -> Optional[OptimizationTask]:
+        """未完了のバックグラウンドの削減タスク"""
+        task = self._jobs.get(window_id)
+        if task is not None and task.status in FINISHED_STATUSES:
+            del self._jobs[window_id]
+            return None
+        return task
+
+    async def maybe_compact(self, window: ContextWindow, session_id: Optional[str] = None) -> Optional[OptimizationTask]:
+        """使用率が high_water 以上ならバックグラウンドの削減を投入（投入したタスクを返す）"""
+        policy = window.compaction_policy
+        if policy is None or window.current_tokens < window.token_budget * policy.high_water:
+            return None
+        if self.running_job(window.id) is not None:
+            return None
+
+        task = await self.optimizer.optimize_context_window(
+            window,
+            ["reduce_tokens"],
+            self._constraints(policy, int(window.token_budget * policy.low_water), policy.compress_mode),
+            session_id=session_id,
+            priority="low"
+        )
+        self._jobs[window.id] = task
+        self.background_jobs += 1
+        return task
+
+    async def make_room(self, window: ContextWindow, element: ContextElement) -> Optional[Dict[str, Any]]:
+        """要素を追加できるだけの空きをローカルの削減で作る（ポリシーで無効、または空きを作れない場合は None）
+
+        空きを作れない場合はウィンドウを変更しない。
+        """
+        policy = window.compaction_policy
+        if policy is None or not policy.evict_on_add:
+            return None
+        target_tokens = window.token_budget - element.token_count
+        if target_tokens < 0 or window.current_tokens <= target_tokens:
+            return None
+        # 実行中のバックグラウンドの削減と同じウィンドウを同時に変更しない
+        job = self.running_job(window.id)
+        if job is not None and job.status == OptimizationStatus.IN_PROGRESS:
+            return None
+        # 削除も圧縮もできない要素（保持する型の短い要素）だけで目標を超える場合は何もしない
+        preserved_types = set(policy.preserve_element_types)
+        fixed_tokens = sum(
+            e.token_count for e in window.elements
+            if e.type.value in preserved_types and len(e.content) <= 200
+        )
+        if fixed_tokens > target_tokens:
+            return None
+
+        snapshot = self.optimizer.snapshots.take(window, reason="before_eviction")
+        try:
+            result = await self.optimizer._optimize_for_token_reduction(
+                window, self._constraints(policy, target_tokens, "local")
+            )
+        except Exception as e:
+            logger.error(f"Synchronous eviction failed for window {window.id}: {str(e)}")
+            self.optimizer.snapshots.restore(window, snapshot.id)
+            return None
+        if not result["target_achieved"]:
+            # 追加は拒否されるため、削った要素を元に戻す
+            self.optimizer.snapshots.restore(window, snapshot.id)
+            return None
+
+        self.sync_evictions += 1
+        self.sync_tokens_freed += result["original_tokens"] - result["final_tokens"]
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running_jobs": sum(1 for window_id in list(self._jobs) if self.running_job(window_id) is not None),
+            "background_jobs": self.background_jobs,
+            "sync_evictions": self.sync_evictions,
+            "sync_tokens_freed": self.sync_tokens_freed
+        }
@@ -0,0 +1,263 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+EventCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+class ProgressEventBus:
+    """プロセス内のイベント配信
+
+    publish() は呼び出し元を待たせずにキューへ積み、購読者への配信は別タスクで行う。
+    高頻度の進捗は publish_coalesced() でキーごとに間引き、min_interval ごとに最新の状態だけを配信する。
+    """
+
+    def __init__(self, min_interval: float = 0.5, max_queue: int = 10000):
+        self.min_interval = min_interval
+        self.subscribers: List[EventCallback] = []
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        # キー -> (配信予定のタイマー, 最新状態を作る関数)
+        self._pending: Dict[str, Tuple[asyncio.TimerHandle, Callable[[], Dict[str, Any]]]] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.published = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def subscribe(self, callback: EventCallback):
+        self.subscribers.append(callback)
+
+    async def start(self):
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        for handle, _ in self._pending.values():
+            handle.cancel()
+        self._pending.clear()
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def publish(self, event: Dict[str, Any]):
+        """イベントを配信キューに追加（満杯の場合は破棄）"""
+        try:
+            self._queue.put_nowait(event)
+            self.published += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def publish_coalesced(self, key: str, snapshot: Callable[[], Dict[str, Any]]):
+        """キーごとに間引いて配信（配信時点の snapshot() を送るため、間引かれた更新も最新状態に反映される）"""
+        if key in self._pending:
+            self._pending[key] = (self._pending[key][0], snapshot)
+            self.coalesced += 1
+            return
+
+        delay = self._last_sent.get(key, float("-inf")) + self.min_interval - time.monotonic()
+        if delay <= 0:
+            self._send_coalesced(key, snapshot)
+        else:
+            handle = asyncio.get_running_loop().call_later(delay, self.flush, key)
+            self._pending[key] = (handle, snapshot)
+
+    def flush(self, key: str, discard: bool = False):
+        """間引き待ちのイベントを直ちに配信（discard=True の場合は破棄）"""
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        handle, snapshot = pending
+        handle.cancel()
+        if not discard:
+            self._send_coalesced(key, snapshot)
+
+    def forget(self, key: str):
+        """終了したキーの状態を削除"""
+        self.flush(key, discard=True)
+        self._last_sent.pop(key, None)
+
+    def _send_coalesced(self, key: str, snapshot: Callable[[], Dict[str, Any]]):
+        self._last_sent[key] = time.monotonic()
+        try:
+            event = snapshot()
+        except Exception as e:
+            logger.error(f"Progress snapshot failed for {key}: {str(e)}")
+            return
+        self.publish(event)
+
+    async def _dispatch(self):
+        while True:
+            event = await self._queue.get()
+            for callback in list(self.subscribers):
+                try:
+                    await callback(event)
+                except Exception as e:
+                    logger.error(f"Event subscriber failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self.subscribers),
+            "queued": self._queue.qsize(),
+            "pending_coalesced": len(self._pending),
+            "published": self.published,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped
+        }
+
+class OptimizationProgress:
+    """最適化タスクの進捗（目標ごとの処理済み要素数・削減トークン数・LLM呼び出し数・残り時間の推定）"""
+
+    def __init__(self,
+                 task,
+                 goals: List[str],
+                 current_tokens: Callable[[], float],
+                 bus: Optional[ProgressEventBus] = None,
+                 rate_window_seconds: float = 3.0):
+        self.task = task
+        self.bus = bus
+        self.current_tokens = current_tokens
+        self.original_tokens = current_tokens()
+        self.started = time.monotonic()
+        self.llm_calls = 0
+        # 目標ごとの直近の処理速度を求めるための (時刻, 処理済み要素数)
+        self.rate_window_seconds = rate_window_seconds
+        self._samples: Dict[str, deque] = {goal: deque() for goal in goals}
+        # 目標 -> 状態（同じ目標が複数回指定された場合も1つとして扱う）
+        self.goals: Dict[str, Dict[str, Any]] = {
+            goal: {"status": "pending", "processed": 0, "total": 0} for goal in goals
+        }
+
+    @property
+    def fraction(self) -> float:
+        """完了した割合（目標ごとの処理済み要素の割合の平均）"""
+        if not self.goals:
+            return 1.0
+        total = 0.0
+        for state in self.goals.values():
+            if state["status"] == "completed":
+                total += 1.0
+            elif state["total"]:
+                total += min(state["processed"] / state["total"], 1.0)
+        return total / len(self.goals)
+
+    def eta_seconds(self, now: float) -> Optional[float]:
+        """残り時間の推定
+
+        並行に実行中の目標ごとに「未処理の要素数 / 直近の処理速度」を求め、その最大値とする。
+        速度が求まる目標がない間は経過時間と完了割合から線形外挿する。
+        """
+        estimates = []
+        for goal, state in self.goals.items():
+            samples = self._samples[goal]
+            self._trim_samples(samples, now)
+            if state["status"] != "running" or len(samples) < 2:
+                continue
+            (first_time, first_count), (last_time, last_count) = samples[0], samples[-1]
+            if last_time > first_time and last_count > first_count:
+                remaining = max(state["total"] - state["processed"], 0)
+                estimates.append(remaining * (last_time - first_time) / (last_count - first_count))
+        if estimates:
+            return max(estimates)
+        
+        fraction = self.fraction
+        return (now - self.started) * (1.0 - fraction) / fraction if fraction > 0 else None
+
+    def _trim_samples(self, samples: deque, now: float):
+        while len(samples) > 2 and samples[0][0] < now - self.rate_window_seconds:
+            samples.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        elapsed = now - self.started
+        fraction = self.fraction
+        return {
+            "type": "optimization_progress",
+            "task_id": self.task.id,
+            "window_id": self.task.context_id,
+            "progress": fraction,
+            "goals": {goal: dict(state) for goal, state in self.goals.items()},
+            "tokens_saved": self.original_tokens - self.current_tokens(),
+            "llm_calls": self.llm_calls,
+            "elapsed_seconds": elapsed,
+            "eta_seconds": self.eta_seconds(now)
+        }
+
+    def _changed(self):
+        self.task.progress = self.fraction
+        if self.bus is not None:
+            self.bus.publish_coalesced(self.task.id, self.snapshot)
+
+    def _goal_event(self, event_type: str, goal: str):
+        if self.bus is not None:
+            # 間引き待ちの進捗を先に送り、イベントの順序を保つ
+            self.bus.flush(self.task.id)
+            self.bus.publish({
+                "type": event_type,
+                "task_id": self.task.id,
+                "window_id": self.task.context_id,
+                "goal": goal,
+                "progress": self.fraction,
+                "tokens_saved": self.original_tokens - self.current_tokens(),
+                "llm_calls": self.llm_calls
+            })
+
+    def goal_started(self, goal: str):
+        self.goals[goal]["status"] = "running"
+        self._goal_event("optimization_goal_started", goal)
+
+    def goal_completed(self, goal: str):
+        self.goals[goal]["status"] = "completed"
+        self.task.progress = self.fraction
+        self._goal_event("optimization_goal_completed", goal)
+
+    def add_work(self, goal: str, count: int):
+        self.goals[goal]["total"] += count
+        self._changed()
+
+    def complete_work(self, goal: str, count: int = 1):
+        self.goals[goal]["processed"] += count
+        now = time.monotonic()
+        samples = self._samples[goal]
+        samples.append((now, self.goals[goal]["processed"]))
+        self._trim_samples(samples, now)
+        self._changed()
+
+    def record_llm_call(self):
+        self.llm_calls += 1
+        self._changed()
+
+# 実行中の目標の進捗の記録先（目標ごとの非同期タスク内で設定）
+_current_goal: ContextVar[Optional[Tuple[OptimizationProgress, str]]] = ContextVar("optimization_goal", default=None)
+
+@contextmanager
+def goal_progress(progress: OptimizationProgress, goal: str) -> Iterator[None]:
+    """ブロック内の作業量・LLM呼び出しを目標の進捗として記録"""
+    token = _current_goal.set((progress, goal))
+    progress.goal_started(goal)
+    try:
+        yield
+    finally:
+        _current_goal.reset(token)
+
+def report_work(count: int):
+    """現在の目標の処理予定の要素数を追加"""
+    current = _current_goal.get()
+    if current is not None and count:
+        current[0].add_work(current[1], count)
+
+def report_done(count: int = 1):
+    """現在の目標の処理済み要素数を追加"""
+    current = _current_goal.get()
+    if current is not None and count:
+        current[0].complete_work(current[1], count)
+
+def report_llm_call():
+    """現在の目標でのLLM呼び出しを記録"""
+    current = _current_goal.get()
+    if current is not None:
+        current[0].record_llm_call()
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Any, Callable, Awaitable, FrozenSet, Optional
+
+# ウィンドウに対する効果の対象
+MEMBERSHIP = "membership"  # 要素の追加・削除
+ORDER = "order"            # 要素の並び順
+CONTENT = "content"        # 要素の内容
+
+# 依存関係を作る対象。内容の書き換えは要素単位で「読んだ内容から変わっていないこと」を
+# 確かめてから適用するため、内容への読み書きが重なる目標同士も並行に実行できる
+WINDOW_RESOURCES = frozenset({MEMBERSHIP, ORDER})
+
+@dataclass(frozen=True)
+class GoalSpec:
+    """最適化目標の宣言（結果のキーと、ウィンドウに対する読み書きの効果）"""
+    name: str
+    result_key: str
+    reads: FrozenSet[str]
+    writes: FrozenSet[str]
+
+    def conflicts_with(self, later: "GoalSpec") -> bool:
+        """後続の目標がこの目標の完了を待つ必要があるか（書き込み後の読み・読み込み後の書き・書き込みの競合）
+
+        同じ結果キーの目標は同じ要素を書き換え、結果も同じキーに書き込むため常に直列にする。
+        """
+        if self.result_key == later.result_key:
+            return True
+        hazards = (self.writes & (later.reads | later.writes)) | (self.reads & later.writes)
+        return bool(hazards & WINDOW_RESOURCES)
+
+GOAL_SPECS: Dict[str, GoalSpec] = {
+    spec.name: spec for spec in (
+        GoalSpec("reduce_tokens", "token_reduction",
+                 reads=frozenset({MEMBERSHIP, CONTENT}), writes=frozenset({MEMBERSHIP, CONTENT})),
+        GoalSpec("improve_clarity", "clarity_improvement",
+                 reads=frozenset({CONTENT}), writes=frozenset({CONTENT})),
+        GoalSpec("enhance_relevance", "relevance_enhancement",
+                 reads=frozenset({MEMBERSHIP, CONTENT}), writes=frozenset({ORDER})),
+        GoalSpec("remove_redundancy", "redundancy_removal",
+                 reads=frozenset({MEMBERSHIP, CONTENT}), writes=frozenset({MEMBERSHIP, CONTENT})),
+        GoalSpec("improve_structure", "structure_improvement",
+                 reads=frozenset({MEMBERSHIP}), writes=frozenset({ORDER})),
+    )
+}
+
+def unique_goals(goals: List[str], specs: Optional[Dict[str, GoalSpec]] = None) -> List[str]:
+    """重複した目標を除いた目標列（同じ結果キーの目標は最初の1つだけを残す。未知の目標は名前で判定）"""
+    specs = specs or GOAL_SPECS
+    seen = set()
+    unique = []
+    for goal in goals:
+        key = specs[goal].result_key if goal in specs else goal
+        if key not in seen:
+            seen.add(key)
+            unique.append(goal)
+    return unique
+
+class GoalGraphExecutor:
+    """最適化目標を依存グラフ（DAG）として実行
+
+    各目標は、指定順で先行し効果が競合する目標の完了だけを待つ。競合しない目標
+    （例: LLMによる明確性向上と構造の並び替え）は並行に実行される。
+    """
+
+    def __init__(self, specs: Optional[Dict[str, GoalSpec]] = None):
+        self.specs = specs or GOAL_SPECS
+
+    def dependencies(self, goals: List[str]) -> List[List[int]]:
+        """目標ごとに待つ必要のある先行目標の番号（未知の目標は依存なし）"""
+        dependencies = []
+        for j, goal in enumerate(goals):
+            later = self.specs.get(goal)
+            dependencies.append([
+                i for i, earlier in enumerate(goals[:j])
+                if later is not None and earlier in self.specs and self.specs[earlier].conflicts_with(later)
+            ])
+        return dependencies
+
+    async def run(self,
+                  goals: List[str],
+                  run_goal: Callable[[str], Awaitable[Any]],
+                  on_complete: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """全目標を実行して結果キーごとの結果を返す（いずれかが失敗したら残りを取り消して例外を送出。重複した目標は1回だけ実行）"""
+        goals = unique_goals(goals, self.specs)
+        dependencies = self.dependencies(goals)
+        started = time.perf_counter()
+        results: Dict[str, Any] = {}
+        timeline: List[Dict[str, Any]] = [{} for _ in goals]
+        executions: List[asyncio.Task] = []
+
+        async def execute(index: int, goal: str):
+            await asyncio.gather(*(executions[i] for i in dependencies[index]))
+            spec = self.specs.get(goal)
+            if spec is None:
+                # 未知の目標は従来どおり何もしない
+                timeline[index] = {"goal": goal, "skipped": True}
+            else:
+                goal_started = time.perf_counter()
+                results[spec.result_key] = await run_goal(goal)
+                timeline[index] = {
+                    "goal": goal,
+                    "waited_for": [goals[i] for i in dependencies[index]],
+                    "started_seconds": goal_started - started,
+                    "finished_seconds": time.perf_counter() - started
+                }
+            if on_complete is not None:
+                on_complete(goal)
+
+        executions.extend(asyncio.ensure_future(execute(index, goal)) for index, goal in enumerate(goals))
+        try:
+            await asyncio.gather(*executions)
+        except BaseException:
+            for execution in executions:
+                execution.cancel()
+            await asyncio.gather(*executions, return_exceptions=True)
+            raise
+
+        # 結果は指定順に並べる
+        ordered = {
+            self.specs[goal].result_key: results[self.specs[goal].result_key]
+            for goal in goals if goal in self.specs
+        }
+        ordered["execution"] = {
+            "goals": timeline,
+            "elapsed_seconds": time.perf_counter() - started
+        }
+        return ordered
@@ -0,0 +1,255 @@
+import statistics
+from typing import Dict, List, Any, Optional
+
+from text_features import tokenize, split_sentences, tfidf_vectors, cosine, centroid, similarity_matrix, top_terms
+
+class LocalContextScorer:
+    """LLMを使わない決定論的な意味メトリクス推定（語彙的結束性・TF-IDFセントロイド・位置ヒューリスティクス）"""
+
+    def __init__(self,
+                 ideal_sentence_length: int = 40,
+                 min_confident_tokens: int = 150,
+                 confident_similarity: float = 0.6,
+                 exact_similarity_limit: int = 200,
+                 approximate_max_postings: int = 32):
+        self.ideal_sentence_length = ideal_sentence_length
+        self.min_confident_tokens = min_confident_tokens
+        # 語彙的な類似度がこの値以上あれば、語彙の重なりに基づく推定を信頼できるとみなす
+        self.confident_similarity = confident_similarity
+        # 要素数がこれを超える場合、出現要素数の多い語彙を無視した近似類似度で重複度を推定
+        self.exact_similarity_limit = exact_similarity_limit
+        self.approximate_max_postings = approximate_max_postings
+
+    def score_elements(self, contents: List[str], types: List[str]) -> Dict[str, Any]:
+        """コンテキスト要素列の意味メトリクスを推定"""
+        if not contents:
+            return {"metrics": {}, "insights": [], "confidence": 0.0}
+
+        documents = [tokenize(content) for content in contents]
+        vectors = tfidf_vectors(documents)
+        scored = [i for i, vector in enumerate(vectors) if vector]
+        window_centroid = centroid(vectors[i] for i in scored)
+        similarities = similarity_matrix(
+            vectors,
+            self.approximate_max_postings if len(vectors) > self.exact_similarity_limit else None
+        )
+
+        topic_consistency = self._topic_consistency(vectors, scored, window_centroid)
+
+        metrics = {
+            "topic_consistency": topic_consistency,
+            "logical_flow": self._logical_flow(vectors, types),
+            "information_redundancy": self._redundancy(similarities, scored),
+            "context_clarity": self._clarity(contents),
+            "goal_alignment": self._goal_alignment(vectors, types, topic_consistency),
+            "query_relevance": self._query_relevance(vectors, types)
+        }
+
+        insights = []
+        if window_centroid:
+            insights.append(f"主要語彙: {', '.join(top_terms(window_centroid))}")
+        if metrics["information_redundancy"] > 0.6:
+            insights.append("内容の重複した要素が多く含まれています")
+        if metrics["topic_consistency"] < 0.3:
+            insights.append("要素間で話題が分散しています")
+
+        return {
+            "metrics": metrics,
+            "insights": insights,
+            "confidence": self._confidence(
+                documents, scored,
+                [metrics["topic_consistency"], metrics["goal_alignment"], metrics["query_relevance"]]
+            )
+        }
+
+    def score_query_documents(self, query: str, documents: List[str]) -> Dict[str, Any]:
+        """検索クエリと検索結果の関連性メトリクスを推定"""
+        if not documents:
+            return {"metrics": {}, "insights": [], "confidence": 0.0}
+
+        query_tokens = tokenize(query)
+        document_tokens = [tokenize(document) for document in documents]
+        vectors = tfidf_vectors([query_tokens] + document_tokens)
+        query_vector, document_vectors = vectors[0], vectors[1:]
+
+        relevances = [cosine(query_vector, vector) for vector in document_vectors]
+        pair_similarities = [
+            cosine(document_vectors[i], document_vectors[j])
+            for i in range(len(document_vectors))
+            for j in range(i + 1, len(document_vectors))
+        ]
+
+        covered_terms = set().union(*(set(tokens) for tokens in document_tokens))
+        query_terms = set(query_tokens)
+
+        metrics = {
+            "query_relevance": min(1.0, 2.0 * statistics.mean(relevances)),
+            "result_redundancy": statistics.mean(pair_similarities) if pair_similarities else 0.0,
+            "coverage_completeness": len(query_terms & covered_terms) / len(query_terms) if query_terms else 0.0
+        }
+
+        insights = []
+        uncovered = sorted(query_terms - covered_terms)
+        if uncovered:
+            insights.append(f"検索結果に含まれないクエリ語彙: {', '.join(uncovered[:5])}")
+
+        return {
+            "metrics": metrics,
+            "insights": insights,
+            "confidence": self._confidence(
+                [query_tokens] + document_tokens, range(len(vectors)),
+                [metrics["query_relevance"], metrics["coverage_completeness"]]
+            )
+        }
+
+    def score_cross_modal(self, text: str, extracted: List[str]) -> Dict[str, Any]:
+        """テキストと他モダリティ抽出内容の整合性を推定"""
+        documents = [tokenize(text), tokenize(" ".join(extracted))]
+        vectors = tfidf_vectors(documents)
+
+        consistency = min(1.0, 2.0 * cosine(vectors[0], vectors[1]))
+        return {
+            "metrics": {"cross_modal_consistency": consistency},
+            "insights": [],
+            "confidence": self._confidence(documents, range(2), [consistency])
+        }
+
+    def _topic_consistency(self, vectors, scored, window_centroid) -> float:
+        """各要素とセントロイドの平均類似度"""
+        if len(scored) < 2:
+            return 1.0
+        return min(1.0, statistics.mean(cosine(vectors[i], window_centroid) for i in scored))
+
+    def _logical_flow(self, vectors, types) -> float:
+        """隣接要素の結束性と要素配置の妥当性"""
+        adjacent = [
+            cosine(vectors[i], vectors[i + 1])
+            for i in range(len(vectors) - 1)
+            if vectors[i] and vectors[i + 1]
+        ]
+        cohesion = min(1.0, 2.0 * statistics.mean(adjacent)) if adjacent else 0.5
+
+        # システム要素が先頭にまとまっているか
+        first_other = next((i for i, t in enumerate(types) if t != "system"), len(types))
+        system_positions = [i for i, t in enumerate(types) if t == "system"]
+        system_placement = (
+            sum(1 for i in system_positions if i < first_other) / len(system_positions)
+            if system_positions else 1.0
+        )
+
+        # ユーザーとアシスタントが交互に並んでいるか
+        dialog = [t for t in types if t in ("user", "assistant")]
+        alternation = (
+            sum(1 for a, b in zip(dialog, dialog[1:]) if a != b) / (len(dialog) - 1)
+            if len(dialog) > 1 else 1.0
+        )
+
+        return 0.6 * cohesion + 0.2 * system_placement + 0.2 * alternation
+
+    def _redundancy(self, similarities, scored) -> float:
+        """各要素の最大類似度の平均（1が高重複）"""
+        if len(scored) < 2:
+            return 0.0
+        return min(1.0, statistics.mean(max(similarities[i].values(), default=0.0) for i in scored))
+
+    def _clarity(self, contents: List[str]) -> float:
+        """文の長さと記号ノイズから明確性を推定"""
+        sentence_scores = []
+        noise_ratios = []
+        for content in contents:
+            for sentence in split_sentences(content):
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                words = len(sentence.split())
+                # 空白区切りでない言語は2文字を1語とみなす
+                length = words if words > 1 else len(sentence) / 2
+                sentence_scores.append(min(1.0, self.ideal_sentence_length / max(length, 1)))
+            if content:
+                noise = sum(1 for char in content if not (char.isalnum() or char.isspace()))
+                noise_ratios.append(noise / len(content))
+
+        if not sentence_scores:
+            return 0.5
+
+        noise_penalty = min(1.0, 3.0 * statistics.mean(noise_ratios)) if noise_ratios else 0.0
+        return max(0.0, statistics.mean(sentence_scores) * (1.0 - 0.5 * noise_penalty))
+
+    def _goal_alignment(self, vectors, types, topic_consistency: float) -> float:
+        """システム要素（目的）と他要素の類似度"""
+        system_vectors = [v for v, t in zip(vectors, types) if t == "system" and v]
+        other_vectors = [v for v, t in zip(vectors, types) if t != "system" and v]
+        if not system_vectors or not other_vectors:
+            return topic_consistency
+
+        goal = centroid(system_vectors)
+        return min(1.0, 2.0 * statistics.mean(cosine(v, goal) for v in other_vectors))
+
+    def _query_relevance(self, vectors, types) -> float:
+        """最新のユーザー要素をクエリとみなした他要素の関連性"""
+        query_index = next(
+            (i for i in range(len(types) - 1, -1, -1) if types[i] == "user" and vectors[i]),
+            None
+        )
+        if query_index is None:
+            return 0.5
+
+        others = [v for i, v in enumerate(vectors) if i != query_index and v]
+        if not others:
+            return 1.0
+        return min(1.0, 2.0 * statistics.mean(cosine(vectors[query_index], v) for v in others))
+
+    def _confidence(self, documents: List[List[str]], scored, signals: List[float]) -> float:
+        """推定の信頼度（語彙量・評価可能な要素の割合・語彙的な根拠の強さ・根拠の一致度）
+
+        signals は語彙の重なりから求めた同種のメトリクス。重なりが小さい場合は言い換えなどを
+        捉えられていない可能性があり、メトリクス同士が食い違う場合も推定が曖昧なため、
+        量が十分でも信頼度を下げる。
+        """
+        scored = list(scored)
+        if not documents or not scored or not signals:
+            return 0.0
+
+        total_tokens = sum(len(tokens) for tokens in documents)
+        volume = min(1.0, total_tokens / self.min_confident_tokens)
+        coverage = len(scored) / len(documents)
+        strength = min(1.0, statistics.mean(signals) / self.confident_similarity)
+        agreement = 1.0 - min(1.0, 2.0 * statistics.pstdev(signals))
+        return volume * coverage * strength * agreement
+
+class ExtractiveCompressor:
+    """LLMを使わない抽出型圧縮（文書のTF-IDFセントロイドに近い文を、元の順序のまま文字数予算内で残す）"""
+
+    def __init__(self, position_weight: float = 0.1, redundancy_threshold: float = 0.8):
+        # 冒頭の文（主題文であることが多い）への加点
+        self.position_weight = position_weight
+        # 選択済みの文とこれ以上類似する文は冗長として除外
+        self.redundancy_threshold = redundancy_threshold
+
+    def compress(self, text: str, ratio: float = 0.5) -> Optional[str]:
+        """元の文字数の ratio 以内に圧縮（圧縮できない場合は None）"""
+        sentences = split_sentences(text)
+        if len(sentences) < 2:
+            return None
+
+        vectors = tfidf_vectors([tokenize(sentence) for sentence in sentences])
+        document_centroid = centroid(vector for vector in vectors if vector)
+        scores = [
+            cosine(vector, document_centroid) + self.position_weight / (index + 1)
+            for index, vector in enumerate(vectors)
+        ]
+
+        budget = len(text) * ratio
+        selected: List[int] = []
+        used = 0
+        for index in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)):
+            length = len(sentences[index])
+            if selected and used + length > budget:
+                continue
+            if any(cosine(vectors[index], vectors[other]) > self.redundancy_threshold for other in selected):
+                continue
+            selected.append(index)
+            used += length
+
+        compressed = "".join(sentences[index] for index in sorted(selected)).strip()
+        return compressed if len(compressed) < len(text.strip()) else None
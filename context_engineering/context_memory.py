@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from typing import Dict, List, Any, Optional, Set
+
+from context_models import ContextWindow, ContextElement, ContextType, MemoryPolicy
+from context_ordering import is_marked_stable, format_element
+
+logger = logging.getLogger(__name__)
+
+# 要約方式: llm（Geminiによる要約）, local（抽出型圧縮）
+SUMMARIZE_MODES = ("llm", "local")
+
+# 会話ターンとして要約の対象にする要素タイプ
+TURN_TYPES = (ContextType.USER, ContextType.ASSISTANT, ContextType.FUNCTION, ContextType.TOOL)
+
+# local 要約で残す割合
+LOCAL_SUMMARY_RATIO = 0.3
+
+def summary_level(element: ContextElement) -> Optional[int]:
+    """要約要素の階層（0 がターンの要約。要約要素でなければ None）"""
+    if element.type != ContextType.MEMORY:
+        return None
+    return element.metadata.get("memory_level", 0)
+
+def is_turn(element: ContextElement) -> bool:
+    return element.type in TURN_TYPES and not is_marked_stable(element)
+
+class SummaryMemory:
+    """ウィンドウの会話履歴の階層要約
+
+    新しいターンの追加ごとに、作業セットからあふれた古いターンを chunk_size 件ずつ要約にまとめ、
+    同じ階層の要約が fan_in 件を超えたら1つ上の階層へまとめる。既存の要約を作り直すことはなく、
+    要約結果は入力内容のハッシュで書き換えキャッシュに保存する（復元したウィンドウの再要約などで再利用）。
+    """
+
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+        # ウィンドウID -> [ロック, 保持・待機中の畳み込み数]（誰も使わなくなったら削除）
+        self._locks: Dict[str, list] = {}
+        # 実行中のバックグラウンドの畳み込み（完了まで参照を保持）
+        self._tasks: Set[asyncio.Task] = set()
+        self.folds = 0
+        self.summaries_created = 0
+        self.turns_folded = 0
+        self.skipped_conflicts = 0
+
+    async def fold(self, window: ContextWindow) -> Optional[Dict[str, Any]]:
+        """あふれたターンと要約を畳み込む（ポリシー未設定なら None。同じウィンドウの畳み込みは直列に実行）"""
+        policy = window.memory_policy
+        if policy is None:
+            return None
+
+        entry = self._locks.setdefault(window.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._fold_locked(window, policy)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[window.id]
+
+    async def _fold_locked(self, window: ContextWindow, policy: MemoryPolicy) -> Dict[str, Any]:
+        created = []
+        turns = [element for element in window.elements if is_turn(element)]
+        while len(turns) - policy.working_set >= policy.chunk_size:
+            chunk, turns = turns[:policy.chunk_size], turns[policy.chunk_size:]
+            summary = await self._fold_group(window, chunk, 0, policy)
+            if summary is None:
+                break
+            created.append(summary)
+            self.turns_folded += len(chunk)
+
+        level = 0
+        while True:
+            summaries = [element for element in window.elements if summary_level(element) == level]
+            if not summaries:
+                break
+            if len(summaries) > policy.fan_in:
+                summary = await self._fold_group(window, summaries[:policy.fan_in], level + 1, policy)
+                if summary is not None:
+                    created.append(summary)
+                    continue
+            level += 1
+
+        if created:
+            self.folds += 1
+        return {
+            "created": [
+                {"id": summary.id, "level": summary_level(summary), "covers_turns": summary.metadata["covers_turns"],
+                 "tokens": summary.token_count}
+                for summary in created
+            ],
+            **self.describe(window)
+        }
+
+    def schedule(self, window: ContextWindow) -> Optional[asyncio.Task]:
+        """畳み込みをバックグラウンドで実行（要素の追加をLLMの要約で待たせない）"""
+        if window.memory_policy is None:
+            return None
+        task = asyncio.create_task(self._fold_in_background(window))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _fold_in_background(self, window: ContextWindow):
+        try:
+            await self.fold(window)
+        except Exception as e:
+            logger.error(f"Background memory fold failed for window {window.id}: {str(e)}")
+
+    async def _fold_group(self,
+                          window: ContextWindow,
+                          group: List[ContextElement],
+                          level: int,
+                          policy: MemoryPolicy) -> Optional[ContextElement]:
+        """要素群を1つの要約要素に置き換える（要約中に他の処理が削除・変更した場合は置き換えない）"""
+        originals = [(element, element.content) for element in group]
+        text = "\n\n".join(format_element(element) for element in group)
+        content = await self._summarize(text, policy.summarize_mode)
+        if not content:
+            return None
+
+        present = {element.id: element for element in window.elements}
+        if any(present.get(element.id) is not element or element.content is not original
+               for element, original in originals):
+            self.skipped_conflicts += 1
+            return None
+
+        summary = ContextElement(
+            content=content,
+            type=ContextType.MEMORY,
+            metadata={
+                "memory_level": level,
+                "covers_turns": sum(element.metadata.get("covers_turns", 1) for element in group),
+                "source_ids": [element.id for element in group]
+            },
+            tags=["memory"],
+            priority=max(element.priority for element in group),
+            # 要約は最も古い要素の位置・時刻を引き継ぐ
+            created_at=group[0].created_at
+        )
+        folded = {element.id for element in group}
+        position = next(index for index, element in enumerate(window.elements) if element.id in folded)
+        remaining = [element for element in window.elements if element.id not in folded]
+        remaining.insert(position, summary)
+        window.elements = remaining
+        self.summaries_created += 1
+        return summary
+
+    async def _summarize(self, text: str, mode: str) -> Optional[str]:
+        cache = self.optimizer.rewrite_cache
+        if mode == "llm":
+            cached = cache.get("summarize", text)
+            if cached is not None:
+                return cached
+            try:
+                prompt = f"""
+                以下の会話履歴（または要約）を、後続の会話で参照できるよう簡潔に要約してください。
+                事実・決定事項・未解決の質問・ユーザーの要望は必ず残してください。
+
+                {text}
+
+                要約:
+                """
+                summary = (await self.optimizer._generate(prompt)).strip()
+                if summary:
+                    cache.put("summarize", text, summary)
+                    return summary
+            except Exception as e:
+                logger.error(f"History summarization failed, falling back to local summary: {str(e)}")
+
+        return self.optimizer.extractive_compressor.compress(text, LOCAL_SUMMARY_RATIO) or text
+
+    def describe(self, window: ContextWindow) -> Dict[str, Any]:
+        """要約の階層と作業セット"""
+        levels: Dict[int, List[ContextElement]] = {}
+        for element in window.elements:
+            level = summary_level(element)
+            if level is not None:
+                levels.setdefault(level, []).append(element)
+        turns = [element for element in window.elements if is_turn(element)]
+        return {
+            "window_id": window.id,
+            "policy": window.memory_policy.to_dict() if window.memory_policy else None,
+            "working_set": {"turns": len(turns), "tokens": sum(element.token_count for element in turns)},
+            "levels": [
+                {
+                    "level": level,
+                    "summaries": len(levels[level]),
+                    "covers_turns": sum(element.metadata.get("covers_turns", 1) for element in levels[level]),
+                    "tokens": sum(element.token_count for element in levels[level])
+                }
+                for level in sorted(levels)
+            ]
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running_folds": len(self._tasks),
+            "folds": self.folds,
+            "summaries_created": self.summaries_created,
+            "turns_folded": self.turns_folded,
+            "skipped_conflicts": self.skipped_conflicts
+        }
@@ -4,6 +4,9 @@ from enum import Enum
 from datetime import datetime
 import uuid
 import json
+import hashlib
+
+from text_features import simhash
 
 class ContextType(Enum):
     SYSTEM = "system"
@@ -12,6 +15,7 @@ class ContextType(Enum):
     FUNCTION = "function"
     TOOL = "tool"
     MULTIMODAL = "multimodal"
+    MEMORY = "memory"  # 古い会話ターンの要約（階層要約メモリ）
 
 class ContextQuality(Enum):
     EXCELLENT = "excellent"
@@ -33,6 +37,12 @@ class OptimizationStatus(Enum):
     IN_PROGRESS = "in_progress"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class PlanStatus(Enum):
+    PENDING = "pending"
+    EXECUTED = "executed"
+    REJECTED = "rejected"
 
 @dataclass
 class ContextElement:
@@ -46,12 +56,22 @@ class ContextElement:
     priority: int = 5  # 1-10
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
+    # 近似重複検出用SimHashのキャッシュ（計算元の内容, 指紋）
+    _simhash_cache: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
     
     @property
     def token_count(self) -> int:
         """簡易トークン数推定"""
         return len(self.content.split()) * 1.3  # 概算
     
+    @property
+    def simhash(self) -> int:
+        """64ビットSimHash（内容が変わるまでキャッシュ）"""
+        cached = self._simhash_cache
+        if cached is None or cached[0] is not self.content:
+            cached = self._simhash_cache = (self.content, simhash(self.content))
+        return cached[1]
+    
     def to_dict(self) -> Dict[str, Any]:
         return {
             "id": self.id,
@@ -96,6 +116,56 @@ class PromptTemplate:
         variables = re.findall(r'\{(\w+)\}', self.template)
         return list(set(variables))
 
+@dataclass
+class CompactionPolicy:
+    """ウィンドウの自動コンパクション設定（オプトイン）
+    
+    使用率（予約分を除いた上限に対する割合）が high_water を超えたらバックグラウンドで low_water まで削減し、
+    evict_on_add の場合は上限を超える追加の前にローカルの削除・圧縮で空きを作る。
+    """
+    high_water: float = 0.85
+    low_water: float = 0.7
+    compress_mode: str = "local"  # バックグラウンドの削減で使う圧縮方式
+    evict_on_add: bool = True
+    preserve_element_types: List[str] = field(default_factory=lambda: ["system"])
+    
+    def __post_init__(self):
+        if not 0.0 < self.low_water < self.high_water <= 1.0:
+            raise ValueError("Compaction policy requires 0 < low_water < high_water <= 1")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "high_water": self.high_water,
+            "low_water": self.low_water,
+            "compress_mode": self.compress_mode,
+            "evict_on_add": self.evict_on_add,
+            "preserve_element_types": self.preserve_element_types
+        }
+
+@dataclass
+class MemoryPolicy:
+    """階層要約メモリの設定（オプトイン）
+    
+    直近 working_set 件の会話ターンはそのまま保持し、それより古いターンは chunk_size 件ごとに要約へ、
+    同じ階層の要約が fan_in 件を超えたら古いものから1つ上の階層の要約へまとめる。
+    """
+    working_set: int = 12
+    chunk_size: int = 6
+    fan_in: int = 4
+    summarize_mode: str = "llm"  # llm（Geminiによる要約）, local（抽出型圧縮）
+    
+    def __post_init__(self):
+        if self.working_set < 1 or self.chunk_size < 2 or self.fan_in < 2:
+            raise ValueError("Memory policy requires working_set >= 1, chunk_size >= 2 and fan_in >= 2")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "working_set": self.working_set,
+            "chunk_size": self.chunk_size,
+            "fan_in": self.fan_in,
+            "summarize_mode": self.summarize_mode
+        }
+
 @dataclass
 class ContextWindow:
     """コンテキストウィンドウ管理"""
@@ -106,6 +176,8 @@ class ContextWindow:
     template_id: Optional[str] = None
     quality_metrics: Dict[str, float] = field(default_factory=dict)
     optimization_history: List[Dict[str, Any]] = field(default_factory=list)
+    compaction_policy: Optional[CompactionPolicy] = None
+    memory_policy: Optional[MemoryPolicy] = None
     created_at: datetime = field(default_factory=datetime.now)
     
     @property
@@ -123,6 +195,20 @@ class ContextWindow:
         """トークン使用率"""
         return self.current_tokens / self.max_tokens
     
+    @property
+    def token_budget(self) -> int:
+        """要素に使えるトークン数（レスポンス用予約を除く）"""
+        return self.max_tokens - self.reserved_tokens
+    
+    @property
+    def fingerprint(self) -> str:
+        """分析結果に影響する内容のハッシュ（同一ウィンドウの重複排除用）"""
+        digest = hashlib.sha256(f"{self.max_tokens}:{self.reserved_tokens}".encode("utf-8"))
+        for element in self.elements:
+            digest.update(f"\x1e{element.type.value}\x1f{element.priority}\x1f".encode("utf-8"))
+            digest.update(element.content.encode("utf-8"))
+        return digest.hexdigest()
+    
     def add_element(self, element: ContextElement) -> bool:
         """要素追加（トークン制限チェック付き）"""
         if self.current_tokens + element.token_count <= self.max_tokens - self.reserved_tokens:
@@ -172,6 +258,7 @@ class ContextAnalysis:
     quality_score: float = 0.0
     issues: List[str] = field(default_factory=list)
     strengths: List[str] = field(default_factory=list)
+    profile: Dict[str, Any] = field(default_factory=dict)  # ステージ別の計測結果
     analyzed_at: datetime = field(default_factory=datetime.now)
     
     def to_dict(self) -> Dict[str, Any]:
@@ -184,6 +271,7 @@ class ContextAnalysis:
             "quality_score": self.quality_score,
             "issues": self.issues,
             "strengths": self.strengths,
+            "profile": self.profile,
             "analyzed_at": self.analyzed_at.isoformat()
         }
 
@@ -194,6 +282,9 @@ class OptimizationTask:
     context_id: str = ""
     optimization_type: str = ""  # token_reduction, clarity_improvement, etc.
     parameters: Dict[str, Any] = field(default_factory=dict)
+    session_id: Optional[str] = None
+    priority: str = "normal"  # high, normal, low
+    timeout_seconds: Optional[float] = None
     status: OptimizationStatus = OptimizationStatus.PENDING
     progress: float = 0.0
     result: Optional[Dict[str, Any]] = None
@@ -202,6 +293,77 @@ class OptimizationTask:
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
 
+@dataclass
+class OptimizationPlan:
+    """最適化のドライラン計画（ウィンドウを変更せずに見積もったコスト）"""
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    context_id: str = ""
+    goals: List[str] = field(default_factory=list)
+    constraints: Dict[str, Any] = field(default_factory=dict)
+    session_id: Optional[str] = None
+    priority: str = "normal"
+    timeout_seconds: Optional[float] = None
+    window_fingerprint: str = ""  # 計画時点のウィンドウ内容
+    steps: List[Dict[str, Any]] = field(default_factory=list)  # 目標ごとの見積もり
+    status: PlanStatus = PlanStatus.PENDING
+    task_id: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    
+    @property
+    def totals(self) -> Dict[str, float]:
+        """全目標の見積もり合計（時間は依存する目標の連鎖のうち最長のもの。LLMの同時実行数は共有するため下限の目安）"""
+        keys = ("llm_calls", "prompt_tokens", "response_tokens", "expected_token_savings")
+        totals = {key: sum(step[key] for step in self.steps) for key in keys}
+        
+        finished: List[float] = []
+        for step in self.steps:
+            waited = max((finished[index] for index in step.get("depends_on", [])), default=0.0)
+            finished.append(waited + step["estimated_seconds"])
+        totals["estimated_seconds"] = max(finished, default=0.0)
+        totals["sequential_seconds"] = sum(step["estimated_seconds"] for step in self.steps)
+        return totals
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "context_id": self.context_id,
+            "goals": self.goals,
+            "constraints": self.constraints,
+            "priority": self.priority,
+            "timeout_seconds": self.timeout_seconds,
+            "window_fingerprint": self.window_fingerprint,
+            "steps": self.steps,
+            "totals": self.totals,
+            "status": self.status.value,
+            "task_id": self.task_id,
+            "created_at": self.created_at.isoformat()
+        }
+
+@dataclass
+class SessionBudget:
+    """セッション内のウィンドウで共有するトークン予算（1つのモデルコンテキストに収める合計）"""
+    total_tokens: int
+    weights: Dict[str, float] = field(default_factory=dict)  # ウィンドウID -> 重み（未指定は1.0）
+    eviction: str = "priority"  # 予算を超えたウィンドウの削減方式
+    preserve_element_types: List[str] = field(default_factory=lambda: ["system"])  # 削減で削除しないタイプ
+    
+    def __post_init__(self):
+        if self.total_tokens <= 0:
+            raise ValueError("total_tokens must be positive")
+        if any(weight <= 0 for weight in self.weights.values()):
+            raise ValueError("Window weights must be positive")
+    
+    def weight(self, window_id: str) -> float:
+        return self.weights.get(window_id, 1.0)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_tokens": self.total_tokens,
+            "weights": self.weights,
+            "eviction": self.eviction,
+            "preserve_element_types": self.preserve_element_types
+        }
+
 @dataclass
 class ContextSession:
     """コンテキストセッション管理"""
@@ -211,6 +373,7 @@ class ContextSession:
     windows: List[ContextWindow] = field(default_factory=list)
     active_window_id: Optional[str] = None
     session_metadata: Dict[str, Any] = field(default_factory=dict)
+    token_budget: Optional[SessionBudget] = None
     created_at: datetime = field(default_factory=datetime.now)
     last_accessed: datetime = field(default_factory=datetime.now)
     
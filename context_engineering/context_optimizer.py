@@ -1,46 +1,196 @@
 import logging
 import json
 import re
+import math
 from typing import Dict, List, Any, Optional, Tuple
+import time
 from datetime import datetime
 import google.generativeai as genai
-from collections import Counter
+from collections import Counter, OrderedDict
 import asyncio
 
 from context_models import (
     ContextWindow, ContextElement, ContextType, OptimizationTask, 
-    OptimizationStatus, ContextAnalysis
+    OptimizationStatus, ContextAnalysis, OptimizationPlan, PlanStatus
+)
+from context_analyzer import estimate_prompt_tokens
+from context_heuristics import ExtractiveCompressor
+from context_profiler import LatencyModel
+from context_task_registry import OptimizationTaskRegistry, TaskRetentionPolicy, ArchivedTask
+from context_goals import GoalGraphExecutor, unique_goals
+from context_rewrite_cache import RewriteCache, track_rewrite_cache, summarize_cache_stats
+from context_events import OptimizationProgress, goal_progress, report_work, report_done, report_llm_call
+from context_snapshots import SnapshotStore
+from context_ordering import OrderingSpec, PrefixTracker, ordering_mode, split_stable
+from context_reduction import (
+    ReductionCostModel, ReductionAction, rank_actions, select_actions, REDUCTION_ACTIONS, MIN_ACTION_COST
+)
+from text_features import (
+    char_ngram_vectors, similarity_matrix, tokenize, BM25Index, SimHashIndex, AnalysisCache, simhash_features, set_cosine
 )
 
 logger = logging.getLogger(__name__)
 
+# バッチ圧縮プロンプトの固定部分のトークン数概算
+COMPRESSION_PROMPT_OVERHEAD_TOKENS = 300
+
+# バッチ圧縮プロンプト内の入力JSONの区切り
+BATCH_INPUT_MARKER = "入力JSON:"
+
+# LLM圧縮で見込むトークン削減率（ウェーブの大きさの見積もりに使用）
+EXPECTED_COMPRESSION_SAVINGS = 0.5
+
+# 圧縮方式: llm（Geminiによる書き換え）, local（オフラインの抽出型圧縮）, auto（両方を候補にしてコストで選ぶ）
+COMPRESS_MODES = ("llm", "local", "auto")
+
+# 関連性の評価方式: bm25（ローカルのBM25ランキング）, llm（トピック抽出と要素ごとのLLM評価）
+RELEVANCE_MODES = ("bm25", "llm")
+
+# 単一要素プロンプト（圧縮・書き換え・スコアリング）の固定部分のトークン数概算
+SINGLE_PROMPT_OVERHEAD_TOKENS = 60
+
+# 保持する未実行の最適化計画の上限
+MAX_OPTIMIZATION_PLANS = 1000
+
+# ウィンドウごとに保持する最適化履歴の上限
+MAX_OPTIMIZATION_HISTORY = 100
+
+# 書き換えキャッシュのプロンプトの版（プロンプトを変更したら上げる）
+REWRITE_PROMPT_VERSIONS = {"compress": 1, "clarity": 1, "merge": 1, "summarize": 1}
+
+def _near_duplicates(elements: List[ContextElement], threshold: float) -> List[Tuple[int, int, float]]:
+    """近似重複の要素を (要素, 重複元, 類似度) の番号で返す（重複元は先に現れた要素）
+    
+    類似度は SimHash と同じ尺度の 1 - arccos(特徴集合のコサイン類似度) / π。
+    SimHashのハミング距離で候補を絞り、候補のみ特徴集合で類似度を確かめる。
+    """
+    index = SimHashIndex(int((1.0 - threshold) * 64))
+    features: Dict[int, set] = {}
+    duplicates = []
+    for position, element in enumerate(elements):
+        fingerprint = element.simhash
+        for original in index.find(fingerprint):
+            if position not in features:
+                features[position] = simhash_features(element.content)
+            if original not in features:
+                features[original] = simhash_features(elements[original].content)
+            cosine = min(1.0, set_cosine(features[position], features[original]))
+            similarity = 1.0 - math.acos(cosine) / math.pi
+            if similarity >= threshold:
+                duplicates.append((position, original, similarity))
+                break
+        else:
+            index.add(position, fingerprint)
+    return duplicates
+
+def _reduction_target(original_tokens: float, constraints: Dict[str, Any]) -> int:
+    """トークン削減の目標トークン数（target_tokens の指定がなければ target_token_reduction の割合から求める）"""
+    min_tokens = constraints.get("min_tokens", 100)
+    if constraints.get("target_tokens") is not None:
+        return max(int(constraints["target_tokens"]), min_tokens)
+    target_reduction = constraints.get("target_token_reduction", 0.2)  # 20%削減がデフォルト
+    return max(int(original_tokens * (1 - target_reduction)), min_tokens)
+
+def _group_pairs(count: int, pairs: List[Tuple[int, int]]) -> List[List[int]]:
+    """union-findでペアを推移的にグループ化（2要素以上のグループのみ）"""
+    parent = list(range(count))
+    
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    
+    groups: Dict[int, List[int]] = {}
+    for index in range(count):
+        groups.setdefault(find(index), []).append(index)
+    return [group for group in groups.values() if len(group) > 1]
+
 class ContextOptimizer:
     """コンテキスト最適化AI機能"""
     
-    def __init__(self, gemini_api_key: str):
+    def __init__(self,
+                 gemini_api_key: str,
+                 llm_concurrency: int = 4,
+                 llm_timeout: float = 60.0,
+                 llm_retries: int = 2,
+                 llm_retry_backoff: float = 0.5,
+                 retention_policy: Optional[TaskRetentionPolicy] = None,
+                 rewrite_cache_entries: int = 10000):
         genai.configure(api_key=gemini_api_key)
         self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        self.optimization_tasks: Dict[str, OptimizationTask] = {}
+        self.optimization_tasks = OptimizationTaskRegistry(retention_policy)
+        self.llm_concurrency = llm_concurrency
+        self.llm_timeout = llm_timeout
+        self.llm_retries = llm_retries
+        self.llm_retry_backoff = llm_retry_backoff
+        self._llm_semaphore = asyncio.Semaphore(llm_concurrency)
+        self.extractive_compressor = ExtractiveCompressor()
+        # LLM呼び出しの実測値から所要時間を推定（計画の見積もりに使用）
+        self.latency_model = LatencyModel()
+        self.optimization_plans: "OrderedDict[str, OptimizationPlan]" = OrderedDict()
+        self.goal_executor = GoalGraphExecutor()
+        # 要素単位の書き換え結果（圧縮・明確化・マージ・履歴の要約）をタスク間で再利用
+        self.rewrite_cache = RewriteCache(REWRITE_PROMPT_VERSIONS, max_entries=rewrite_cache_entries)
+        # OptimizationScheduler を設定するとタスクはワーカープール経由で実行される
+        self.scheduler = None
+        # ProgressEventBus を設定すると進捗イベントを配信する
+        self.events = None
+        # タスク実行前のウィンドウのスナップショット（最適化の取り消しに使用）
+        self.snapshots = SnapshotStore()
+        # 組み立てたプロンプトの安定した接頭辞（prefix_stable の並び替えに使用）
+        self.prefix_tracker = PrefixTracker()
+    
+    async def _generate(self, prompt: str) -> str:
+        """同時実行数の上限・タイムアウト・リトライを適用したLLM呼び出し"""
+        for attempt in range(self.llm_retries + 1):
+            try:
+                async with self._llm_semaphore:
+                    started = time.perf_counter()
+                    response = await asyncio.wait_for(
+                        self.model.generate_content_async(prompt), self.llm_timeout
+                    )
+                    self.latency_model.observe(estimate_prompt_tokens(response.text), time.perf_counter() - started)
+                report_llm_call()
+                return response.text
+            except Exception as e:
+                if attempt == self.llm_retries:
+                    raise
+                logger.warning(f"LLM call failed (attempt {attempt + 1}), retrying: {str(e)}")
+                await asyncio.sleep(self.llm_retry_backoff * 2 ** attempt)
     
     async def optimize_context_window(self, 
                                     window: ContextWindow, 
                                     optimization_goals: List[str],
-                                    constraints: Dict[str, Any] = None) -> OptimizationTask:
+                                    constraints: Dict[str, Any] = None,
+                                    session_id: Optional[str] = None,
+                                    priority: str = "normal",
+                                    timeout_seconds: Optional[float] = None) -> OptimizationTask:
         """コンテキストウィンドウの包括的最適化"""
         
         task = OptimizationTask(
             context_id=window.id,
             optimization_type="comprehensive",
             parameters={
-                "goals": optimization_goals,
+                "goals": unique_goals(optimization_goals),
                 "constraints": constraints or {}
-            }
+            },
+            session_id=session_id,
+            priority=priority,
+            timeout_seconds=timeout_seconds
         )
         
-        self.optimization_tasks[task.id] = task
-        
-        # バックグラウンドで最適化を実行
-        asyncio.create_task(self._execute_optimization(task, window))
+        if self.scheduler is not None:
+            self.scheduler.submit(task)
+        else:
+            self.optimization_tasks[task.id] = task
+            # バックグラウンドで最適化を実行
+            asyncio.create_task(self._execute_optimization(task, window))
         
         return task
     
@@ -49,146 +199,357 @@ class ContextOptimizer:
         task.status = OptimizationStatus.IN_PROGRESS
         task.started_at = datetime.now()
         
+        snapshot = self.snapshots.take(window, reason="before_optimization", task_id=task.id)
+        history = {
+            "task_id": task.id,
+            "goals": task.parameters["goals"],
+            "snapshot_id": snapshot.id,
+            "status": task.status.value,
+            "tokens_before": window.current_tokens,
+            "started_at": task.started_at.isoformat()
+        }
+        window.optimization_history.append(history)
+        del window.optimization_history[:-MAX_OPTIMIZATION_HISTORY]
+        
         try:
-            result = {}
+            goals = task.parameters["goals"]
+            constraints = task.parameters["constraints"]
+            # トークン列などの解析結果は目標間で共有
+            cache = AnalysisCache()
+            progress = OptimizationProgress(task, goals, lambda: window.current_tokens, self.events)
             
-            # 目標に応じた最適化を実行
-            for goal in task.parameters["goals"]:
-                if goal == "reduce_tokens":
-                    optimization_result = await self._optimize_for_token_reduction(window, task.parameters["constraints"])
-                    result["token_reduction"] = optimization_result
-                
-                elif goal == "improve_clarity":
-                    optimization_result = await self._optimize_for_clarity(window)
-                    result["clarity_improvement"] = optimization_result
-                
-                elif goal == "enhance_relevance":
-                    optimization_result = await self._optimize_for_relevance(window)
-                    result["relevance_enhancement"] = optimization_result
-                
-                elif goal == "remove_redundancy":
-                    optimization_result = await self._optimize_for_redundancy_removal(window)
-                    result["redundancy_removal"] = optimization_result
-                
-                elif goal == "improve_structure":
-                    optimization_result = await self._optimize_for_structure(window)
-                    result["structure_improvement"] = optimization_result
-                
-                task.progress += 1.0 / len(task.parameters["goals"])
+            async def run_goal(goal: str) -> Dict[str, Any]:
+                with goal_progress(progress, goal):
+                    if goal == "reduce_tokens":
+                        return await self._optimize_for_token_reduction(window, constraints)
+                    elif goal == "improve_clarity":
+                        return await self._optimize_for_clarity(window)
+                    elif goal == "enhance_relevance":
+                        return await self._optimize_for_relevance(window, constraints, cache)
+                    elif goal == "remove_redundancy":
+                        return await self._optimize_for_redundancy_removal(window, constraints, cache)
+                    elif goal == "improve_structure":
+                        return await self._optimize_for_structure(window, constraints)
             
+            # 効果が競合しない目標は並行に実行
+            with track_rewrite_cache() as cache_stats:
+                result = await self.goal_executor.run(goals, run_goal, progress.goal_completed)
+            result["rewrite_cache"] = summarize_cache_stats(cache_stats)
             task.result = result
             task.status = OptimizationStatus.COMPLETED
             task.completed_at = datetime.now()
             
+        except asyncio.CancelledError:
+            # キャンセル・タイムアウト時のタスクの状態はスケジューラが設定する
+            self._finish_history(history, window, OptimizationStatus.CANCELLED.value)
+            raise
         except Exception as e:
             task.status = OptimizationStatus.FAILED
             task.error_message = str(e)
             task.completed_at = datetime.now()
             logger.error(f"Optimization task {task.id} failed: {str(e)}")
+        
+        self._finish_history(history, window, task.status.value)
+        self._publish_finished(task)
+        if self.scheduler is None:
+            self.optimization_tasks.collect()
+    
+    def _finish_history(self, history: Dict[str, Any], window: ContextWindow, status: str):
+        history.update({
+            "status": status,
+            "tokens_after": window.current_tokens,
+            "completed_at": datetime.now().isoformat()
+        })
+    
+    def _publish_finished(self, task: OptimizationTask):
+        """タスク終了イベントを配信（間引き待ちの進捗を先に送る）"""
+        if self.events is None:
+            return
+        self.events.flush(task.id)
+        self.events.forget(task.id)
+        self.events.publish({
+            "type": "optimization_finished",
+            "task_id": task.id,
+            "window_id": task.context_id,
+            "status": task.status.value,
+            "progress": task.progress,
+            "error_message": task.error_message
+        })
     
     async def _optimize_for_token_reduction(self, 
                                           window: ContextWindow, 
                                           constraints: Dict[str, Any]) -> Dict[str, Any]:
-        """トークン削減最適化"""
+        """トークン削減最適化
         
-        target_reduction = constraints.get("target_token_reduction", 0.2)  # 20%削減がデフォルト
-        min_tokens = constraints.get("min_tokens", 100)
-        preserve_elements = constraints.get("preserve_element_types", [])
+        重複除去・低優先度要素の削除・ローカル圧縮・LLM圧縮の候補を要素ごとに作り、コストあたりの
+        期待削減量が大きい順に目標トークン数に届く分を選んで適用する。選んだLLM圧縮は並行に実行し、
+        実際の削減量が見込みに届かなければ残りの候補から次のラウンドを選ぶ。
+        """
         
-        original_tokens = window.current_tokens
-        target_tokens = max(int(original_tokens * (1 - target_reduction)), min_tokens)
+        compress_mode = constraints.get("compress_mode", "llm")
+        if compress_mode not in COMPRESS_MODES:
+            raise ValueError(f"Invalid compress_mode: {compress_mode} (expected one of {', '.join(COMPRESS_MODES)})")
+        batching = constraints.get("compression_batching", True)
+        batch_tokens = constraints.get("compression_batch_tokens", 3000)
+        compression_ratio = constraints.get("compression_ratio", 0.5)
+        cost_model = ReductionCostModel.from_constraints(constraints)
         
-        optimization_strategies = []
+        original_tokens = window.current_tokens
+        target_tokens = _reduction_target(original_tokens, constraints)
         
-        # 戦略1: 低優先度要素の削除
-        if window.current_tokens > target_tokens:
-            removal_result = await self._remove_low_priority_elements(window, target_tokens, preserve_elements)
-            optimization_strategies.append(removal_result)
+        applied_actions = []
+        taken, protected = set(), set()
+        # 削減できなかった (要素, アクション)。要素は次のラウンドで別のアクションの候補に戻す
+        failed = set()
+        stats = {"llm_calls": 0, "fallback_calls": 0, "candidates": 0, "waves": 0, "conflicts": 0}
         
-        # 戦略2: 内容の圧縮
-        if window.current_tokens > target_tokens:
-            compression_result = await self._compress_content(window, target_tokens)
-            optimization_strategies.append(compression_result)
+        while window.current_tokens > target_tokens:
+            candidates = [
+                action for action in self._reduction_candidates(window.elements, constraints, cost_model)
+                if (action.element_id, action.kind) not in failed
+            ]
+            selected = select_actions(rank_actions(candidates), window.current_tokens - target_tokens, taken, protected)
+            if not selected:
+                break
+            
+            stats["waves"] += 1
+            report_work(len(selected))
+            elements_by_id = {element.id: element for element in window.elements}
+            originals = {action.element_id: elements_by_id[action.element_id].content for action in selected}
+            llm_wave = [elements_by_id[action.element_id] for action in selected if action.kind == "llm_compress"]
+            local_wave = [elements_by_id[action.element_id] for action in selected if action.kind == "local_compress"]
+            
+            compressed_by_id = self._compress_wave_locally(local_wave, compression_ratio)
+            report_done(len(selected) - len(llm_wave))
+            if llm_wave:
+                stats["candidates"] += len(llm_wave)
+                compressed_by_id.update(await self._compress_wave(llm_wave, batching, batch_tokens, stats))
+            
+            # 効率の良い順に適用（圧縮の間に他の目標が削除・変更した要素には適用しない）
+            present = {element.id for element in window.elements}
+            removed_ids = set()
+            current_tokens = window.current_tokens
+            for action in selected:
+                if current_tokens <= target_tokens:
+                    break
+                element = elements_by_id[action.element_id]
+                if element.id not in present or element.content is not originals[element.id]:
+                    stats["conflicts"] += 1
+                    continue
+                
+                if action.kind in ("dedup", "drop"):
+                    removed_ids.add(element.id)
+                    tokens_saved = element.token_count
+                else:
+                    compressed_content = compressed_by_id.get(element.id)
+                    if not compressed_content or len(compressed_content) >= len(element.content):
+                        failed.add((element.id, action.kind))
+                        taken.discard(element.id)
+                        continue
+                    before_tokens = element.token_count
+                    element.content = compressed_content
+                    tokens_saved = before_tokens - element.token_count
+                
+                current_tokens -= tokens_saved
+                applied_actions.append({
+                    **action.to_dict(),
+                    "tokens_saved": tokens_saved,
+                    # 実際の削減量に基づく限界効用（コストあたりの削減トークン数）
+                    "marginal_benefit": tokens_saved / max(action.cost, MIN_ACTION_COST),
+                    "tokens_after": current_tokens
+                })
+            
+            if removed_ids:
+                window.elements = [element for element in window.elements if element.id not in removed_ids]
         
-        # 戦略3: 重複除去
-        if window.current_tokens > target_tokens:
-            deduplication_result = await self._remove_duplicates(window)
-            optimization_strategies.append(deduplication_result)
+        strategies = {}
+        for action in applied_actions:
+            summary = strategies.setdefault(action["action"], {"strategy": action["action"], "count": 0, "tokens_saved": 0})
+            summary["count"] += 1
+            summary["tokens_saved"] += action["tokens_saved"]
         
         return {
             "original_tokens": original_tokens,
             "final_tokens": window.current_tokens,
+            "target_tokens": target_tokens,
             "reduction_achieved": (original_tokens - window.current_tokens) / original_tokens,
             "target_achieved": window.current_tokens <= target_tokens,
-            "strategies_applied": optimization_strategies
+            "compress_mode": compress_mode,
+            "strategies_applied": list(strategies.values()),
+            "actions": applied_actions,
+            "rounds": stats["waves"],
+            "llm_calls": stats["llm_calls"],
+            "fallback_calls": stats["fallback_calls"],
+            "llm_calls_saved": stats["candidates"] - stats["llm_calls"],
+            "skipped_conflicts": stats["conflicts"]
         }
     
-    async def _remove_low_priority_elements(self, 
-                                          window: ContextWindow, 
-                                          target_tokens: int,
-                                          preserve_types: List[str]) -> Dict[str, Any]:
-        """低優先度要素の削除"""
+    def _reduction_candidates(self,
+                              elements: List[ContextElement],
+                              constraints: Dict[str, Any],
+                              cost_model: ReductionCostModel) -> List[ReductionAction]:
+        """要素ごとのトークン削減アクションの候補（期待削減量・所要時間・LLMトークン数・コスト）"""
+        preserved_types = set(constraints.get("preserve_element_types", []))
+        compress_mode = constraints.get("compress_mode", "llm")
+        compression_ratio = constraints.get("compression_ratio", 0.5)
+        threshold = constraints.get("near_duplicate_threshold", 0.9)
+        concurrency = max(self.llm_concurrency, 1)
         
-        removed_elements = []
-        preserved_types = set(preserve_types)
+        duplicates = {position: (original, similarity)
+                      for position, original, similarity in _near_duplicates(elements, threshold)}
+        actions = []
+        for position, element in enumerate(elements):
+            tokens = element.token_count
+            if position in duplicates:
+                # 重複元が残るため情報は失われない
+                original, similarity = duplicates[position]
+                actions.append(ReductionAction("dedup", element.id, tokens, 0.0, 0.0, 0.0,
+                                               duplicate_of=elements[original].id,
+                                               similarity=similarity))
+            if element.type.value not in preserved_types:
+                actions.append(ReductionAction("drop", element.id, tokens, 0.0, 0.0,
+                                               cost_model.cost(0.0, 0.0, tokens, element.priority)))
+            
+            if len(element.content) <= 200:  # 長いコンテンツのみ圧縮
+                continue
+            if compress_mode in ("local", "auto"):
+                savings = tokens * (1.0 - compression_ratio)
+                actions.append(ReductionAction(
+                    "local_compress", element.id, savings, 0.0, 0.0,
+                    cost_model.cost(0.0, 0.0, savings * cost_model.local_compress_loss, element.priority)
+                ))
+            if compress_mode in ("llm", "auto"):
+                savings = tokens * EXPECTED_COMPRESSION_SAVINGS
+                if self.rewrite_cache.contains("compress", element.content):
+                    seconds, llm_tokens = 0.0, 0.0
+                else:
+                    prompt_tokens = estimate_prompt_tokens(element.content)
+                    response_tokens = prompt_tokens * EXPECTED_COMPRESSION_SAVINGS
+                    # 並行に実行されるため、所要時間は同時実行数で按分する
+                    seconds = self.latency_model.estimate(response_tokens) / concurrency
+                    llm_tokens = prompt_tokens + SINGLE_PROMPT_OVERHEAD_TOKENS + response_tokens
+                actions.append(ReductionAction(
+                    "llm_compress", element.id, savings, seconds, llm_tokens,
+                    cost_model.cost(seconds, llm_tokens, savings * cost_model.llm_compress_loss, element.priority)
+                ))
+        return actions
+    
+    async def _compress_wave(self,
+                             wave: List[ContextElement],
+                             batching: bool,
+                             batch_tokens: int,
+                             stats: Dict[str, int]) -> Dict[str, str]:
+        """ウェーブ内の要素を並行に圧縮し、要素IDごとの圧縮結果を返す（キャッシュにない要素のみLLMで圧縮）"""
+        compressed_by_id: Dict[str, str] = {}
+        misses = []
+        for element in wave:
+            cached = self.rewrite_cache.get("compress", element.content)
+            if cached is not None:
+                compressed_by_id[element.id] = cached
+            else:
+                misses.append(element)
+        report_done(len(wave) - len(misses))
         
-        # 優先度順にソート（低優先度から）
-        sortable_elements = [
-            elem for elem in window.elements 
-            if elem.type.value not in preserved_types
-        ]
-        sortable_elements.sort(key=lambda x: x.priority)
+        batches = []
+        position = 0
+        while position < len(misses):
+            batch = self._next_compression_batch(misses, position, batch_tokens) if batching else misses[position:position + 1]
+            batches.append(batch)
+            position += len(batch)
         
-        for element in sortable_elements:
-            if window.current_tokens <= target_tokens:
-                break
-            
-            if window.remove_element(element.id):
-                removed_elements.append({
-                    "id": element.id,
-                    "type": element.type.value,
-                    "priority": element.priority,
-                    "tokens": element.token_count,
-                    "content_preview": element.content[:100] + "..." if len(element.content) > 100 else element.content
-                })
+        async def compress_batch(batch: List[ContextElement]) -> Dict[str, str]:
+            result = await self._compress_batch(batch)
+            # 出力に含まれなかった要素は個別圧縮の完了時に数える
+            report_done(len(result))
+            return result
         
-        return {
-            "strategy": "low_priority_removal",
-            "removed_count": len(removed_elements),
-            "removed_elements": removed_elements,
-            "tokens_saved": sum(elem["tokens"] for elem in removed_elements)
-        }
-    
-    async def _compress_content(self, window: ContextWindow, target_tokens: int) -> Dict[str, Any]:
-        """内容の圧縮"""
+        async def compress_single(element: ContextElement) -> Optional[str]:
+            compressed = await self._compress_single_content(element.content)
+            report_done()
+            return compressed
+        
+        multi_batches = [batch for batch in batches if len(batch) > 1]
+        for result in await asyncio.gather(*(compress_batch(batch) for batch in multi_batches)):
+            compressed_by_id.update(result)
+        stats["llm_calls"] += len(multi_batches)
         
-        compressed_elements = []
+        # バッチ出力に含まれない（解析失敗・圧縮不足）要素のみ個別に圧縮
+        pending = [element for element in misses if element.id not in compressed_by_id]
+        stats["fallback_calls"] += sum(1 for batch in multi_batches for element in batch if element in pending)
+        stats["llm_calls"] += len(pending)
+        results = await asyncio.gather(*(compress_single(element) for element in pending))
+        for element, compressed in zip(pending, results):
+            if compressed:
+                compressed_by_id[element.id] = compressed
         
-        for element in window.elements[:]:  # コピーを作成して反復
-            if window.current_tokens <= target_tokens:
+        for element in misses:
+            if element.id in compressed_by_id:
+                self.rewrite_cache.put("compress", element.content, compressed_by_id[element.id])
+        
+        return compressed_by_id
+    
+    def _compress_wave_locally(self, wave: List[ContextElement], ratio: float) -> Dict[str, str]:
+        """ウェーブ内の要素を抽出型圧縮（LLM呼び出しなし）"""
+        compressed_by_id = {}
+        for element in wave:
+            compressed = self.extractive_compressor.compress(element.content, ratio)
+            # 少なくとも10%削減できた要素のみ採用
+            if compressed and len(compressed) < len(element.content) * 0.9:
+                compressed_by_id[element.id] = compressed
+        return compressed_by_id
+    
+    def _next_compression_batch(self,
+                                candidates: List[ContextElement],
+                                start: int,
+                                batch_tokens: int) -> List[ContextElement]:
+        """トークン予算内で連続する要素をバッチにまとめる（予算を超える要素は単独）"""
+        budget = max(batch_tokens - COMPRESSION_PROMPT_OVERHEAD_TOKENS, 1)
+        batch = []
+        used_tokens = 0.0
+        
+        for element in candidates[start:]:
+            # 入力と出力（約半分）の両方がプロンプト予算を消費する
+            element_tokens = estimate_prompt_tokens(element.content) * 1.5
+            if batch and used_tokens + element_tokens > budget:
                 break
-            
-            if len(element.content) > 200:  # 長いコンテンツのみ圧縮
-                compressed_content = await self._compress_single_content(element.content)
-                
-                if compressed_content and len(compressed_content) < len(element.content):
-                    original_tokens = element.token_count
-                    element.content = compressed_content
-                    new_tokens = element.token_count
-                    
-                    compressed_elements.append({
-                        "id": element.id,
-                        "original_length": len(element.content),
-                        "compressed_length": len(compressed_content),
-                        "tokens_saved": original_tokens - new_tokens
-                    })
+            batch.append(element)
+            used_tokens += element_tokens
         
-        return {
-            "strategy": "content_compression",
-            "compressed_count": len(compressed_elements),
-            "compressed_elements": compressed_elements,
-            "total_tokens_saved": sum(elem["tokens_saved"] for elem in compressed_elements)
-        }
+        return batch
+    
+    async def _compress_batch(self, elements: List[ContextElement]) -> Dict[str, str]:
+        """複数要素を1回のLLM呼び出しで圧縮し、要素IDごとの圧縮結果を返す"""
+        try:
+            items = [{"id": element.id, "text": element.content} for element in elements]
+            prompt = f"""
+            以下のJSONの各テキストを、要点を保持しながらそれぞれ50%程度に圧縮してください。
+            重要な情報を失わないよう注意してください。
+
+            出力は入力と同じ形式のJSONのみとし、各要素の "id" はそのまま、"text" を圧縮後のテキストにしてください。
+
+            {BATCH_INPUT_MARKER}
+            {json.dumps({"items": items}, ensure_ascii=False)}
+            """
+            
+            text = (await self._generate(prompt)).strip()
+            # コードブロックで囲まれた出力に対応
+            text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+            data = json.loads(text)
+            
+            originals = {element.id: element.content for element in elements}
+            compressed_by_id = {}
+            for item in data.get("items", []):
+                element_id = item.get("id")
+                compressed = str(item.get("text", "")).strip()
+                # 少なくとも10%削減できた要素のみ採用
+                if element_id in originals and compressed and len(compressed) < len(originals[element_id]) * 0.9:
+                    compressed_by_id[element_id] = compressed
+            
+            return compressed_by_id
+            
+        except Exception as e:
+            logger.error(f"Batch content compression failed: {str(e)}")
+            return {}
     
     async def _compress_single_content(self, content: str) -> Optional[str]:
         """単一コンテンツの圧縮"""
@@ -203,8 +564,7 @@ class ContextOptimizer:
             圧縮されたテキスト:
             """
             
-            response = self.model.generate_content(prompt)
-            compressed = response.text.strip()
+            compressed = (await self._generate(prompt)).strip()
             
             # 圧縮率をチェック
             if len(compressed) < len(content) * 0.9:  # 少なくとも10%削減
@@ -216,59 +576,51 @@ class ContextOptimizer:
             logger.error(f"Content compression failed: {str(e)}")
             return None
     
-    async def _remove_duplicates(self, window: ContextWindow) -> Dict[str, Any]:
-        """重複除去"""
-        
-        removed_duplicates = []
-        seen_content = set()
-        
-        for element in window.elements[:]:  # コピーを作成
-            # 内容の正規化（小文字化、空白除去）
-            normalized_content = re.sub(r'\s+', ' ', element.content.lower().strip())
-            
-            if normalized_content in seen_content:
-                if window.remove_element(element.id):
-                    removed_duplicates.append({
-                        "id": element.id,
-                        "type": element.type.value,
-                        "tokens": element.token_count,
-                        "content_preview": element.content[:100] + "..."
-                    })
-            else:
-                seen_content.add(normalized_content)
-        
-        return {
-            "strategy": "duplicate_removal",
-            "removed_count": len(removed_duplicates),
-            "removed_duplicates": removed_duplicates,
-            "tokens_saved": sum(elem["tokens"] for elem in removed_duplicates)
-        }
-    
     async def _optimize_for_clarity(self, window: ContextWindow) -> Dict[str, Any]:
         """明確性向上最適化"""
         
         improved_elements = []
         
-        for element in window.elements:
-            if len(element.content) > 100:  # 長いコンテンツのみ
-                improved_content = await self._improve_content_clarity(element.content)
-                
-                if improved_content and improved_content != element.content:
-                    element.content = improved_content
-                    improved_elements.append({
-                        "id": element.id,
-                        "type": element.type.value,
-                        "improvement_type": "clarity"
-                    })
+        # 長いコンテンツのみ並行に書き直し、結果は要素順に適用
+        targets = [element for element in window.elements if len(element.content) > 100]
+        originals = [element.content for element in targets]
+        report_work(len(targets))
+        
+        async def improve(content: str) -> Optional[str]:
+            improved = await self._improve_content_clarity(content)
+            report_done()
+            return improved
+        
+        improved_contents = await asyncio.gather(*(improve(content) for content in originals))
+        
+        # 書き直しの間に他の目標が削除・変更した要素には適用しない
+        present = {element.id for element in window.elements}
+        conflicts = 0
+        for element, original, improved_content in zip(targets, originals, improved_contents):
+            if element.id not in present or element.content is not original:
+                conflicts += 1
+                continue
+            if improved_content and improved_content != element.content:
+                element.content = improved_content
+                improved_elements.append({
+                    "id": element.id,
+                    "type": element.type.value,
+                    "improvement_type": "clarity"
+                })
         
         return {
             "strategy": "clarity_improvement",
             "improved_count": len(improved_elements),
-            "improved_elements": improved_elements
+            "improved_elements": improved_elements,
+            "skipped_conflicts": conflicts
         }
     
     async def _improve_content_clarity(self, content: str) -> Optional[str]:
         """コンテンツの明確性向上"""
+        cached = self.rewrite_cache.get("clarity", content)
+        if cached is not None:
+            return cached
+        
         try:
             prompt = f"""
             以下のテキストをより明確で理解しやすく書き直してください。
@@ -280,42 +632,85 @@ class ContextOptimizer:
             改善されたテキスト:
             """
             
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            improved = (await self._generate(prompt)).strip()
+            if not improved:
+                # 空の応答はキャッシュせず、書き換えなしとして扱う
+                return None
+            self.rewrite_cache.put("clarity", content, improved)
+            return improved
             
         except Exception as e:
             logger.error(f"Clarity improvement failed: {str(e)}")
             return None
     
-    async def _optimize_for_relevance(self, window: ContextWindow) -> Dict[str, Any]:
+    async def _optimize_for_relevance(self,
+                                      window: ContextWindow,
+                                      constraints: Dict[str, Any] = None,
+                                      cache: Optional[AnalysisCache] = None) -> Dict[str, Any]:
         """関連性向上最適化"""
         
         if not window.elements:
             return {"strategy": "relevance_enhancement", "changes": []}
         
-        # 主要トピックを特定
-        all_content = " ".join([elem.content for elem in window.elements])
-        main_topics = await self._extract_main_topics(all_content)
+        constraints = constraints or {}
+        relevance_mode = constraints.get("relevance_mode", "bm25")
+        if relevance_mode not in RELEVANCE_MODES:
+            raise ValueError(f"Invalid relevance_mode: {relevance_mode} (expected one of {', '.join(RELEVANCE_MODES)})")
+        mode = ordering_mode(constraints)
+        query = constraints.get("query")
+        elements = window.elements[:]
         
-        relevance_scores = []
-        reordered_elements = []
-        
-        # 各要素の関連性をスコア化
-        for element in window.elements:
-            relevance_score = await self._calculate_relevance_score(element.content, main_topics)
-            relevance_scores.append((element, relevance_score))
+        if relevance_mode == "bm25":
+            main_topics, scores = self._rank_relevance_locally(elements, query, cache=cache)
+        else:
+            # 主要トピックを特定
+            if query:
+                main_topics = [query]
+            else:
+                all_content = " ".join([elem.content for elem in window.elements])
+                main_topics = await self._extract_main_topics(all_content)
+            
+            # 各要素の関連性をスコア化
+            scores = []
+            report_work(len(elements))
+            for element in elements:
+                scores.append(await self._calculate_relevance_score(element.content, main_topics))
+                report_done()
         
-        # 関連性順に並び替え
-        relevance_scores.sort(key=lambda x: x[1], reverse=True)
-        window.elements = [elem for elem, score in relevance_scores]
+        # 関連性順に並び替え（同点は元の順序を保持）。採点中に他の目標が削除した要素は含めない
+        score_by_id = {element.id: score for element, score in zip(elements, scores)}
+        stable, volatile = split_stable(
+            window.elements, self.prefix_tracker.stable_ids(window) if mode == "prefix_stable" else set()
+        )
+        window.elements = stable + sorted(volatile, key=lambda elem: score_by_id.get(elem.id, 0.0), reverse=True)
         
         return {
             "strategy": "relevance_enhancement",
+            "relevance_mode": relevance_mode,
+            "ordering_mode": mode,
             "main_topics": main_topics,
             "element_count": len(window.elements),
+            "stable_prefix_elements": len(stable),
             "reordered": True
         }
     
+    def _rank_relevance_locally(self,
+                                elements: List[ContextElement],
+                                query: Optional[str] = None,
+                                topic_count: int = 10,
+                                cache: Optional[AnalysisCache] = None) -> Tuple[List[str], List[float]]:
+        """BM25による関連性スコア（クエリ未指定時はウィンドウ全体で重みの大きい語彙をトピックとする）"""
+        extract = cache.tokens if cache is not None else tokenize
+        index = BM25Index([extract(elem.content) for elem in elements])
+        if query:
+            topics = [query]
+            query_tokens = tokenize(query)
+        else:
+            topics = index.top_terms(topic_count)
+            query_tokens = topics
+        
+        return topics, index.score(query_tokens)
+    
     async def _extract_main_topics(self, content: str) -> List[str]:
         """主要トピック抽出"""
         try:
@@ -327,8 +722,8 @@ class ContextOptimizer:
             トピックのみを改行区切りで回答してください。
             """
             
-            response = self.model.generate_content(prompt)
-            topics = [topic.strip() for topic in response.text.strip().split('\n') if topic.strip()]
+            text = await self._generate(prompt)
+            topics = [topic.strip() for topic in text.strip().split('\n') if topic.strip()]
             return topics[:5]  # 最大5個
             
         except Exception as e:
@@ -351,89 +746,131 @@ class ContextOptimizer:
             関連性スコア（数値のみ）:
             """
             
-            response = self.model.generate_content(prompt)
-            score = float(response.text.strip())
+            score = float((await self._generate(prompt)).strip())
             return max(0.0, min(1.0, score))
             
         except Exception as e:
             logger.error(f"Relevance scoring failed: {str(e)}")
             return 0.5
     
-    async def _optimize_for_redundancy_removal(self, window: ContextWindow) -> Dict[str, Any]:
+    async def _optimize_for_redundancy_removal(self,
+                                             window: ContextWindow,
+                                             constraints: Dict[str, Any] = None,
+                                             cache: Optional[AnalysisCache] = None) -> Dict[str, Any]:
         """冗長性除去最適化"""
         
         # セマンティックな重複を検出
-        semantic_duplicates = await self._detect_semantic_duplicates(window.elements)
+        detection = await self._detect_semantic_duplicates(window.elements[:], constraints or {}, cache)
+        semantic_duplicates = [group for group in detection["groups"] if len(group) > 1]
+        
+        # 各グループのマージは並行に実行
+        originals = [[elem.content for elem in group] for group in semantic_duplicates]
+        report_work(len(originals))
+        
+        async def merge(contents: List[str]) -> str:
+            merged = await self._merge_similar_contents(contents)
+            report_done()
+            return merged
+        
+        merged_contents = await asyncio.gather(*(merge(contents) for contents in originals))
         
         merged_elements = []
         removed_elements = []
+        conflicts = 0
+        present = {elem.id for elem in window.elements}
         
-        for duplicate_group in semantic_duplicates:
-            if len(duplicate_group) > 1:
-                # 最も包括的な要素を選択し、他をマージ
-                primary_element = max(duplicate_group, key=lambda x: len(x.content))
-                other_elements = [elem for elem in duplicate_group if elem != primary_element]
-                
-                # 他の要素をマージ
-                merged_content = await self._merge_similar_contents([elem.content for elem in duplicate_group])
-                primary_element.content = merged_content
-                
-                # 他の要素を削除
-                for elem in other_elements:
-                    if window.remove_element(elem.id):
-                        removed_elements.append(elem.id)
-                
-                merged_elements.append(primary_element.id)
+        for duplicate_group, contents, merged_content in zip(semantic_duplicates, originals, merged_contents):
+            # マージ中に他の目標が削除・変更した要素を含むグループには適用しない
+            if any(elem.id not in present or elem.content is not content
+                   for elem, content in zip(duplicate_group, contents)):
+                conflicts += 1
+                continue
+            
+            # 最も包括的な要素を選択し、他をマージ
+            primary_element = max(duplicate_group, key=lambda x: len(x.content))
+            other_elements = [elem for elem in duplicate_group if elem != primary_element]
+            primary_element.content = merged_content
+            
+            # 他の要素を削除
+            for elem in other_elements:
+                if window.remove_element(elem.id):
+                    removed_elements.append(elem.id)
+            
+            merged_elements.append(primary_element.id)
         
         return {
             "strategy": "redundancy_removal",
             "merged_elements": len(merged_elements),
             "removed_elements": len(removed_elements),
-            "duplicate_groups": len(semantic_duplicates)
+            "duplicate_groups": len(semantic_duplicates),
+            "candidate_pairs": detection["candidate_pairs"],
+            "llm_confirmations": detection["llm_confirmations"],
+            "skipped_conflicts": conflicts
         }
     
-    async def _detect_semantic_duplicates(self, elements: List[ContextElement]) -> List[List[ContextElement]]:
-        """セマンティックな重複検出"""
+    async def _detect_semantic_duplicates(self,
+                                          elements: List[ContextElement],
+                                          constraints: Dict[str, Any],
+                                          cache: Optional[AnalysisCache] = None) -> Dict[str, Any]:
+        """セマンティックな重複検出（ローカルのベクトル類似度で判定し、境界領域のペアのみLLMで確認）"""
+        detection = {"groups": [], "candidate_pairs": 0, "llm_confirmations": 0}
         if len(elements) < 2:
-            return []
+            return detection
         
         try:
-            # 要素間の類似度を計算
-            similarity_matrix = []
-            for i, elem1 in enumerate(elements):
-                row = []
-                for j, elem2 in enumerate(elements):
-                    if i == j:
-                        row.append(1.0)
-                    else:
-                        similarity = await self._calculate_semantic_similarity(elem1.content, elem2.content)
-                        row.append(similarity)
-                similarity_matrix.append(row)
-            
-            # 類似度が高い要素をグループ化
-            duplicate_groups = []
-            processed = set()
-            
-            for i, similarities in enumerate(similarity_matrix):
-                if i in processed:
-                    continue
-                
-                group = [elements[i]]
-                processed.add(i)
-                
-                for j, similarity in enumerate(similarities):
-                    if j != i and j not in processed and similarity > 0.7:  # 70%以上の類似度
-                        group.append(elements[j])
-                        processed.add(j)
-                
-                if len(group) > 1:
-                    duplicate_groups.append(group)
+            duplicate_pairs, borderline_pairs = self._duplicate_candidate_pairs(elements, constraints, cache)
+            
+            async def confirm(i: int, j: int) -> bool:
+                similarity = await self._calculate_semantic_similarity(elements[i].content, elements[j].content)
+                report_done()
+                return similarity > 0.7  # 70%以上の類似度
+            
+            detection["candidate_pairs"] = len(duplicate_pairs) + len(borderline_pairs)
+            detection["llm_confirmations"] = len(borderline_pairs)
+            report_work(len(borderline_pairs))
+            confirmations = await asyncio.gather(*(confirm(i, j) for _, i, j in borderline_pairs))
+            duplicate_pairs.extend(
+                (i, j) for (_, i, j), confirmed in zip(borderline_pairs, confirmations) if confirmed
+            )
             
-            return duplicate_groups
+            # union-findで推移的にグループ化
+            detection["groups"] = [
+                [elements[index] for index in group]
+                for group in _group_pairs(len(elements), duplicate_pairs)
+            ]
+            return detection
             
         except Exception as e:
             logger.error(f"Semantic duplicate detection failed: {str(e)}")
-            return []
+            return detection
+    
+    def _duplicate_candidate_pairs(self,
+                                   elements: List[ContextElement],
+                                   constraints: Dict[str, Any],
+                                   cache: Optional[AnalysisCache] = None) -> Tuple[List[Tuple[int, int]], List[Tuple[float, int, int]]]:
+        """ローカル類似度による重複ペアと、LLMで確認する境界領域のペア（類似度の高い順・上限件数まで）"""
+        duplicate_threshold = constraints.get("duplicate_threshold", 0.8)
+        borderline_threshold = constraints.get("duplicate_borderline_threshold", 0.5)
+        max_confirmations = constraints.get("max_llm_confirmations", 50)
+        
+        # 要素ごとのハッシュ化文字n-gramベクトルから類似度行列を一括計算
+        # 要素数が多い場合は高頻出n-gramを無視した近似（転置インデックス）で候補ペアを絞る
+        vectors = char_ngram_vectors([elem.content for elem in elements], cache)
+        rows = similarity_matrix(vectors, None if len(elements) <= 200 else 64)
+        
+        duplicate_pairs = []
+        borderline_pairs = []
+        for i, row in enumerate(rows):
+            for j, similarity in row.items():
+                if j <= i:
+                    continue
+                if similarity >= duplicate_threshold:
+                    duplicate_pairs.append((i, j))
+                elif similarity >= borderline_threshold:
+                    borderline_pairs.append((similarity, i, j))
+        
+        borderline_pairs.sort(key=lambda x: (-x[0], x[1], x[2]))
+        return duplicate_pairs, borderline_pairs[:max_confirmations]
     
     async def _calculate_semantic_similarity(self, content1: str, content2: str) -> float:
         """セマンティック類似度計算"""
@@ -447,8 +884,7 @@ class ContextOptimizer:
             類似度（数値のみ）:
             """
             
-            response = self.model.generate_content(prompt)
-            similarity = float(response.text.strip())
+            similarity = float((await self._generate(prompt)).strip())
             return max(0.0, min(1.0, similarity))
             
         except Exception as e:
@@ -457,6 +893,12 @@ class ContextOptimizer:
     
     async def _merge_similar_contents(self, contents: List[str]) -> str:
         """類似コンテンツのマージ"""
+        # マージ対象の組み合わせ（順序を含む）ごとにキャッシュ
+        cache_key = json.dumps(contents, ensure_ascii=False)
+        cached = self.rewrite_cache.get("merge", cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             contents_text = "\n\n".join([f"テキスト{i+1}: {content}" for i, content in enumerate(contents)])
             
@@ -469,68 +911,269 @@ class ContextOptimizer:
             統合されたテキスト:
             """
             
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            merged = (await self._generate(prompt)).strip()
+            if not merged:
+                return contents[0] if contents else ""
+            self.rewrite_cache.put("merge", cache_key, merged)
+            return merged
             
         except Exception as e:
             logger.error(f"Content merging failed: {str(e)}")
             return contents[0] if contents else ""
     
-    async def _optimize_for_structure(self, window: ContextWindow) -> Dict[str, Any]:
-        """構造最適化"""
-        
-        # 要素タイプ別に分類
-        type_groups = {}
-        for element in window.elements:
-            element_type = element.type.value
-            if element_type not in type_groups:
-                type_groups[element_type] = []
-            type_groups[element_type].append(element)
-        
-        # 最適な順序を決定
-        optimal_order = ["system", "user", "assistant", "function", "tool"]
-        reordered_elements = []
-        
-        for element_type in optimal_order:
-            if element_type in type_groups:
-                # 同タイプ内では優先度順、作成日順でソート
-                type_elements = sorted(
-                    type_groups[element_type],
-                    key=lambda x: (x.priority, x.created_at),
-                    reverse=True
-                )
-                reordered_elements.extend(type_elements)
-        
-        # 分類されなかった要素を追加
-        for element_type, elements in type_groups.items():
-            if element_type not in optimal_order:
-                reordered_elements.extend(elements)
+    async def _optimize_for_structure(self, window: ContextWindow, constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """構造最適化（structure_order・type_order の指定による1回の安定ソート。ordering_mode で接頭辞を固定）"""
         
+        spec = OrderingSpec.from_constraints(constraints)
+        mode = ordering_mode(constraints)
+        original_elements = window.elements
+        # prefix_stable では安定した要素を現在の順序のまま先頭に置き、残りだけを並び替える
+        stable, volatile = split_stable(
+            original_elements, self.prefix_tracker.stable_ids(window) if mode == "prefix_stable" else set()
+        )
+        reordered_elements = stable + spec.sort(volatile)
+        moved = sum(1 for before, after in zip(original_elements, reordered_elements) if before is not after)
         window.elements = reordered_elements
         
         return {
             "strategy": "structure_optimization",
-            "type_groups": {k: len(v) for k, v in type_groups.items()},
-            "reordered": True,
-            "optimal_order_applied": optimal_order
+            "ordering": spec.to_dict(),
+            "ordering_mode": mode,
+            "stable_prefix_elements": len(stable),
+            "type_groups": dict(Counter(element.type.value for element in reordered_elements)),
+            "reordered": moved > 0,
+            "moved_elements": moved
         }
     
+    def plan_optimization(self,
+                          window: ContextWindow,
+                          optimization_goals: List[str],
+                          constraints: Dict[str, Any] = None,
+                          session_id: Optional[str] = None,
+                          priority: str = "normal",
+                          timeout_seconds: Optional[float] = None) -> OptimizationPlan:
+        """最適化のドライラン（ウィンドウを変更せずにLLM呼び出し数・トークン数・削減量・所要時間を見積もる）
+        
+        各目標は現在のウィンドウに対して見積もるため、先行する目標による変化は反映しない。
+        """
+        constraints = constraints or {}
+        plan = OptimizationPlan(
+            context_id=window.id,
+            goals=unique_goals(optimization_goals),
+            constraints=constraints,
+            session_id=session_id,
+            priority=priority,
+            timeout_seconds=timeout_seconds,
+            window_fingerprint=window.fingerprint
+        )
+        
+        estimators = {
+            "reduce_tokens": self._estimate_token_reduction,
+            "improve_clarity": self._estimate_clarity,
+            "enhance_relevance": self._estimate_relevance,
+            "remove_redundancy": self._estimate_redundancy_removal,
+            "improve_structure": self._estimate_structure
+        }
+        
+        dependencies = self.goal_executor.dependencies(plan.goals)
+        for goal, depends_on in zip(plan.goals, dependencies):
+            estimator = estimators.get(goal)
+            step = estimator(window, constraints) if estimator else self._plan_step(note="unknown goal (skipped)")
+            plan.steps.append({"goal": goal, "depends_on": depends_on, **step})
+        
+        self.optimization_plans[plan.id] = plan
+        while len(self.optimization_plans) > MAX_OPTIMIZATION_PLANS:
+            self.optimization_plans.popitem(last=False)
+        
+        return plan
+    
+    async def execute_plan(self, plan_id: str, window: ContextWindow) -> OptimizationTask:
+        """計画を最適化タスクとして実行"""
+        plan = self.optimization_plans.get(plan_id)
+        if plan is None:
+            raise KeyError(plan_id)
+        if plan.status != PlanStatus.PENDING:
+            raise ValueError(f"Plan already {plan.status.value}")
+        
+        task = await self.optimize_context_window(
+            window, plan.goals, plan.constraints,
+            session_id=plan.session_id,
+            priority=plan.priority,
+            timeout_seconds=plan.timeout_seconds
+        )
+        task.parameters["plan_id"] = plan.id
+        plan.status = PlanStatus.EXECUTED
+        plan.task_id = task.id
+        return task
+    
+    def reject_plan(self, plan_id: str) -> OptimizationPlan:
+        """計画を却下"""
+        plan = self.optimization_plans.get(plan_id)
+        if plan is None:
+            raise KeyError(plan_id)
+        if plan.status != PlanStatus.PENDING:
+            raise ValueError(f"Plan already {plan.status.value}")
+        
+        plan.status = PlanStatus.REJECTED
+        return plan
+    
+    def _plan_step(self,
+                   concurrent_calls: List[Tuple[float, float]] = (),
+                   sequential_calls: List[Tuple[float, float]] = (),
+                   expected_token_savings: float = 0.0,
+                   **details) -> Dict[str, Any]:
+        """(プロンプトトークン数, 出力トークン数) の呼び出し一覧から見積もりを作成"""
+        # 並行呼び出しは同時実行数ごとの波で進むため、長い順に並べた各波の先頭（最長）の合計
+        durations = sorted((self.latency_model.estimate(response) for _, response in concurrent_calls), reverse=True)
+        seconds = sum(durations[::max(self.llm_concurrency, 1)])
+        seconds += sum(self.latency_model.estimate(response) for _, response in sequential_calls)
+        
+        calls = list(concurrent_calls) + list(sequential_calls)
+        return {
+            "llm_calls": len(calls),
+            "prompt_tokens": sum(prompt for prompt, _ in calls),
+            "response_tokens": sum(response for _, response in calls),
+            "expected_token_savings": expected_token_savings,
+            "estimated_seconds": seconds,
+            **{key: value for key, value in details.items() if value is not None}
+        }
+    
+    def _estimate_token_reduction(self, window: ContextWindow, constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """トークン削減の見積もり（_optimize_for_token_reduction と同じ候補から1ラウンド分を選ぶ）"""
+        compress_mode = constraints.get("compress_mode", "llm")
+        batching = constraints.get("compression_batching", True)
+        batch_tokens = constraints.get("compression_batch_tokens", 3000)
+        cost_model = ReductionCostModel.from_constraints(constraints)
+        
+        original_tokens = window.current_tokens
+        target_tokens = _reduction_target(original_tokens, constraints)
+        needed = original_tokens - target_tokens
+        
+        selected = []
+        if needed > 0:
+            ranked = rank_actions(self._reduction_candidates(window.elements, constraints, cost_model))
+            selected = select_actions(ranked, needed, set(), set())
+        expected_savings = min(max(needed, 0), sum(action.expected_savings for action in selected))
+        
+        # キャッシュ済みの要素はLLMを呼び出さない
+        elements_by_id = {element.id: element for element in window.elements}
+        compressed = [elements_by_id[action.element_id] for action in selected if action.kind == "llm_compress"]
+        uncached = [elem for elem in compressed if not self.rewrite_cache.contains("compress", elem.content)]
+        calls = []
+        position = 0
+        while position < len(uncached):
+            batch = self._next_compression_batch(uncached, position, batch_tokens) if batching else uncached[position:position + 1]
+            position += len(batch)
+            input_tokens = sum(estimate_prompt_tokens(elem.content) for elem in batch)
+            overhead = COMPRESSION_PROMPT_OVERHEAD_TOKENS if len(batch) > 1 else SINGLE_PROMPT_OVERHEAD_TOKENS
+            calls.append((input_tokens + overhead, input_tokens * EXPECTED_COMPRESSION_SAVINGS))
+        
+        action_counts = Counter(action.kind for action in selected)
+        return self._plan_step(
+            concurrent_calls=calls,
+            expected_token_savings=expected_savings,
+            target_tokens=target_tokens,
+            actions={kind: action_counts[kind] for kind in REDUCTION_ACTIONS if action_counts[kind]},
+            removed_elements=action_counts["dedup"] + action_counts["drop"],
+            compressed_elements=action_counts["local_compress"] + len(compressed),
+            cached_elements=len(compressed) - len(uncached),
+            compress_mode=compress_mode,
+            note="batch parse failures add one fallback call per element" if calls and batching else None
+        )
+    
+    def _estimate_clarity(self, window: ContextWindow, constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """明確性向上の見積もり（キャッシュにない長い要素ごとに1回の並行書き換え）"""
+        targets = [elem for elem in window.elements if len(elem.content) > 100]
+        calls = [
+            (estimate_prompt_tokens(elem.content) + SINGLE_PROMPT_OVERHEAD_TOKENS, estimate_prompt_tokens(elem.content))
+            for elem in targets if not self.rewrite_cache.contains("clarity", elem.content)
+        ]
+        return self._plan_step(
+            concurrent_calls=calls,
+            rewritten_elements=len(targets),
+            cached_elements=len(targets) - len(calls)
+        )
+    
+    def _estimate_relevance(self, window: ContextWindow, constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """関連性向上の見積もり（llmモードはトピック抽出1回と要素ごとの逐次スコアリング）"""
+        relevance_mode = constraints.get("relevance_mode", "bm25")
+        if not window.elements or relevance_mode != "llm":
+            return self._plan_step(relevance_mode=relevance_mode)
+        
+        calls = []
+        if not constraints.get("query"):
+            all_content = " ".join(elem.content for elem in window.elements)
+            calls.append((estimate_prompt_tokens(all_content) + SINGLE_PROMPT_OVERHEAD_TOKENS, 30.0))
+        calls.extend(
+            (estimate_prompt_tokens(elem.content[:500]) + SINGLE_PROMPT_OVERHEAD_TOKENS, 5.0)
+            for elem in window.elements
+        )
+        return self._plan_step(sequential_calls=calls, relevance_mode=relevance_mode, scored_elements=len(window.elements))
+    
+    def _estimate_redundancy_removal(self, window: ContextWindow, constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """冗長性除去の見積もり（境界ペアの確認がすべて重複と判定された場合の上限）"""
+        elements = window.elements
+        if len(elements) < 2:
+            return self._plan_step()
+        
+        duplicate_pairs, borderline_pairs = self._duplicate_candidate_pairs(elements, constraints)
+        confirm_calls = [
+            (estimate_prompt_tokens(elements[i].content[:300]) + estimate_prompt_tokens(elements[j].content[:300])
+             + SINGLE_PROMPT_OVERHEAD_TOKENS, 5.0)
+            for _, i, j in borderline_pairs
+        ]
+        
+        groups = _group_pairs(len(elements), duplicate_pairs + [(i, j) for _, i, j in borderline_pairs])
+        merge_calls = []
+        cached_merges = 0
+        savings = 0.0
+        for group in groups:
+            group_elements = [elements[index] for index in group]
+            savings += sum(elem.token_count for elem in group_elements) - max(elem.token_count for elem in group_elements)
+            if self.rewrite_cache.contains("merge", json.dumps([elem.content for elem in group_elements], ensure_ascii=False)):
+                cached_merges += 1
+                continue
+            merge_calls.append((
+                sum(estimate_prompt_tokens(elem.content) for elem in group_elements) + SINGLE_PROMPT_OVERHEAD_TOKENS,
+                max(estimate_prompt_tokens(elem.content) for elem in group_elements)
+            ))
+        
+        # 確認の後にグループごとのマージを並行に実行
+        confirm_step = self._plan_step(concurrent_calls=confirm_calls)
+        merge_step = self._plan_step(concurrent_calls=merge_calls)
+        step = self._plan_step(
+            concurrent_calls=confirm_calls + merge_calls,
+            expected_token_savings=savings,
+            duplicate_pairs=len(duplicate_pairs),
+            borderline_pairs=len(borderline_pairs),
+            duplicate_groups=len(groups),
+            cached_merges=cached_merges
+        )
+        step["estimated_seconds"] = confirm_step["estimated_seconds"] + merge_step["estimated_seconds"]
+        return step
+    
+    def _estimate_structure(self, window: ContextWindow, constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """構造最適化の見積もり（LLM呼び出しなし）"""
+        return self._plan_step(
+            ordering=OrderingSpec.from_constraints(constraints).to_dict(),
+            ordering_mode=ordering_mode(constraints)
+        )
+    
     def get_optimization_task(self, task_id: str) -> Optional[OptimizationTask]:
         """最適化タスクを取得"""
         return self.optimization_tasks.get(task_id)
     
-    def list_optimization_tasks(self, context_id: Optional[str] = None) -> List[OptimizationTask]:
-        """最適化タスク一覧を取得"""
-        tasks = list(self.optimization_tasks.values())
-        
-        if context_id:
-            tasks = [task for task in tasks if task.context_id == context_id]
-        
-        # 作成日時順でソート
-        tasks.sort(key=lambda x: x.created_at, reverse=True)
-        return tasks
+    def get_archived_optimization_task(self, task_id: str) -> Optional[ArchivedTask]:
+        """保持期間を過ぎて圧縮形式になった最適化タスクを取得"""
+        return self.optimization_tasks.get_archived(task_id)
+    
+    def list_optimization_tasks(self,
+                                context_id: Optional[str] = None,
+                                include_archived: bool = False) -> List[Any]:
+        """最適化タスク一覧を取得（新しい順）"""
+        return self.optimization_tasks.list(context_id, include_archived)
     
-    async def auto_optimize_context(self, window: ContextWindow) -> Dict[str, Any]:
+    async def auto_optimize_context(self, window: ContextWindow, session_id: Optional[str] = None) -> Dict[str, Any]:
         """自動最適化（すべての最適化を適用）"""
         
         analysis_prompt = f"""
@@ -563,14 +1206,17 @@ class ContextOptimizer:
         """
         
         try:
-            response = self.model.generate_content(analysis_prompt)
-            recommendations = json.loads(response.text)
+            recommendations = json.loads(await self._generate(analysis_prompt))
+            # 推奨優先度 high|medium|low をスケジューラの優先度クラスに対応付け
+            priority = recommendations.get("priority")
             
             # 推奨された最適化を実行
             task = await self.optimize_context_window(
                 window,
                 recommendations["recommended_goals"],
-                recommendations.get("constraints", {})
+                recommendations.get("constraints", {}),
+                session_id=session_id,
+                priority=priority if priority in ("high", "low") else "normal"
             )
             
             return {
@@ -0,0 +1,172 @@
+import hashlib
+from collections import OrderedDict
+from operator import attrgetter
+from typing import Dict, List, Any, Sequence, Tuple, Set
+
+from context_models import ContextWindow, ContextElement, ContextType
+
+# 構造最適化の既定の並び順（タイプ順 → 優先度の高い順 → 新しい順）
+DEFAULT_ORDERING = ("type", "-priority", "-created_at")
+
+# 要素タイプの既定の順位（含まれないタイプはその後ろにタイプ名順）
+DEFAULT_TYPE_ORDER = ("system", "memory", "user", "assistant", "function", "tool")
+
+# 並び順に指定できるキー（"-" を付けると降順）
+ORDERING_KEYS = ("pinned", "type", "priority", "created_at", "updated_at")
+
+# 並び替えの方式: free（全要素を並び替え）, prefix_stable（安定した要素を先頭に固定し、残りの要素だけを並び替え）
+ORDERING_MODES = ("free", "prefix_stable")
+
+def ordering_mode(constraints: Dict[str, Any]) -> str:
+    mode = constraints.get("ordering_mode", "free")
+    if mode not in ORDERING_MODES:
+        raise ValueError(f"Invalid ordering_mode: {mode} (expected one of {', '.join(ORDERING_MODES)})")
+    return mode
+
+def is_marked_stable(element: ContextElement) -> bool:
+    """常に先頭に固定する要素か（システム・テンプレート要素、または metadata の stable・stable タグ）"""
+    return (
+        element.type == ContextType.SYSTEM
+        or "template_id" in element.metadata
+        or bool(element.metadata.get("stable"))
+        or "stable" in element.tags
+    )
+
+def is_pinned(element: ContextElement) -> bool:
+    """固定指定された要素か（metadata の pinned または pinned タグ）"""
+    return bool(element.metadata.get("pinned")) or "pinned" in element.tags
+
+class OrderingSpec:
+    """要素の並び順の指定
+
+    キーの値は要素ごとに1回だけ計算し、グループ分けせずに全要素をまとめて安定ソートする。
+    キーが同じ要素は現在の順序を保つため、同じウィンドウに対する結果は常に同じになる。
+    pinned は固定指定された要素を先頭に（-pinned で末尾に）置く。
+    """
+
+    def __init__(self,
+                 keys: Sequence[str] = DEFAULT_ORDERING,
+                 type_order: Sequence[str] = DEFAULT_TYPE_ORDER):
+        self.keys: List[Tuple[str, bool]] = []
+        for key in keys:
+            descending = key.startswith("-")
+            name = key[1:] if descending else key
+            if name not in ORDERING_KEYS:
+                raise ValueError(f"Unknown ordering key: {name} (expected one of {', '.join(ORDERING_KEYS)})")
+            self.keys.append((name, descending))
+
+        known = {context_type.value for context_type in ContextType}
+        unknown = [value for value in type_order if value not in known]
+        if unknown:
+            raise ValueError(f"Unknown element types in type_order: {', '.join(unknown)}")
+        self.type_order = list(dict.fromkeys(type_order))
+        # 指定のないタイプはタイプ名順に後ろへ
+        ranked = self.type_order + sorted(known - set(self.type_order))
+        self._type_ranks: Dict[ContextType, int] = {ContextType(value): rank for rank, value in enumerate(ranked)}
+
+    @classmethod
+    def from_constraints(cls, constraints: Dict[str, Any]) -> "OrderingSpec":
+        return cls(
+            constraints.get("structure_order", DEFAULT_ORDERING),
+            constraints.get("type_order", DEFAULT_TYPE_ORDER)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "keys": [("-" if descending else "") + name for name, descending in self.keys],
+            "type_order": self.type_order
+        }
+
+    def _column(self, name: str, elements: List[ContextElement]) -> List[Any]:
+        """要素ごとのキーの値（昇順で並べる値）"""
+        if name == "pinned":
+            return [0 if is_pinned(element) else 1 for element in elements]
+        if name == "type":
+            ranks = self._type_ranks
+            return [ranks[context_type] for context_type in map(attrgetter("type"), elements)]
+        return list(map(attrgetter(name), elements))
+
+    def sort(self, elements: List[ContextElement]) -> List[ContextElement]:
+        """並べ替えた新しいリスト
+
+        キーごとの値の列を1回だけ計算し、下位のキーから順に番号列を安定ソートする
+        （辞書式順序のソートと同じ結果。reverse=True でも同じキーの要素の順序は保たれる）。
+        """
+        order = list(range(len(elements)))
+        for name, descending in reversed(self.keys):
+            order.sort(key=self._column(name, elements).__getitem__, reverse=descending)
+        return [elements[index] for index in order]
+
+def split_stable(elements: List[ContextElement], stable_ids: Set[str]) -> Tuple[List[ContextElement], List[ContextElement]]:
+    """安定した要素と変動する要素に分ける（それぞれ現在の順序を保つ）"""
+    stable = [element for element in elements if element.id in stable_ids]
+    volatile = [element for element in elements if element.id not in stable_ids]
+    return stable, volatile
+
+def format_element(element: ContextElement) -> str:
+    return f"[{element.type.value}] {element.content}"
+
+class PrefixTracker:
+    """ウィンドウごとに直前に組み立てたプロンプトの要素列を記録し、安定した接頭辞を求める
+
+    安定した要素は、固定指定の要素と、直前のプロンプトに含まれ内容が変わっていない履歴の要素。
+    prefix_stable の並び替えではこれらを現在の順序のまま先頭に置くため、プロンプトは末尾への追加だけで
+    変化し、プロバイダ側のプレフィックスキャッシュが効く。
+    """
+
+    def __init__(self, max_windows: int = 10000):
+        self.max_windows = max_windows
+        # ウィンドウID -> 直前のプロンプトの (要素ID, 内容)
+        self._last: "OrderedDict[str, List[Tuple[str, str]]]" = OrderedDict()
+
+    def stable_ids(self, window: ContextWindow) -> Set[str]:
+        """先頭に固定する要素のID"""
+        stable = {element.id for element in window.elements if is_marked_stable(element)}
+        previous = self._last.get(window.id)
+        if previous:
+            current = {element.id: element.content for element in window.elements}
+            stable.update(element_id for element_id, content in previous if current.get(element_id) == content)
+        return stable
+
+    def assemble(self, window: ContextWindow) -> Dict[str, Any]:
+        """現在の順序でプロンプトを組み立て、安定した接頭辞のトークン数と指紋を返す（組み立てた要素列を記録）
+
+        安定した接頭辞は、固定指定の要素か直前のプロンプトと同じ位置・内容の要素が先頭から続く部分。
+        """
+        previous = self._last.get(window.id, [])
+        prefix_length = 0
+        for position, element in enumerate(window.elements):
+            unchanged = position < len(previous) and previous[position] == (element.id, element.content)
+            if not (unchanged or is_marked_stable(element)):
+                break
+            prefix_length += 1
+
+        parts = [format_element(element) for element in window.elements]
+        digest = hashlib.sha256()
+        for part in parts[:prefix_length]:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\n\n")
+
+        # 直前のプロンプトと先頭から一致する要素（プロバイダのキャッシュに載っている見込みの部分）
+        reused = 0
+        for element, (element_id, content) in zip(window.elements, previous):
+            if element.id != element_id or element.content != content:
+                break
+            reused += 1
+
+        self._last[window.id] = [(element.id, element.content) for element in window.elements]
+        self._last.move_to_end(window.id)
+        while len(self._last) > self.max_windows:
+            self._last.popitem(last=False)
+
+        return {
+            "window_id": window.id,
+            "prompt": "\n\n".join(parts),
+            "total_tokens": window.current_tokens,
+            "stable_prefix_elements": prefix_length,
+            "stable_prefix_tokens": sum(element.token_count for element in window.elements[:prefix_length]),
+            "stable_prefix_fingerprint": digest.hexdigest(),
+            "reused_prefix_elements": reused,
+            "reused_prefix_tokens": sum(element.token_count for element in window.elements[:reused]),
+            "volatile_elements": len(window.elements) - prefix_length
+        }
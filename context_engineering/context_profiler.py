@@ -0,0 +1,224 @@
+import time
+import bisect
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional, Iterator
+
+# 現在計測中のステージ（LLM呼び出し・キャッシュヒットの記録先）
+_current_stage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_profile_stage", default=None)
+
+# ミリ秒単位のヒストグラム境界
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+# 文字数単位のヒストグラム境界
+DEFAULT_BUCKETS_CHARS = (100, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+
+def record_llm_call(prompt_chars: int, response_chars: int):
+    """現在のステージにLLM呼び出しを記録"""
+    stage = _current_stage.get()
+    if stage is not None:
+        stage["llm_calls"] += 1
+        stage["prompt_chars"] += prompt_chars
+        stage["response_chars"] += response_chars
+
+def record_cache_hit():
+    """現在のステージにキャッシュヒットを記録"""
+    stage = _current_stage.get()
+    if stage is not None:
+        stage["cache_hits"] += 1
+
+class AnalysisProfiler:
+    """分析1回分のステージ別計測"""
+
+    def __init__(self):
+        self.stages: List[Dict[str, Any]] = []
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """ステージの実行時間（wall/CPU）を計測"""
+        record = {
+            "stage": name,
+            "wall_ms": 0.0,
+            "cpu_ms": 0.0,
+            "llm_calls": 0,
+            "prompt_chars": 0,
+            "response_chars": 0,
+            "cache_hits": 0
+        }
+        token = _current_stage.set(record)
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            yield record
+        finally:
+            # 非同期ステージのCPU時間は同一スレッド上の他タスクを含む概算値
+            record["wall_ms"] = (time.perf_counter() - wall_started) * 1000
+            record["cpu_ms"] = (time.thread_time() - cpu_started) * 1000
+            _current_stage.reset(token)
+            self.stages.append(record)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_wall_ms": (time.perf_counter() - self._started) * 1000,
+            "llm_calls": sum(stage["llm_calls"] for stage in self.stages),
+            "prompt_chars": sum(stage["prompt_chars"] for stage in self.stages),
+            "response_chars": sum(stage["response_chars"] for stage in self.stages),
+            "cache_hits": sum(stage["cache_hits"] for stage in self.stages),
+            "stages": list(self.stages)
+        }
+
+class Histogram:
+    """固定バケットのヒストグラム"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """バケット上限による分位点の近似"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}" for bound in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+class ProfileRegistry:
+    """ステージ別計測結果のヒストグラム集計"""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.analyses = 0
+        self.cache_hits = 0
+        self.total_wall_ms = Histogram()
+
+    def record(self, profile: Dict[str, Any]):
+        """分析1回分のプロファイルを集計"""
+        if profile.get("cache_hit"):
+            # 再利用された分析結果は計測済みのため件数のみ加算
+            self.cache_hits += 1
+            return
+
+        self.analyses += 1
+        self.total_wall_ms.observe(profile.get("total_wall_ms", 0.0))
+        for stage in profile.get("stages", []):
+            self.record_stage(stage)
+
+    def record_stage(self, stage: Dict[str, Any]):
+        """ステージ1件を集計"""
+        aggregate = self.stages.get(stage["stage"])
+        if aggregate is None:
+            aggregate = self.stages[stage["stage"]] = {
+                "wall_ms": Histogram(),
+                "cpu_ms": Histogram(),
+                "prompt_chars": Histogram(DEFAULT_BUCKETS_CHARS),
+                "response_chars": Histogram(DEFAULT_BUCKETS_CHARS),
+                "llm_calls": 0,
+                "cache_hits": 0
+            }
+
+        aggregate["wall_ms"].observe(stage["wall_ms"])
+        aggregate["cpu_ms"].observe(stage["cpu_ms"])
+        if stage["llm_calls"]:
+            aggregate["prompt_chars"].observe(stage["prompt_chars"])
+            aggregate["response_chars"].observe(stage["response_chars"])
+        aggregate["llm_calls"] += stage["llm_calls"]
+        aggregate["cache_hits"] += stage["cache_hits"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "analyses": self.analyses,
+            "cache_hits": self.cache_hits,
+            "total_wall_ms": self.total_wall_ms.to_dict(),
+            "stages": {
+                name: {
+                    key: value.to_dict() if isinstance(value, Histogram) else value
+                    for key, value in aggregate.items()
+                }
+                for name, aggregate in self.stages.items()
+            }
+        }
+
+class LatencyModel:
+    """LLM呼び出しの所要時間モデル（秒 = 固定遅延 + 出力トークンあたりの生成時間）を直近の実測値から推定
+
+    係数は実測値が追加されたときだけ推定し直す（estimate は削減計画の候補ごとに呼ばれるため）。
+    """
+
+    def __init__(self,
+                 default_base_seconds: float = 1.0,
+                 default_seconds_per_token: float = 0.01,
+                 max_samples: int = 500,
+                 min_samples: int = 10):
+        self.default_base_seconds = default_base_seconds
+        self.default_seconds_per_token = default_seconds_per_token
+        self.min_samples = min_samples
+        self.samples: deque = deque(maxlen=max_samples)  # (出力トークン数, 秒)
+        self._fitted: Optional[Dict[str, float]] = None
+
+    def observe(self, response_tokens: float, seconds: float):
+        self.samples.append((response_tokens, seconds))
+        self._fitted = None
+
+    def coefficients(self) -> Dict[str, float]:
+        """最小二乗法で固定遅延とトークンあたりの時間を推定（実測が少ない場合は既定値）"""
+        if self._fitted is None:
+            self._fitted = self._fit()
+        return dict(self._fitted)
+
+    def _fit(self) -> Dict[str, float]:
+        count = len(self.samples)
+        if count < self.min_samples:
+            return {
+                "base_seconds": self.default_base_seconds,
+                "seconds_per_token": self.default_seconds_per_token,
+                "samples": count
+            }
+
+        mean_tokens = sum(tokens for tokens, _ in self.samples) / count
+        mean_seconds = sum(seconds for _, seconds in self.samples) / count
+        variance = sum((tokens - mean_tokens) ** 2 for tokens, _ in self.samples)
+        covariance = sum((tokens - mean_tokens) * (seconds - mean_seconds) for tokens, seconds in self.samples)
+        per_token = max(covariance / variance, 0.0) if variance else 0.0
+        return {
+            "base_seconds": max(mean_seconds - per_token * mean_tokens, 0.0),
+            "seconds_per_token": per_token,
+            "samples": count
+        }
+
+    def estimate(self, response_tokens: float) -> float:
+        """出力トークン数から1回の呼び出しの所要秒数を推定"""
+        if self._fitted is None:
+            self._fitted = self._fit()
+        coefficients = self._fitted
+        return coefficients["base_seconds"] + coefficients["seconds_per_token"] * response_tokens
@@ -0,0 +1,98 @@
+from dataclasses import dataclass, fields
+from typing import Dict, List, Any, Optional, NamedTuple, Set
+
+# トークン削減アクションの種類
+REDUCTION_ACTIONS = ("dedup", "drop", "local_compress", "llm_compress")
+
+# コストが0のアクション（ローカルの重複除去など）の効率を有限にするための下限
+MIN_ACTION_COST = 1e-6
+
+@dataclass
+class ReductionCostModel:
+    """トークン削減アクションのコスト（秒換算）
+
+    コスト = 所要秒数 × seconds_weight + LLMトークン数 × llm_token_weight
+           + 失われるトークン数 × 優先度/10 × information_loss_weight
+    """
+    seconds_weight: float = 1.0
+    llm_token_weight: float = 0.001
+    information_loss_weight: float = 0.05
+    # 圧縮で削減したトークンのうち情報として失われる割合
+    llm_compress_loss: float = 0.2
+    local_compress_loss: float = 0.5
+
+    @classmethod
+    def from_constraints(cls, constraints: Dict[str, Any]) -> "ReductionCostModel":
+        """制約の reduction_weights で重みを上書き"""
+        weights = constraints.get("reduction_weights") or {}
+        known = {field.name for field in fields(cls)}
+        unknown = set(weights) - known
+        if unknown:
+            raise ValueError(f"Unknown reduction_weights: {', '.join(sorted(unknown))} (expected {', '.join(sorted(known))})")
+        return cls(**{name: float(value) for name, value in weights.items()})
+
+    def cost(self, seconds: float, llm_tokens: float, lost_tokens: float, priority: int) -> float:
+        return (
+            seconds * self.seconds_weight
+            + llm_tokens * self.llm_token_weight
+            + lost_tokens * priority / 10 * self.information_loss_weight
+        )
+
+class ReductionAction(NamedTuple):
+    """要素1つに対するトークン削減アクションの候補"""
+    kind: str
+    element_id: str
+    expected_savings: float
+    seconds: float
+    llm_tokens: float
+    cost: float
+    # dedup の場合に残す要素
+    duplicate_of: Optional[str] = None
+    # dedup の場合の重複元との類似度
+    similarity: Optional[float] = None
+
+    @property
+    def benefit_per_cost(self) -> float:
+        """コストあたりの期待削減トークン数"""
+        return self.expected_savings / max(self.cost, MIN_ACTION_COST)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "action": self.kind,
+            "element_id": self.element_id,
+            "expected_tokens_saved": self.expected_savings,
+            "estimated_seconds": self.seconds,
+            "llm_tokens": self.llm_tokens,
+            "cost": self.cost,
+            "benefit_per_cost": self.benefit_per_cost,
+            **({"duplicate_of": self.duplicate_of} if self.duplicate_of else {}),
+            **({"similarity": self.similarity} if self.similarity is not None else {})
+        }
+
+def rank_actions(actions: List[ReductionAction]) -> List[ReductionAction]:
+    """コストあたりの削減量が大きい順（同等なら削減量の大きい順）"""
+    return sorted(actions, key=lambda action: (-action.benefit_per_cost, -action.expected_savings))
+
+def select_actions(ranked: List[ReductionAction],
+                   needed: float,
+                   taken: Set[str],
+                   protected: Set[str]) -> List[ReductionAction]:
+    """期待削減量が needed に届くまで効率の良い順にアクションを選ぶ（貪欲法）
+
+    要素ごとにアクションは1つまで（taken に記録）。重複除去で残す要素（protected）は削除しない。
+    """
+    selected = []
+    expected = 0.0
+    for action in ranked:
+        if expected >= needed:
+            break
+        if action.element_id in taken or action.expected_savings <= 0:
+            continue
+        if action.kind == "drop" and action.element_id in protected:
+            continue
+        selected.append(action)
+        taken.add(action.element_id)
+        if action.duplicate_of is not None:
+            protected.add(action.duplicate_of)
+        expected += action.expected_savings
+    return selected
@@ -0,0 +1,102 @@
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Iterator, Tuple
+
+# 現在のタスクのキャッシュ利用状況（戦略 -> ヒット数・ミス数）
+_current_stats: ContextVar[Optional[Dict[str, Dict[str, int]]]] = ContextVar("rewrite_cache_stats", default=None)
+
+@contextmanager
+def track_rewrite_cache() -> Iterator[Dict[str, Dict[str, int]]]:
+    """ブロック内（そこから起動した非同期タスクを含む）のキャッシュ利用状況を記録"""
+    stats: Dict[str, Dict[str, int]] = {}
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+def summarize_cache_stats(stats: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """戦略ごとと全体のヒット率"""
+    def ratio(hits: int, misses: int) -> float:
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    summary: Dict[str, Any] = {
+        strategy: {**counts, "hit_ratio": ratio(counts["hits"], counts["misses"])}
+        for strategy, counts in stats.items()
+    }
+    hits = sum(counts["hits"] for counts in stats.values())
+    misses = sum(counts["misses"] for counts in stats.values())
+    summary["total"] = {"hits": hits, "misses": misses, "hit_ratio": ratio(hits, misses)}
+    return summary
+
+class RewriteCache:
+    """LLMによる書き換え結果のLRUキャッシュ
+
+    キーは (戦略, プロンプトの版, 入力内容のSHA-256)。プロンプトを変更した戦略は版を上げると
+    古い結果が使われなくなる。同じ内容のウィンドウ（複製したセッションや共通のシステムプロンプト）の
+    再最適化では、新しい内容の分だけLLMを呼び出す。
+    """
+
+    def __init__(self,
+                 prompt_versions: Dict[str, int],
+                 max_entries: int = 10000,
+                 max_chars: int = 20_000_000):
+        self.prompt_versions = dict(prompt_versions)
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[Tuple[str, int, str], str]" = OrderedDict()
+        self._chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, strategy: str, content: str) -> Tuple[str, int, str]:
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return strategy, self.prompt_versions.get(strategy, 0), digest
+
+    def get(self, strategy: str, content: str) -> Optional[str]:
+        """キャッシュされた書き換え結果（なければ None）"""
+        key = self._key(strategy, content)
+        output = self._entries.get(key)
+        hit = output is not None
+        if hit:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        stats = _current_stats.get()
+        if stats is not None:
+            counts = stats.setdefault(strategy, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+        return output
+
+    def contains(self, strategy: str, content: str) -> bool:
+        """キャッシュ済みか（見積もり用。ヒット率や順序には影響しない）"""
+        return self._key(strategy, content) in self._entries
+
+    def put(self, strategy: str, content: str, output: str):
+        key = self._key(strategy, content)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._chars -= len(previous)
+        self._entries[key] = output
+        self._chars += len(output)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._chars > self.max_chars):
+            _, evicted = self._entries.popitem(last=False)
+            self._chars -= len(evicted)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "cached_chars": self._chars,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+            "evictions": self.evictions,
+            "prompt_versions": self.prompt_versions
+        }
@@ -0,0 +1,408 @@
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable, Set
+
+from context_models import ContextWindow, OptimizationTask, OptimizationStatus
+from context_task_registry import OptimizationTaskRegistry, FINISHED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# 優先度クラス（先頭ほど優先）
+PRIORITY_CLASSES = ("high", "normal", "low")
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+class TaskStore:
+    """最適化タスクのSQLite永続化
+
+    永続化されるのはタスクの履歴のみ（コンテキストウィンドウはメモリ上にあり、再起動後には残らない）。
+    イベントループ上では save・delete を書き込み待ちにまとめ、別スレッドで1回のコミットとして書き込む。
+    """
+
+    def __init__(self, path: str = "optimization_tasks.db"):
+        self.path = path
+        # タスクID -> 書き込み待ちの行（同じタスクの保存は最新の行だけを書き込む）
+        self._pending: Dict[str, tuple] = {}
+        self._deleted: Set[str] = set()
+        self._flusher: Optional[asyncio.Task] = None
+        self._write_lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS optimization_tasks (
+                id TEXT PRIMARY KEY,
+                context_id TEXT NOT NULL,
+                session_id TEXT,
+                optimization_type TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                timeout_seconds REAL,
+                parameters TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL,
+                result TEXT,
+                error_message TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                completed_at TEXT
+            )
+        """)
+        self.connection.commit()
+
+    def save(self, task: OptimizationTask):
+        """タスクを保存（既存の行は置き換え）"""
+        self._deleted.discard(task.id)
+        self._pending[task.id] = self._row(task)
+        self._schedule_flush()
+
+    @staticmethod
+    def _row(task: OptimizationTask) -> tuple:
+        return (
+            task.id,
+            task.context_id,
+            task.session_id,
+            task.optimization_type,
+            task.priority,
+            task.timeout_seconds,
+            json.dumps(task.parameters, ensure_ascii=False, default=str),
+            task.status.value,
+            task.progress,
+            json.dumps(task.result, ensure_ascii=False, default=str) if task.result is not None else None,
+            task.error_message,
+            task.created_at.isoformat(),
+            _isoformat(task.started_at),
+            _isoformat(task.completed_at)
+        )
+
+    def _schedule_flush(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # イベントループ外（起動前・終了後）はその場で書き込む
+            self.flush_now()
+            return
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_in_background())
+
+    def _take_pending(self):
+        rows, deleted = list(self._pending.values()), list(self._deleted)
+        self._pending.clear()
+        self._deleted.clear()
+        return rows, deleted
+
+    def _write(self, rows: List[tuple], deleted: List[str]):
+        with self._write_lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO optimization_tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.connection.executemany("DELETE FROM optimization_tasks WHERE id = ?", [(task_id,) for task_id in deleted])
+            self.connection.commit()
+
+    async def _flush_in_background(self):
+        # 書き込み中に追加された変更は次の周回でまとめて書き込む（書き込みは常に1つずつ順番に行う）
+        while self._pending or self._deleted:
+            rows, deleted = self._take_pending()
+            try:
+                await asyncio.to_thread(self._write, rows, deleted)
+            except Exception as e:
+                logger.error(f"Failed to persist {len(rows)} optimization tasks: {str(e)}")
+
+    def flush_now(self):
+        """書き込み待ちの変更を同期的に書き込む"""
+        if self._pending or self._deleted:
+            self._write(*self._take_pending())
+
+    async def drain(self):
+        """バックグラウンドの書き込みの完了を待ち、残りを書き込む"""
+        if self._flusher is not None:
+            await self._flusher
+        self.flush_now()
+
+    def load_all(self) -> List[OptimizationTask]:
+        """保存済みのタスクを作成日時順に読み込み"""
+        rows = self.connection.execute(
+            "SELECT id, context_id, session_id, optimization_type, priority, timeout_seconds, parameters, "
+            "status, progress, result, error_message, created_at, started_at, completed_at "
+            "FROM optimization_tasks ORDER BY created_at"
+        ).fetchall()
+
+        return [
+            OptimizationTask(
+                id=row[0],
+                context_id=row[1],
+                session_id=row[2],
+                optimization_type=row[3],
+                priority=row[4],
+                timeout_seconds=row[5],
+                parameters=json.loads(row[6]),
+                status=OptimizationStatus(row[7]),
+                progress=row[8],
+                result=json.loads(row[9]) if row[9] is not None else None,
+                error_message=row[10],
+                created_at=datetime.fromisoformat(row[11]),
+                started_at=_parse_datetime(row[12]),
+                completed_at=_parse_datetime(row[13])
+            )
+            for row in rows
+        ]
+
+    def delete(self, task_id: str):
+        self._pending.pop(task_id, None)
+        self._deleted.add(task_id)
+        self._schedule_flush()
+
+    def close(self):
+        self.flush_now()
+        self.connection.close()
+
+class FairTaskQueue:
+    """優先度クラスごとに、セッション間をラウンドロビンで公平に取り出すキュー"""
+
+    def __init__(self, priorities=PRIORITY_CLASSES):
+        self.priorities = tuple(priorities)
+        # 優先度 -> (セッション -> タスクIDの待ち行列)。セッションの並びがラウンドロビンの順番
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {
+            priority: OrderedDict() for priority in self.priorities
+        }
+
+    def __len__(self) -> int:
+        return sum(self.counts().values())
+
+    def push(self, priority: str, session_key: str, task_id: str):
+        sessions = self._queues[priority]
+        if session_key not in sessions:
+            sessions[session_key] = deque()
+        sessions[session_key].append(task_id)
+
+    def pop(self) -> Optional[str]:
+        """最も優先度の高いクラスから、順番が来たセッションのタスクを取り出す"""
+        for priority in self.priorities:
+            sessions = self._queues[priority]
+            if not sessions:
+                continue
+            session_key, queue = sessions.popitem(last=False)
+            task_id = queue.popleft()
+            if queue:
+                # 取り出したセッションは順番の最後に回す
+                sessions[session_key] = queue
+            return task_id
+        return None
+
+    def remove(self, task_id: str) -> bool:
+        for sessions in self._queues.values():
+            for session_key, queue in sessions.items():
+                if task_id in queue:
+                    queue.remove(task_id)
+                    if not queue:
+                        del sessions[session_key]
+                    return True
+        return False
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            priority: sum(len(queue) for queue in sessions.values())
+            for priority, sessions in self._queues.items()
+        }
+
+class OptimizationScheduler:
+    """最適化タスクのスケジューラ（ワーカー数の上限・優先度・セッション間の公平性・キャンセル・タイムアウト）"""
+
+    def __init__(self,
+                 optimizer,
+                 store: TaskStore,
+                 window_resolver: Callable[[str], Optional[ContextWindow]],
+                 max_workers: int = 4,
+                 default_timeout: Optional[float] = None):
+        self.optimizer = optimizer
+        self.store = store
+        # 実行時にコンテキストIDからウィンドウを解決（キュー内ではIDのみ保持）
+        self.window_resolver = window_resolver
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.queue = FairTaskQueue()
+        self.running: Dict[str, asyncio.Task] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._timed_out: Set[str] = set()
+        self._workers: List[asyncio.Task] = []
+        self._available: Optional[asyncio.Semaphore] = None
+        self._stopping = False
+
+    @property
+    def tasks(self) -> OptimizationTaskRegistry:
+        return self.optimizer.optimization_tasks
+
+    async def start(self):
+        """保存済みタスクを復元してワーカーを起動"""
+        self._available = asyncio.Semaphore(0)
+        # 保持ポリシーで履歴から削除されたタスクは永続化ストアからも削除
+        self.tasks.on_evict = self.store.delete
+        self._restore()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def stop(self):
+        """ワーカーを停止（実行中のタスクは再起動後に再実行されるよう待機状態で保存）"""
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.store.drain()
+        self.store.close()
+
+    def _restore(self):
+        tasks = self.store.load_all()
+        for task in tasks:
+            self.tasks.add(task, collect=False)
+        self.tasks.collect()
+        
+        for task in tasks:
+            if task.status in FINISHED_STATUSES:
+                continue
+            if self.window_resolver(task.context_id) is None:
+                # ウィンドウは永続化されないため、対象のないタスクは理由を記録して失敗とする
+                self._finish(
+                    task, OptimizationStatus.FAILED,
+                    "Interrupted by restart: context window no longer exists (only task history is persisted)"
+                )
+            else:
+                # 中断されたタスクは最初からやり直す
+                task.status = OptimizationStatus.PENDING
+                task.progress = 0.0
+                task.started_at = None
+                self.store.save(task)
+                self._enqueue(task)
+
+    def submit(self, task: OptimizationTask):
+        """タスクを登録してキューに追加"""
+        if task.priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Invalid priority: {task.priority} (expected one of {', '.join(PRIORITY_CLASSES)})")
+        self.tasks[task.id] = task
+        self.store.save(task)
+        self._enqueue(task)
+
+    def _enqueue(self, task: OptimizationTask):
+        # セッション不明のタスクはコンテキスト単位で公平に扱う
+        self.queue.push(task.priority, task.session_id or task.context_id, task.id)
+        if self._available is not None:
+            self._available.release()
+
+    def cancel(self, task_id: str) -> bool:
+        """待機中または実行中のタスクをキャンセル（終了済みの場合は False）"""
+        task = self.tasks.get(task_id)
+        if task is None or task.status in FINISHED_STATUSES:
+            return False
+
+        if task_id in self.running:
+            self.running[task_id].cancel()
+        else:
+            # キューから取り出された直後など、キューにも実行中にもないタスクも開始前にキャンセル
+            self.queue.remove(task_id)
+            self._finish(task, OptimizationStatus.CANCELLED, "Cancelled before start")
+        return True
+
+    def set_timeout(self, task_id: str, seconds: float) -> bool:
+        """タスクのタイムアウト（開始からの秒数）を変更（終了済みの場合は False）"""
+        task = self.tasks.get(task_id)
+        if task is None or task.status in FINISHED_STATUSES:
+            return False
+
+        task.timeout_seconds = seconds
+        self.store.save(task)
+        if task_id in self.running:
+            self._schedule_timeout(task)
+        return True
+
+    def _schedule_timeout(self, task: OptimizationTask):
+        handle = self._timers.pop(task.id, None)
+        if handle:
+            handle.cancel()
+
+        timeout = task.timeout_seconds or self.default_timeout
+        if timeout:
+            elapsed = (datetime.now() - task.started_at).total_seconds() if task.started_at else 0.0
+            self._timers[task.id] = asyncio.get_running_loop().call_later(
+                max(timeout - elapsed, 0.0), self._expire, task.id
+            )
+
+    def _expire(self, task_id: str):
+        execution = self.running.get(task_id)
+        if execution is not None:
+            self._timed_out.add(task_id)
+            execution.cancel()
+
+    def _finish(self, task: OptimizationTask, status: OptimizationStatus, error_message: Optional[str] = None):
+        task.status = status
+        task.error_message = error_message
+        task.completed_at = datetime.now()
+        self.store.save(task)
+        self.optimizer._publish_finished(task)
+        self.tasks.collect()
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            task_id = self.queue.pop()
+            if task_id is not None:
+                await self._run(task_id)
+
+    async def _run(self, task_id: str):
+        task = self.tasks.get(task_id)
+        if task is None or task.status in FINISHED_STATUSES:
+            # 取り出した後にキャンセルされたタスク
+            return
+        window = self.window_resolver(task.context_id)
+        if window is None:
+            self._finish(task, OptimizationStatus.FAILED, "Context window not found")
+            return
+
+        task.status = OptimizationStatus.IN_PROGRESS
+        task.started_at = datetime.now()
+        self.store.save(task)
+
+        execution = asyncio.create_task(self.optimizer._execute_optimization(task, window))
+        self.running[task_id] = execution
+        self._schedule_timeout(task)
+
+        try:
+            await execution
+            self.store.save(task)
+            self.tasks.collect()
+        except asyncio.CancelledError:
+            if self._stopping:
+                # 停止時は再起動後に再実行されるよう待機状態で保存
+                execution.cancel()
+                task.status = OptimizationStatus.PENDING
+                task.progress = 0.0
+                task.started_at = None
+                self.store.save(task)
+                raise
+            if task_id in self._timed_out:
+                timeout = task.timeout_seconds or self.default_timeout
+                self._finish(task, OptimizationStatus.FAILED, f"Timed out after {timeout} seconds")
+            else:
+                self._finish(task, OptimizationStatus.CANCELLED, "Cancelled while running")
+        except Exception as e:
+            logger.error(f"Scheduled optimization task {task_id} failed: {str(e)}")
+            self._finish(task, OptimizationStatus.FAILED, str(e))
+        finally:
+            self.running.pop(task_id, None)
+            handle = self._timers.pop(task_id, None)
+            if handle:
+                handle.cancel()
+            self._timed_out.discard(task_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "running": len(self.running),
+            "queued": self.queue.counts(),
+            "total_tasks": len(self.tasks),
+            "retention": self.tasks.get_stats()
+        }
@@ -0,0 +1,256 @@
+import copy
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from context_models import ContextWindow, ContextElement, ContextType
+
+@dataclass(frozen=True, eq=False)
+class ElementState:
+    """スナップショット時点の要素の状態（不変。同じ状態はスナップショット間で共有する）"""
+    id: str
+    content: str
+    type: ContextType
+    role: Optional[str]
+    metadata: Dict[str, Any]
+    tags: Tuple[str, ...]
+    priority: int
+    created_at: datetime
+    updated_at: datetime
+
+    @property
+    def token_count(self) -> int:
+        return len(self.content.split()) * 1.3  # ContextElement.token_count と同じ概算
+
+    def matches(self, element: ContextElement) -> bool:
+        """要素が変更されていないか（内容は同一オブジェクトなら比較を省略）"""
+        return (
+            element.id == self.id
+            and element.updated_at == self.updated_at
+            and element.priority == self.priority
+            and element.type == self.type
+            and element.role == self.role
+            and (element.content is self.content or element.content == self.content)
+            and tuple(element.tags) == self.tags
+            and element.metadata == self.metadata
+        )
+
+    def to_element(self) -> ContextElement:
+        return ContextElement(
+            id=self.id,
+            content=self.content,
+            type=self.type,
+            role=self.role,
+            metadata=copy.deepcopy(self.metadata),
+            tags=list(self.tags),
+            priority=self.priority,
+            created_at=self.created_at,
+            updated_at=self.updated_at
+        )
+
+@dataclass(frozen=True)
+class WindowSnapshot:
+    """ウィンドウの不変スナップショット
+
+    要素の並びはチャンクの列として持ち、前回のスナップショットと同じ内容のチャンクは
+    位置にかかわらずそのまま共有する（構造共有）。変更のない要素・チャンクは新たなメモリを使わない。
+    """
+    window_id: str
+    chunks: Tuple[Tuple[ElementState, ...], ...]
+    max_tokens: int
+    reserved_tokens: int
+    reason: str = "manual"
+    task_id: Optional[str] = None
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    created_at: datetime = field(default_factory=datetime.now)
+
+    @property
+    def states(self) -> List[ElementState]:
+        return [state for chunk in self.chunks for state in chunk]
+
+    def to_dict(self) -> Dict[str, Any]:
+        states = self.states
+        return {
+            "id": self.id,
+            "window_id": self.window_id,
+            "reason": self.reason,
+            "task_id": self.task_id,
+            "element_count": len(states),
+            "tokens": sum(state.token_count for state in states),
+            "created_at": self.created_at.isoformat()
+        }
+
+def diff_states(before: List[ElementState], after: List[ElementState]) -> Dict[str, Any]:
+    """2つの状態列の差分（追加・削除・変更された要素と並び順の変化）"""
+    before_by_id = {state.id: state for state in before}
+    after_by_id = {state.id: state for state in after}
+
+    modified = []
+    for state in after:
+        previous = before_by_id.get(state.id)
+        # 共有された状態は同一オブジェクトなので比較を省略できる
+        if previous is None or previous is state:
+            continue
+        changes = [
+            name for name in ("content", "type", "role", "metadata", "tags", "priority")
+            if getattr(previous, name) != getattr(state, name)
+        ]
+        if changes:
+            modified.append({
+                "id": state.id,
+                "changes": changes,
+                "tokens_before": previous.token_count,
+                "tokens_after": state.token_count
+            })
+
+    kept_before = [state.id for state in before if state.id in after_by_id]
+    kept_after = [state.id for state in after if state.id in before_by_id]
+    return {
+        "added": [{"id": state.id, "tokens": state.token_count} for state in after if state.id not in before_by_id],
+        "removed": [{"id": state.id, "tokens": state.token_count} for state in before if state.id not in after_by_id],
+        "modified": modified,
+        "reordered": kept_before != kept_after,
+        "tokens_before": sum(state.token_count for state in before),
+        "tokens_after": sum(state.token_count for state in after)
+    }
+
+class SnapshotStore:
+    """ウィンドウごとのスナップショット（新しいものから max_snapshots 件を保持）
+
+    チャンクの境界は要素IDから決める（平均 chunk_size 件）ため、先頭への挿入や削除は前後のチャンクにしか
+    影響しない。要素の状態とチャンクは、ウィンドウが直前に対応していたスナップショット（基準）と比較して
+    再利用するため、スナップショットの作成コストは変更された要素の数にほぼ比例する。
+    """
+
+    def __init__(self, max_snapshots: int = 20, chunk_size: int = 32):
+        self.max_snapshots = max_snapshots
+        self.chunk_size = chunk_size
+        # チャンクの最大長（境界となる要素が長く現れない場合の上限）
+        self.max_chunk_size = chunk_size * 8
+        self._snapshots: Dict[str, "OrderedDict[str, WindowSnapshot]"] = {}
+        # ウィンドウID -> (基準のスナップショット, 要素ID -> 状態, 状態の並び -> チャンク)
+        self._bases: Dict[str, Tuple[WindowSnapshot, Dict[str, ElementState], Dict[tuple, tuple]]] = {}
+        self.taken = 0
+        self.reused_states = 0
+        self.shared_chunks = 0
+
+    def _set_base(self, snapshot: WindowSnapshot):
+        states = {state.id: state for chunk in snapshot.chunks for state in chunk}
+        chunks = {tuple(map(id, chunk)): chunk for chunk in snapshot.chunks}
+        self._bases[snapshot.window_id] = (snapshot, states, chunks)
+
+    def _states(self, window: ContextWindow) -> List[ElementState]:
+        """現在の要素の状態（基準から変更のない要素は同じ状態オブジェクトを再利用）"""
+        base = self._bases.get(window.id)
+        base_states = base[1] if base is not None else {}
+        states = []
+        for element in window.elements:
+            state = base_states.get(element.id)
+            if state is not None and state.matches(element):
+                self.reused_states += 1
+            else:
+                state = ElementState(
+                    id=element.id,
+                    content=element.content,
+                    type=element.type,
+                    role=element.role,
+                    metadata=copy.deepcopy(element.metadata),
+                    tags=tuple(element.tags),
+                    priority=element.priority,
+                    created_at=element.created_at,
+                    updated_at=element.updated_at
+                )
+            states.append(state)
+        return states
+
+    def _chunk(self, window_id: str, states: List[ElementState]) -> Tuple[Tuple[ElementState, ...], ...]:
+        """要素IDで決まる境界でチャンクに分け、基準と同じ内容のチャンクは共有"""
+        base = self._bases.get(window_id)
+        base_chunks = base[2] if base is not None else {}
+        chunks = []
+        current: List[ElementState] = []
+        for state in states:
+            current.append(state)
+            # 境界はプロセスに依存しないハッシュで決める
+            if zlib.crc32(state.id.encode("utf-8")) % self.chunk_size == 0 or len(current) >= self.max_chunk_size:
+                chunks.append(current)
+                current = []
+        if current:
+            chunks.append(current)
+
+        result = []
+        for chunk in chunks:
+            shared = base_chunks.get(tuple(map(id, chunk)))
+            if shared is not None:
+                self.shared_chunks += 1
+                result.append(shared)
+            else:
+                result.append(tuple(chunk))
+        return tuple(result)
+
+    def take(self, window: ContextWindow, reason: str = "manual", task_id: Optional[str] = None) -> WindowSnapshot:
+        """現在のウィンドウのスナップショットを作成"""
+        snapshot = WindowSnapshot(
+            window_id=window.id,
+            chunks=self._chunk(window.id, self._states(window)),
+            max_tokens=window.max_tokens,
+            reserved_tokens=window.reserved_tokens,
+            reason=reason,
+            task_id=task_id
+        )
+        history = self._snapshots.setdefault(window.id, OrderedDict())
+        history[snapshot.id] = snapshot
+        while len(history) > self.max_snapshots:
+            history.popitem(last=False)
+        self._set_base(snapshot)
+        self.taken += 1
+        return snapshot
+
+    def get(self, window_id: str, snapshot_id: str) -> Optional[WindowSnapshot]:
+        return self._snapshots.get(window_id, {}).get(snapshot_id)
+
+    def list(self, window_id: str) -> List[WindowSnapshot]:
+        """ウィンドウのスナップショット一覧（新しい順）"""
+        return list(reversed(self._snapshots.get(window_id, {}).values()))
+
+    def diff(self, snapshot: WindowSnapshot, against: Optional[WindowSnapshot] = None,
+             window: Optional[ContextWindow] = None) -> Dict[str, Any]:
+        """スナップショットから against（省略時は現在のウィンドウ）への差分"""
+        if against is not None:
+            after = against.states
+        else:
+            after = self._states(window)
+        return diff_states(snapshot.states, after)
+
+    def restore(self,
+                window: ContextWindow,
+                snapshot_id: str,
+                restore_limits: bool = False) -> Tuple[WindowSnapshot, Dict[str, Any]]:
+        """ウィンドウをスナップショットの状態に戻す（戻す前の状態もスナップショットとして残すため、復元も取り消せる）
+
+        max_tokens・reserved_tokens はセッション予算などで変わるため、restore_limits 指定時だけ戻す。
+        """
+        snapshot = self.get(window.id, snapshot_id)
+        if snapshot is None:
+            raise KeyError(snapshot_id)
+
+        before = self.take(window, reason="before_restore")
+        window.elements = [state.to_element() for state in snapshot.states]
+        if restore_limits:
+            window.max_tokens = snapshot.max_tokens
+            window.reserved_tokens = snapshot.reserved_tokens
+        # 以降のスナップショットは復元したスナップショットの状態・チャンクを共有する
+        self._set_base(snapshot)
+        return before, diff_states(before.states, snapshot.states)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "windows": len(self._snapshots),
+            "snapshots": sum(len(history) for history in self._snapshots.values()),
+            "taken": self.taken,
+            "reused_states": self.reused_states,
+            "shared_chunks": self.shared_chunks
+        }
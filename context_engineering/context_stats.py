@@ -0,0 +1,163 @@
+import re
+import statistics
+from array import array
+from collections import Counter
+from typing import Dict, List, Any, NamedTuple
+
+from context_models import ContextWindow, ContextType
+from context_heuristics import LocalContextScorer
+
+# 要素タイプを1バイトで表現するためのコード表
+TYPE_CODES = tuple(context_type.value for context_type in ContextType)
+_TYPE_INDEX = {value: index for index, value in enumerate(TYPE_CODES)}
+
+# 優先度は上限のない int のため、int64 の範囲に丸めて格納する
+_PRIORITY_MIN = -(2 ** 63)
+_PRIORITY_MAX = 2 ** 63 - 1
+
+def _packed_priority(priority: int) -> int:
+    return min(max(priority, _PRIORITY_MIN), _PRIORITY_MAX)
+
+class PackedWindow(NamedTuple):
+    """プロセス間転送用のコンパクトなウィンドウ表現（要素内容は1つの文字列とオフセット配列）"""
+    text: str
+    offsets: array  # 'Q' 要素 i の内容は text[offsets[i]:offsets[i + 1]]
+    types: bytes
+    priorities: array  # 'q' int64 の範囲に丸めた優先度
+    created_at: array  # 'd' UNIXタイムスタンプ
+    max_tokens: int
+    reserved_tokens: int
+
+    @property
+    def element_count(self) -> int:
+        return len(self.types)
+
+    def contents(self) -> List[str]:
+        return [self.text[self.offsets[i]:self.offsets[i + 1]] for i in range(self.element_count)]
+
+    def type_values(self) -> List[str]:
+        return [TYPE_CODES[code] for code in self.types]
+
+def pack_window(window: ContextWindow) -> PackedWindow:
+    """ContextWindowをPackedWindowに変換"""
+    offsets = array("Q", [0])
+    position = 0
+    for element in window.elements:
+        position += len(element.content)
+        offsets.append(position)
+
+    return PackedWindow(
+        text="".join(element.content for element in window.elements),
+        offsets=offsets,
+        types=bytes(_TYPE_INDEX[element.type.value] for element in window.elements),
+        priorities=array("q", (_packed_priority(element.priority) for element in window.elements)),
+        created_at=array("d", (element.created_at.timestamp() for element in window.elements)),
+        max_tokens=window.max_tokens,
+        reserved_tokens=window.reserved_tokens
+    )
+
+def _current_tokens(contents: List[str]) -> float:
+    """ContextWindow.current_tokens と同じ推定"""
+    return sum(len(content.split()) * 1.3 for content in contents)
+
+def basic_metrics(packed: PackedWindow, contents: List[str]) -> Dict[str, float]:
+    """基本メトリクス計算"""
+    if not contents:
+        return {
+            "total_elements": 0,
+            "total_tokens": 0,
+            "avg_element_length": 0,
+            "token_utilization": 0
+        }
+
+    element_lengths = [len(content) for content in contents]
+    current_tokens = _current_tokens(contents)
+
+    return {
+        "total_elements": len(contents),
+        "total_tokens": current_tokens,
+        "avg_element_length": statistics.mean(element_lengths),
+        "max_element_length": max(element_lengths),
+        "min_element_length": min(element_lengths),
+        "token_utilization": current_tokens / packed.max_tokens,
+        "available_tokens": packed.max_tokens - current_tokens - packed.reserved_tokens
+    }
+
+def structure_metrics(packed: PackedWindow) -> Dict[str, float]:
+    """構造分析"""
+    if not packed.element_count:
+        return {}
+
+    # 要素タイプの分布
+    type_counts = Counter(packed.type_values())
+    total_elements = packed.element_count
+
+    # 優先度分析
+    priorities = list(packed.priorities)
+
+    # 時系列分析
+    creation_times = packed.created_at
+    time_span = max(creation_times) - min(creation_times) if len(creation_times) > 1 else 0
+
+    return {
+        "type_diversity": len(type_counts) / max(len(type_counts), 1),
+        "avg_priority": statistics.mean(priorities),
+        "priority_std": statistics.stdev(priorities) if len(priorities) > 1 else 0,
+        "time_span_hours": time_span / 3600,
+        "system_ratio": type_counts.get("system", 0) / total_elements,
+        "user_ratio": type_counts.get("user", 0) / total_elements,
+        "assistant_ratio": type_counts.get("assistant", 0) / total_elements,
+        "memory_ratio": type_counts.get("memory", 0) / total_elements
+    }
+
+def token_efficiency_metrics(contents: List[str]) -> Dict[str, float]:
+    """トークン効率性分析"""
+    if not contents:
+        return {}
+
+    # 情報密度計算
+    total_chars = sum(len(content) for content in contents)
+    total_words = sum(len(content.split()) for content in contents)
+    current_tokens = _current_tokens(contents)
+
+    # 冗長性分析
+    redundancy_score = redundancy(contents)
+
+    return {
+        "chars_per_token": total_chars / max(current_tokens, 1),
+        "words_per_token": total_words / max(current_tokens, 1),
+        "information_density": total_words / max(total_chars, 1),
+        "redundancy_score": redundancy_score,
+        "efficiency_score": 1.0 - redundancy_score
+    }
+
+def redundancy(contents: List[str]) -> float:
+    """冗長性計算"""
+    if len(contents) < 2:
+        return 0.0
+
+    # 単語レベルでの重複計算
+    all_words = []
+    for content in contents:
+        all_words.extend(re.findall(r'\w+', content.lower()))
+
+    if not all_words:
+        return 0.0
+
+    word_counts = Counter(all_words)
+    duplicate_words = sum(count - 1 for count in word_counts.values() if count > 1)
+
+    return duplicate_words / len(all_words)
+
+def compute_window_metrics(packed: PackedWindow) -> Dict[str, Dict[str, float]]:
+    """LLMを使わない統計メトリクスを一括計算（プロセスプールから呼び出し可能）"""
+    contents = packed.contents()
+    return {
+        "basic": basic_metrics(packed, contents),
+        "structure": structure_metrics(packed),
+        "efficiency": token_efficiency_metrics(contents)
+    }
+
+def score_packed_window(scorer: LocalContextScorer, packed: PackedWindow) -> Dict[str, Any]:
+    """ローカル意味メトリクス推定（プロセスプールから呼び出し可能）"""
+    return scorer.score_elements(packed.contents(), packed.type_values())
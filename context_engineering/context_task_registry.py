@@ -0,0 +1,210 @@
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable, NamedTuple, Iterator
+
+from context_models import OptimizationTask, OptimizationStatus
+
+# 終了済みのタスク状態
+FINISHED_STATUSES = (OptimizationStatus.COMPLETED, OptimizationStatus.FAILED, OptimizationStatus.CANCELLED)
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+@dataclass
+class TaskRetentionPolicy:
+    """最適化タスクの保持ポリシー"""
+    # 結果を含む完全な形で保持する終了済みタスクの上限
+    max_full_tasks: int = 1000
+    max_full_age_seconds: float = 3600.0
+    max_result_bytes: int = 50 * 1024 * 1024
+    # 圧縮形式（状態・時刻・トークン増減のみ）で保持する履歴の上限
+    max_archived_tasks: int = 10000
+    max_archived_age_seconds: float = 7 * 24 * 3600.0
+
+class ArchivedTask(NamedTuple):
+    """終了済みタスクの圧縮形式"""
+    id: str
+    context_id: str
+    session_id: Optional[str]
+    optimization_type: str
+    priority: str
+    status: str
+    created_at: float
+    started_at: Optional[float]
+    completed_at: Optional[float]
+    original_tokens: Optional[float]
+    final_tokens: Optional[float]
+    error_message: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "context_id": self.context_id,
+            "session_id": self.session_id,
+            "optimization_type": self.optimization_type,
+            "priority": self.priority,
+            "status": self.status,
+            "created_at": _isoformat(self.created_at),
+            "started_at": _isoformat(self.started_at),
+            "completed_at": _isoformat(self.completed_at),
+            "duration_seconds": (
+                self.completed_at - self.started_at
+                if self.started_at is not None and self.completed_at is not None else None
+            ),
+            "original_tokens": self.original_tokens,
+            "final_tokens": self.final_tokens,
+            "token_delta": (
+                self.final_tokens - self.original_tokens
+                if self.original_tokens is not None and self.final_tokens is not None else None
+            ),
+            "error_message": self.error_message,
+            "archived": True
+        }
+
+def archive_task(task: OptimizationTask) -> ArchivedTask:
+    """タスクを圧縮形式に変換"""
+    token_reduction = (task.result or {}).get("token_reduction", {})
+    return ArchivedTask(
+        id=task.id,
+        context_id=task.context_id,
+        session_id=task.session_id,
+        optimization_type=task.optimization_type,
+        priority=task.priority,
+        status=task.status.value,
+        created_at=task.created_at.timestamp(),
+        started_at=task.started_at.timestamp() if task.started_at else None,
+        completed_at=task.completed_at.timestamp() if task.completed_at else None,
+        original_tokens=token_reduction.get("original_tokens"),
+        final_tokens=token_reduction.get("final_tokens"),
+        error_message=task.error_message[:200] if task.error_message else None
+    )
+
+def _finished_at(task: OptimizationTask) -> float:
+    return (task.completed_at or task.created_at).timestamp()
+
+class OptimizationTaskRegistry:
+    """保持ポリシー付きの最適化タスク管理（コンテキストID索引・終了済みタスクの圧縮アーカイブ）"""
+
+    def __init__(self, policy: Optional[TaskRetentionPolicy] = None):
+        self.policy = policy or TaskRetentionPolicy()
+        self.tasks: Dict[str, OptimizationTask] = {}
+        self.archived: "OrderedDict[str, ArchivedTask]" = OrderedDict()
+        # 全タスクID・コンテキストID -> タスクID（登録順。アーカイブ済みを含む）
+        self._order: Dict[str, None] = {}
+        self.by_context: Dict[str, Dict[str, None]] = {}
+        # 未終了のタスクID（collect はここから終了したタスクだけを探す）
+        self._active: Dict[str, None] = {}
+        # 完全な形で保持する終了済みタスクID（終了順。先頭からアーカイブする）
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        # 終了済みタスクの結果サイズ（終了の検出時に1回だけ計測）
+        self._result_bytes: Dict[str, int] = {}
+        self._total_result_bytes = 0
+        # アーカイブからも削除されたタスクIDの通知先（永続化ストアの削除など）
+        self.on_evict: Optional[Callable[[str], None]] = None
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self.tasks
+
+    def __getitem__(self, task_id: str) -> OptimizationTask:
+        return self.tasks[task_id]
+
+    def __setitem__(self, task_id: str, task: OptimizationTask):
+        self.add(task)
+
+    def add(self, task: OptimizationTask, collect: bool = True):
+        """タスクを登録（collect=False は一括登録用で、最後に collect() を呼ぶこと）"""
+        self.tasks[task.id] = task
+        self.archived.pop(task.id, None)
+        if task.id in self._finished:
+            del self._finished[task.id]
+            self._total_result_bytes -= self._result_bytes.pop(task.id)
+        self._active[task.id] = None
+        self._order[task.id] = None
+        self.by_context.setdefault(task.context_id, {})[task.id] = None
+        if collect:
+            self.collect()
+
+    def get(self, task_id: str) -> Optional[OptimizationTask]:
+        return self.tasks.get(task_id)
+
+    def get_archived(self, task_id: str) -> Optional[ArchivedTask]:
+        return self.archived.get(task_id)
+
+    def values(self) -> Iterator[OptimizationTask]:
+        return iter(list(self.tasks.values()))
+
+    def list(self, context_id: Optional[str] = None, include_archived: bool = False) -> List[Any]:
+        """新しい順のタスク一覧（索引を使うためソート不要）"""
+        task_ids = self.by_context.get(context_id, {}) if context_id else self._order
+        listed = []
+        for task_id in reversed(list(task_ids)):
+            task = self.tasks.get(task_id)
+            if task is not None:
+                listed.append(task)
+            elif include_archived and task_id in self.archived:
+                listed.append(self.archived[task_id])
+        return listed
+
+    def collect(self, now: Optional[float] = None):
+        """保持ポリシーを超えた終了済みタスクを圧縮形式へ移し、古いアーカイブを削除"""
+        now = time.time() if now is None else now
+        policy = self.policy
+
+        # 前回から終了したタスクを終了順に追加（通常は数件のため並べ替えは小さい）
+        newly_finished = [
+            self.tasks[task_id] for task_id in self._active
+            if self.tasks[task_id].status in FINISHED_STATUSES
+        ]
+        for task in sorted(newly_finished, key=_finished_at):
+            del self._active[task.id]
+            self._finished[task.id] = None
+            self._result_bytes[task.id] = len(json.dumps(task.result, default=str)) if task.result else 0
+            self._total_result_bytes += self._result_bytes[task.id]
+
+        while self._finished:
+            task = self.tasks[next(iter(self._finished))]
+            if (len(self._finished) <= policy.max_full_tasks
+                    and self._total_result_bytes <= policy.max_result_bytes
+                    and now - _finished_at(task) <= policy.max_full_age_seconds):
+                break
+            self._archive(task)
+
+        # アーカイブは終了順に並んでいるため先頭から削除
+        while self.archived:
+            task_id, archived = next(iter(self.archived.items()))
+            archived_at = archived.completed_at or archived.created_at
+            if len(self.archived) <= policy.max_archived_tasks and now - archived_at <= policy.max_archived_age_seconds:
+                break
+            self._evict(task_id, archived.context_id)
+
+    def _archive(self, task: OptimizationTask):
+        del self.tasks[task.id]
+        del self._finished[task.id]
+        self._total_result_bytes -= self._result_bytes.pop(task.id)
+        self.archived[task.id] = archive_task(task)
+
+    def _evict(self, task_id: str, context_id: str):
+        del self.archived[task_id]
+        self._order.pop(task_id, None)
+        context_tasks = self.by_context.get(context_id)
+        if context_tasks is not None:
+            context_tasks.pop(task_id, None)
+            if not context_tasks:
+                del self.by_context[context_id]
+        if self.on_evict is not None:
+            self.on_evict(task_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "tasks": len(self.tasks),
+            "finished_full_tasks": len(self._result_bytes),
+            "result_bytes": self._total_result_bytes,
+            "archived_tasks": len(self.archived),
+            "contexts": len(self.by_context)
+        }
@@ -0,0 +1,156 @@
+import math
+from array import array
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from context_models import ContextWindow, ContextAnalysis
+
+# 時系列として保持するメトリクス（列）
+TRACKED_METRICS = (
+    "quality_score",
+    "topic_consistency",
+    "logical_flow",
+    "information_redundancy",
+    "context_clarity",
+    "goal_alignment",
+    "token_utilization",
+    "redundancy_score",
+    "efficiency_score",
+    "total_tokens"
+)
+
+def _nan_to_none(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+class _Columns:
+    """タイムスタンプ・重み・メトリクスの列指向配列"""
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.weights = array("I")  # ダウンサンプリングで統合された点の数
+        self.metrics = {name: array("d") for name in TRACKED_METRICS}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def append(self, timestamp: float, weight: int, values: Dict[str, float]):
+        self.timestamps.append(timestamp)
+        self.weights.append(weight)
+        for name, column in self.metrics.items():
+            column.append(values.get(name, math.nan))
+
+    def merge_range(self, start: int, end: int) -> Dict[str, Any]:
+        """区間 [start, end) を重み付き平均で1点に統合"""
+        weights = self.weights[start:end]
+        total_weight = sum(weights)
+        merged = {
+            "timestamp": sum(t * w for t, w in zip(self.timestamps[start:end], weights)) / total_weight,
+            "weight": total_weight,
+            "values": {}
+        }
+        for name, column in self.metrics.items():
+            pairs = [(v, w) for v, w in zip(column[start:end], weights) if not math.isnan(v)]
+            value_weight = sum(w for _, w in pairs)
+            merged["values"][name] = sum(v * w for v, w in pairs) / value_weight if value_weight else math.nan
+        return merged
+
+    def delete_range(self, start: int, end: int):
+        del self.timestamps[start:end]
+        del self.weights[start:end]
+        for column in self.metrics.values():
+            del column[start:end]
+
+class QualityTimeSeries:
+    """ウィンドウ単位の品質メトリクス時系列（直近は全解像度、古い点はダウンサンプリング）"""
+
+    def __init__(self,
+                 max_recent_points: int = 256,
+                 max_archived_points: int = 256,
+                 downsample_factor: int = 4):
+        self.max_recent_points = max_recent_points
+        self.max_archived_points = max_archived_points
+        self.downsample_factor = max(2, downsample_factor)
+        self.recent = _Columns()
+        self.archived = _Columns()
+
+    def __len__(self) -> int:
+        return len(self.archived) + len(self.recent)
+
+    def append(self, timestamp: datetime, values: Dict[str, float]):
+        """分析結果を1点追加"""
+        self.recent.append(timestamp.timestamp(), 1, values)
+
+        # 溢れた直近の点は downsample_factor 点ずつ統合してアーカイブへ
+        while len(self.recent) > self.max_recent_points:
+            end = min(self.downsample_factor, len(self.recent))
+            merged = self.recent.merge_range(0, end)
+            self.recent.delete_range(0, end)
+            self.archived.append(merged["timestamp"], merged["weight"], merged["values"])
+
+        # アーカイブも溢れたら隣接2点ずつ統合して解像度を半分にする
+        if len(self.archived) > self.max_archived_points:
+            compacted = _Columns()
+            for start in range(0, len(self.archived), 2):
+                merged = self.archived.merge_range(start, min(start + 2, len(self.archived)))
+                compacted.append(merged["timestamp"], merged["weight"], merged["values"])
+            self.archived = compacted
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """最新の点"""
+        columns = self.recent if len(self.recent) else self.archived
+        if not len(columns):
+            return None
+        return {
+            "timestamp": datetime.fromtimestamp(columns.timestamps[-1]).isoformat(),
+            "metrics": {
+                name: _nan_to_none(column[-1])
+                for name, column in columns.metrics.items()
+            }
+        }
+
+    def history(self, since: Optional[datetime] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        """古い順の列指向履歴（ダウンサンプリング済みの点は weight > 1）"""
+        since_ts = since.timestamp() if since else None
+        indexes = [
+            (columns, i)
+            for columns in (self.archived, self.recent)
+            for i in range(len(columns))
+            if since_ts is None or columns.timestamps[i] >= since_ts
+        ]
+        if limit is not None:
+            indexes = indexes[-limit:] if limit > 0 else []
+
+        return {
+            "timestamps": [datetime.fromtimestamp(c.timestamps[i]).isoformat() for c, i in indexes],
+            "weights": [c.weights[i] for c, i in indexes],
+            "metrics": {
+                name: [_nan_to_none(c.metrics[name][i]) for c, i in indexes]
+                for name in TRACKED_METRICS
+            }
+        }
+
+class QualityTimeSeriesStore:
+    """ウィンドウIDごとの品質時系列ストア"""
+
+    def __init__(self, **series_options):
+        self.series_options = series_options
+        self.series: Dict[str, QualityTimeSeries] = {}
+
+    def record(self, window: ContextWindow, analysis: ContextAnalysis):
+        """分析結果を時系列に追加し、ウィンドウの最新品質メトリクスを更新"""
+        values = {
+            name: float(value)
+            for name, value in analysis.metrics.items()
+            if isinstance(value, (int, float))
+        }
+        values["quality_score"] = float(analysis.quality_score)
+
+        series = self.series.get(window.id)
+        if series is None:
+            series = self.series[window.id] = QualityTimeSeries(**self.series_options)
+        series.append(analysis.analyzed_at, values)
+
+        window.quality_metrics = values
+
+    def get(self, window_id: str) -> Optional[QualityTimeSeries]:
+        return self.series.get(window_id)
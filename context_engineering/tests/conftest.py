@@ -0,0 +1,5 @@
+import os
+import sys
+
+# モジュールはフラットにインポートされるため、パッケージのディレクトリを検索パスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
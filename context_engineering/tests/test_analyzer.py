@@ -0,0 +1,103 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from context_analyzer import ContextAnalyzer, SEMANTIC_METRICS
+from context_models import ContextWindow, ContextElement, ContextType
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+class _StubModel:
+    """チャンク分析と reduce に決まった応答を返すモデル"""
+
+    def __init__(self, chunk_replies, reduce_reply):
+        self.chunk_replies = itertools.cycle(chunk_replies)
+        self.reduce_reply = reduce_reply
+
+    async def generate_content_async(self, prompt):
+        if "各チャンクの要約" in prompt:
+            return _Response(self.reduce_reply)
+        return _Response(next(self.chunk_replies))
+
+def _analyze(chunk_replies, reduce_reply):
+    analyzer = ContextAnalyzer("test-key", max_prompt_tokens=450)
+    analyzer.model = _StubModel(chunk_replies, reduce_reply)
+    window = ContextWindow(max_tokens=100000)
+    for i in range(12):
+        window.add_element(ContextElement(content=f"element {i} " + "word " * 30, type=ContextType.USER))
+    return asyncio.run(analyzer._analyze_semantic_consistency(window))
+
+MALFORMED_CHUNKS = [
+    json.dumps([0.9, 0.8]),
+    json.dumps({"insights": "not a list"}),
+    json.dumps({"metrics": ["topic_consistency", 0.9]}),
+    json.dumps({"metrics": {"topic_consistency": "high", "logical_flow": None, "context_clarity": "nan"}}),
+]
+
+def test_map_reduce_tolerates_malformed_chunk_and_reduce_output():
+    result = _analyze(MALFORMED_CHUNKS, json.dumps({"metrics": "none", "insights": 3}))
+
+    assert result["metrics"]["semantic_chunks"] > 1
+    for metric in SEMANTIC_METRICS:
+        assert result["metrics"][metric] == pytest.approx(0.5)
+    assert "cross_chunk_consistency" not in result["metrics"]
+
+def test_map_reduce_ignores_invalid_reduce_values():
+    valid = json.dumps({"metrics": {metric: 0.8 for metric in SEMANTIC_METRICS}, "insights": ["ok"], "summary": "s"})
+    result = _analyze([valid], json.dumps({"metrics": {"cross_chunk_consistency": "bad", "cross_chunk_flow": 0.4}}))
+
+    # 不正な値はチャンクの値で代用し、正しい値だけを反映する
+    assert result["metrics"]["cross_chunk_consistency"] == pytest.approx(0.8)
+    assert result["metrics"]["logical_flow"] == pytest.approx(0.6)
+    assert "ok" in result["insights"]
+
+def _rag_analyzer(reply: str):
+    from context_analyzer import RAGAnalyzer
+
+    # 信頼度に関係なくLLM分析に進む
+    analyzer = RAGAnalyzer("test-key", hybrid_confidence_threshold=1.1)
+    analyzer.model = _StubModel([reply], reply)
+    return analyzer
+
+def _rag_context():
+    from context_models import RAGContext
+
+    return RAGContext(
+        query="kyoto hotel near gion",
+        retrieved_documents=[{"content": "A hotel in Gion, Kyoto."}, {"content": "Tokyo flight prices in April."}]
+    )
+
+@pytest.mark.parametrize("reply", [
+    json.dumps(["not", "a", "dict"]),
+    json.dumps({"metrics": "none"}),
+    json.dumps({"metrics": {"query_relevance": "high", "result_redundancy": None}}),
+    "not json",
+])
+def test_rag_hybrid_falls_back_to_local_scores_on_malformed_reply(reply):
+    analyzer = _rag_analyzer(reply)
+    context = _rag_context()
+    local = analyzer.local_scorer.score_query_documents(
+        context.query, [document["content"] for document in context.retrieved_documents]
+    )
+
+    result = asyncio.run(analyzer._analyze_relevance(context, "hybrid"))
+
+    for metric in ("query_relevance", "result_redundancy", "coverage_completeness"):
+        assert result["metrics"][metric] == pytest.approx(local["metrics"][metric])
+    assert isinstance(result["insights"], list)
+
+def test_rag_hybrid_uses_valid_llm_values():
+    reply = json.dumps({"metrics": {"query_relevance": 0.9, "result_redundancy": "bad"}, "insights": ["ok"]})
+    analyzer = _rag_analyzer(reply)
+    context = _rag_context()
+
+    result = asyncio.run(analyzer._analyze_relevance(context, "hybrid"))
+
+    assert result["metrics"]["query_relevance"] == pytest.approx(0.9)
+    assert result["insights"] == ["ok"]
@@ -0,0 +1,44 @@
+import asyncio
+
+from context_budget import SessionBudgetAllocator
+from context_models import ContextSession, ContextWindow, ContextElement, ContextType, SessionBudget
+
+def _window(reserved_tokens: int = 0) -> ContextWindow:
+    window = ContextWindow(max_tokens=10 ** 6, reserved_tokens=reserved_tokens)
+    window.add_element(ContextElement(content="system " * 50, type=ContextType.SYSTEM, priority=0))
+    for i in range(10):
+        window.add_element(ContextElement(content="user " * 50, type=ContextType.USER, priority=i))
+    return window
+
+def test_priority_eviction_keeps_preserved_types():
+    window = _window()
+    session = ContextSession(windows=[window], token_budget=SessionBudget(total_tokens=300))
+
+    result = asyncio.run(SessionBudgetAllocator().rebalance(session))
+
+    assert [element.type for element in window.elements].count(ContextType.SYSTEM) == 1
+    # 予算に収まるだけ、優先度の高いユーザー要素が残る
+    assert [element.priority for element in window.elements if element.type == ContextType.USER] == [7, 8, 9]
+    assert result["trimmed"][0]["within_budget"]
+
+def test_allocation_below_reserved_tokens_does_not_wipe_window():
+    window = _window(reserved_tokens=500)
+    session = ContextSession(windows=[window], token_budget=SessionBudget(total_tokens=400))
+
+    result = asyncio.run(SessionBudgetAllocator().rebalance(session))
+
+    assert window.token_budget == 0
+    assert len(window.elements) == 11
+    assert result["trimmed"][0]["infeasible"]
+    assert result["windows"][0]["infeasible"]
+
+def test_satisfied_window_with_fractional_tokens_is_not_trimmed():
+    small = ContextWindow(max_tokens=10 ** 6, reserved_tokens=0)
+    small.add_element(ContextElement(content="word " * 9, type=ContextType.USER))
+    assert small.current_tokens % 1 != 0
+    session = ContextSession(windows=[small, _window()], token_budget=SessionBudget(total_tokens=300))
+
+    result = asyncio.run(SessionBudgetAllocator().rebalance(session))
+
+    assert len(small.elements) == 1
+    assert [trim["window_id"] for trim in result["trimmed"]] == [session.windows[1].id]
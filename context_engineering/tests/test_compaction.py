@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from context_compaction import WindowCompactor
+from context_models import (
+    ContextWindow, ContextElement, ContextType, CompactionPolicy, OptimizationTask, OptimizationStatus
+)
+from context_optimizer import ContextOptimizer
+
+def _window(system_text: str, turns: int) -> ContextWindow:
+    window = ContextWindow(max_tokens=120, reserved_tokens=0, compaction_policy=CompactionPolicy())
+    window.add_element(ContextElement(content=system_text, type=ContextType.SYSTEM))
+    for i in range(turns):
+        window.add_element(ContextElement(content=f"turn {i} " * 5, type=ContextType.USER))
+    return window
+
+def _state(window: ContextWindow):
+    return [(element.id, element.content) for element in window.elements]
+
+def test_make_room_evicts_when_feasible():
+    compactor = WindowCompactor(ContextOptimizer("test-key"))
+    window = _window("You are a helpful assistant.", 8)
+    element = ContextElement(content="new " * 20, type=ContextType.USER)
+
+    assert asyncio.run(compactor.make_room(window, element)) is not None
+    assert window.add_element(element)
+
+def test_make_room_leaves_window_unchanged_when_preserved_tokens_exceed_budget():
+    compactor = WindowCompactor(ContextOptimizer("test-key"))
+    window = _window("rule " * 60, 2)
+    before = _state(window)
+    element = ContextElement(content="new " * 40, type=ContextType.USER)
+
+    assert asyncio.run(compactor.make_room(window, element)) is None
+    assert _state(window) == before
+    assert compactor.sync_evictions == 0
+
+def test_make_room_restores_window_when_target_is_missed():
+    compactor = WindowCompactor(ContextOptimizer("test-key"))
+    # 保持する長い要素は圧縮の候補になるが、1文のため抽出型圧縮では縮まない
+    system_text = " ".join(f"rule{i}" for i in range(60))
+    window = _window(system_text, 2)
+    before = _state(window)
+    element = ContextElement(content="new " * 40, type=ContextType.USER)
+
+    assert asyncio.run(compactor.make_room(window, element)) is None
+    assert _state(window) == before
+
+def test_make_room_skips_while_background_job_runs():
+    compactor = WindowCompactor(ContextOptimizer("test-key"))
+    window = _window("You are a helpful assistant.", 8)
+    before = _state(window)
+    compactor._jobs[window.id] = OptimizationTask(
+        context_id=window.id, status=OptimizationStatus.IN_PROGRESS
+    )
+
+    assert asyncio.run(compactor.make_room(window, ContextElement(content="new " * 20))) is None
+    assert _state(window) == before
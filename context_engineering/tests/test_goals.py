@@ -0,0 +1,24 @@
+import asyncio
+
+from context_goals import GoalGraphExecutor, unique_goals
+
+def test_repeated_goals_depend_on_each_other():
+    executor = GoalGraphExecutor()
+    assert executor.dependencies(["improve_clarity", "improve_clarity"]) == [[], [0]]
+    # 内容だけを書き換える別の目標とは並行に実行できる
+    assert executor.dependencies(["improve_clarity", "improve_structure"]) == [[], []]
+
+def test_repeated_goals_run_once():
+    executor = GoalGraphExecutor()
+    calls = []
+
+    async def run_goal(goal):
+        calls.append(goal)
+        await asyncio.sleep(0)
+        return {"run": len(calls)}
+
+    result = asyncio.run(executor.run(["improve_clarity", "improve_structure", "improve_clarity"], run_goal))
+
+    assert sorted(calls) == ["improve_clarity", "improve_structure"]
+    assert [entry["goal"] for entry in result["execution"]["goals"]] == ["improve_clarity", "improve_structure"]
+    assert unique_goals(["unknown", "reduce_tokens", "unknown", "reduce_tokens"]) == ["unknown", "reduce_tokens"]
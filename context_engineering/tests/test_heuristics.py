@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from context_heuristics import LocalContextScorer
+from context_models import ContextWindow, ContextElement, ContextType
+
+# 実際の会話に近いウィンドウ（話題は一貫しているが語彙の重なりは小さい）
+CONVERSATION = [
+    ("system", "You are a helpful assistant for a travel booking service. Help users plan trips and book flights and hotels."),
+    ("user", "Hi, I'd like to plan a trip to Japan next spring. Can you help me figure out where to go?"),
+    ("assistant", "Of course! Spring is a great time to visit because of the cherry blossoms. Tokyo, Kyoto and Osaka are popular first stops. How long will you stay?"),
+    ("user", "About ten days. I'm mostly interested in temples, food and maybe some hiking."),
+    ("assistant", "Ten days works well. You could spend three days in Tokyo, four in Kyoto for the temples, and two in Osaka for street food, with a day hike near Nara or Hakone."),
+    ("user", "That sounds nice. What would flights from Chicago cost around April?"),
+    ("assistant", "Round-trip economy fares from Chicago to Tokyo in April usually range from 900 to 1400 dollars depending on the airline and how early you book."),
+    ("user", "Could you also suggest a mid-range hotel in Kyoto close to the main sights?"),
+    ("assistant", "A mid-range option near Gion or Higashiyama keeps you within walking distance of Kiyomizu-dera and Yasaka Shrine. Expect roughly 120 to 180 dollars per night."),
+    ("user", "Great. Is the rail pass still worth buying for this itinerary?"),
+    ("assistant", "After the recent price increase, the national rail pass only pays off if you take several long shinkansen rides. For Tokyo, Kyoto and Osaka a regional pass or individual tickets are usually cheaper."),
+    ("user", "Okay, please book the flights for April 3rd to April 13th and hold the Kyoto hotel for four nights."),
+]
+
+# 同じ語彙を繰り返す定型的なウィンドウ（語彙的な推定で十分に判定できる）
+REPETITIVE = [("system", "Summarize quarterly sales reports for the regional sales team.")] + [
+    ("user" if i % 2 == 0 else "assistant",
+     f"Quarterly sales report for the regional sales team: regional sales grew in the quarter and the sales team met the quarterly report targets {i}.")
+    for i in range(12)
+]
+
+def _score(elements):
+    scorer = LocalContextScorer()
+    return scorer.score_elements([content for _, content in elements], [element_type for element_type, _ in elements])
+
+def _window(elements) -> ContextWindow:
+    window = ContextWindow(max_tokens=100000)
+    for element_type, content in elements:
+        window.add_element(ContextElement(content=content, type=ContextType(element_type)))
+    return window
+
+def test_confidence_is_low_for_realistic_conversation():
+    assert sum(len(content.split()) for _, content in CONVERSATION) > LocalContextScorer().min_confident_tokens
+    assert _score(CONVERSATION)["confidence"] < 0.6
+
+def test_confidence_is_high_for_lexically_consistent_window():
+    assert _score(REPETITIVE)["confidence"] >= 0.6
+
+def test_hybrid_escalates_on_realistic_window():
+    pytest.importorskip("google.generativeai")
+    from context_analyzer import ContextAnalyzer
+    from context_stats import pack_window
+
+    analyzer = ContextAnalyzer("test-key")
+    calls = []
+
+    async def fake_semantic(window):
+        calls.append(window.id)
+        return {"metrics": {"topic_consistency": 0.9}, "insights": []}
+
+    analyzer._analyze_semantic_consistency = fake_semantic
+    for elements, expected_calls in ((REPETITIVE, 0), (CONVERSATION, 1)):
+        window = _window(elements)
+        asyncio.run(analyzer._analyze_semantics(window, "hybrid", pack_window(window), False))
+        assert len(calls) == expected_calls
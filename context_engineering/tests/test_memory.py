@@ -0,0 +1,68 @@
+import asyncio
+
+from context_budget import SessionBudgetAllocator
+from context_heuristics import ExtractiveCompressor
+from context_memory import SummaryMemory, summary_level
+from context_models import ContextSession, ContextWindow, ContextElement, ContextType, MemoryPolicy, SessionBudget
+from context_ordering import OrderingSpec
+from context_rewrite_cache import RewriteCache
+from context_stats import pack_window, structure_metrics
+
+class _Optimizer:
+    """local 要約に必要な部分だけを持つ最適化エンジン"""
+
+    def __init__(self):
+        self.rewrite_cache = RewriteCache({"summarize": 1})
+        self.extractive_compressor = ExtractiveCompressor()
+
+def _window() -> ContextWindow:
+    window = ContextWindow(max_tokens=10 ** 6, reserved_tokens=0)
+    window.add_element(ContextElement(content="You are a helpful assistant.", type=ContextType.SYSTEM))
+    window.memory_policy = MemoryPolicy(working_set=4, chunk_size=3, fan_in=2, summarize_mode="local")
+    for i in range(30):
+        window.add_element(ContextElement(
+            content=f"Turn {i} discusses item {i}. We agreed to ship item {i} next week. The remaining work is testing.",
+            type=ContextType.USER if i % 2 == 0 else ContextType.ASSISTANT
+        ))
+    return window
+
+def _folded_window(memory: SummaryMemory) -> ContextWindow:
+    window = _window()
+    asyncio.run(memory.fold(window))
+    return window
+
+def test_summaries_are_memory_elements_not_system():
+    window = _folded_window(SummaryMemory(_Optimizer()))
+    summaries = [element for element in window.elements if summary_level(element) is not None]
+
+    assert summaries and all(element.type == ContextType.MEMORY for element in summaries)
+    metrics = structure_metrics(pack_window(window))
+    assert metrics["system_ratio"] == 1 / len(window.elements)
+    assert metrics["memory_ratio"] == len(summaries) / len(window.elements)
+
+    # 並び替えではシステム要素の後、会話ターンの前に置く
+    ordered = OrderingSpec(("type",)).sort(window.elements)
+    assert ordered[0].type == ContextType.SYSTEM
+    assert all(element.type == ContextType.MEMORY for element in ordered[1:len(summaries) + 1])
+
+def test_summaries_are_not_preserved_as_system_by_budget_eviction():
+    window = _folded_window(SummaryMemory(_Optimizer()))
+    for element in window.elements:
+        element.priority = 0 if element.type == ContextType.MEMORY else 5
+    session = ContextSession(windows=[window], token_budget=SessionBudget(total_tokens=150))
+
+    asyncio.run(SessionBudgetAllocator().rebalance(session))
+
+    types = [element.type for element in window.elements]
+    assert ContextType.SYSTEM in types and ContextType.MEMORY not in types
+
+def test_fold_locks_are_released():
+    memory = SummaryMemory(_Optimizer())
+    windows = [_window() for _ in range(3)]
+
+    async def fold_all():
+        await asyncio.gather(*(memory.fold(window) for window in windows for _ in range(2)))
+
+    asyncio.run(fold_all())
+    assert memory._locks == {}
+    assert memory.get_stats()["summaries_created"] > 0
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from context_models import ContextWindow, ContextElement, ContextType
+from context_optimizer import ContextOptimizer
+from context_reduction import ReductionCostModel
+
+def _optimizer(replies):
+    optimizer = ContextOptimizer("test-key")
+    calls = []
+
+    async def fake_generate(prompt):
+        calls.append(prompt)
+        return replies[min(len(calls), len(replies)) - 1]
+
+    optimizer._generate = fake_generate
+    return optimizer, calls
+
+def test_empty_clarity_rewrite_is_not_cached():
+    optimizer, calls = _optimizer(["   ", "A clearer sentence."])
+
+    assert asyncio.run(optimizer._improve_content_clarity("an unclear sentence")) is None
+    assert asyncio.run(optimizer._improve_content_clarity("an unclear sentence")) == "A clearer sentence."
+    # 空でない書き換えはキャッシュから返す
+    assert asyncio.run(optimizer._improve_content_clarity("an unclear sentence")) == "A clearer sentence."
+    assert len(calls) == 2
+
+def test_empty_merge_is_not_cached():
+    optimizer, calls = _optimizer(["", "merged text"])
+
+    assert asyncio.run(optimizer._merge_similar_contents(["first", "second"])) == "first"
+    assert asyncio.run(optimizer._merge_similar_contents(["first", "second"])) == "merged text"
+    assert len(calls) == 2
+
+def test_dedup_actions_report_similarity():
+    optimizer, _ = _optimizer([""])
+    text = "The deployment pipeline runs the integration tests before every release of the service."
+    window = ContextWindow(max_tokens=10 ** 6, reserved_tokens=0)
+    window.add_element(ContextElement(content=text, type=ContextType.USER))
+    window.add_element(ContextElement(content=text + " ", type=ContextType.USER))
+    original, duplicate = window.elements
+
+    actions = optimizer._reduction_candidates(window.elements, {"compress_mode": "local"}, ReductionCostModel())
+    dedup = [action for action in actions if action.kind == "dedup"]
+    assert len(dedup) == 1
+    assert dedup[0].element_id == duplicate.id
+    assert dedup[0].to_dict()["duplicate_of"] == original.id
+    assert dedup[0].to_dict()["similarity"] >= 0.9
+    # dedup 以外には類似度を含めない
+    assert all("similarity" not in action.to_dict() for action in actions if action.kind != "dedup")
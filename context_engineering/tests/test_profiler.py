@@ -0,0 +1,20 @@
+from context_profiler import LatencyModel
+
+def test_latency_model_refits_only_after_new_samples(monkeypatch):
+    model = LatencyModel(min_samples=2)
+    for tokens in range(10):
+        model.observe(tokens, 1.0 + 0.5 * tokens)
+
+    fits = []
+    original_fit = model._fit
+    monkeypatch.setattr(model, "_fit", lambda: fits.append(1) or original_fit())
+
+    assert abs(model.estimate(4) - 3.0) < 1e-9
+    for tokens in range(100):
+        model.estimate(tokens)
+    assert len(fits) == 1
+
+    model.observe(20, 100.0)
+    assert model.estimate(4) != 3.0
+    assert len(fits) == 2
+    assert model.coefficients()["samples"] == 11
@@ -0,0 +1,92 @@
+import asyncio
+
+from context_models import OptimizationTask, OptimizationStatus
+from context_scheduler import OptimizationScheduler, TaskStore
+from context_task_registry import OptimizationTaskRegistry
+
+class _Optimizer:
+    def __init__(self):
+        self.optimization_tasks = OptimizationTaskRegistry()
+        self.finished = []
+        self.executed = []
+
+    def _publish_finished(self, task):
+        self.finished.append(task.id)
+
+    async def _execute_optimization(self, task, window):
+        self.executed.append(task.id)
+
+def _scheduler(optimizer) -> OptimizationScheduler:
+    return OptimizationScheduler(optimizer, TaskStore(":memory:"), lambda context_id: object())
+
+def test_cancel_pending_task_outside_queue_marks_it_cancelled():
+    optimizer = _Optimizer()
+    scheduler = _scheduler(optimizer)
+    task = OptimizationTask(context_id="window")
+    scheduler.submit(task)
+    # 取り出し後、実行開始前の状態
+    assert scheduler.queue.pop() == task.id
+
+    assert scheduler.cancel(task.id) is True
+    assert task.status == OptimizationStatus.CANCELLED
+    assert optimizer.finished == [task.id]
+
+    # 取り出し済みのタスクがその後実行されることはない
+    asyncio.run(scheduler._run(task.id))
+    assert optimizer.executed == []
+    assert task.status == OptimizationStatus.CANCELLED
+
+def test_cancel_finished_task_returns_false():
+    optimizer = _Optimizer()
+    scheduler = _scheduler(optimizer)
+    task = OptimizationTask(context_id="window")
+    scheduler.submit(task)
+    assert scheduler.cancel(task.id) is True
+    assert scheduler.cancel(task.id) is False
+    assert len(scheduler.queue) == 0
+
+def test_restore_fails_tasks_whose_window_is_gone(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    store = TaskStore(path)
+    orphan = OptimizationTask(context_id="gone", status=OptimizationStatus.IN_PROGRESS)
+    alive = OptimizationTask(context_id="alive")
+    store.save(orphan)
+    store.save(alive)
+    store.close()
+
+    optimizer = _Optimizer()
+    scheduler = OptimizationScheduler(
+        optimizer, TaskStore(path), lambda context_id: object() if context_id == "alive" else None
+    )
+
+    async def start_and_stop():
+        await scheduler.start()
+        # 実行中のタスクが終わる前にワーカーを止める
+        await scheduler.stop()
+
+    scheduler.queue.pop = lambda: None
+    asyncio.run(start_and_stop())
+
+    restored = {task.id: task for task in TaskStore(path).load_all()}
+    assert restored[orphan.id].status == OptimizationStatus.FAILED
+    assert "only task history is persisted" in restored[orphan.id].error_message
+    assert restored[alive.id].status == OptimizationStatus.PENDING
+
+def test_saves_on_the_event_loop_are_written_off_the_loop(tmp_path):
+    import threading
+
+    store = TaskStore(str(tmp_path / "tasks.db"))
+    threads = []
+    write = store._write
+    store._write = lambda rows, deleted: threads.append(threading.get_ident()) or write(rows, deleted)
+
+    async def save_many():
+        for _ in range(20):
+            store.save(OptimizationTask(context_id="window"))
+        await store.drain()
+
+    asyncio.run(save_many())
+    assert threads and threading.get_ident() not in threads
+    # 同じ周回の保存は1回の書き込みにまとめる
+    assert len(threads) < 20
+    assert len(store.load_all()) == 20
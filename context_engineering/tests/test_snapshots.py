@@ -0,0 +1,56 @@
+from context_models import ContextWindow, ContextElement, ContextType
+from context_snapshots import SnapshotStore
+
+def _window(count: int) -> ContextWindow:
+    window = ContextWindow(max_tokens=10 ** 6)
+    for i in range(count):
+        window.add_element(ContextElement(id=f"element-{i}", content=f"element {i}", type=ContextType.USER, metadata={"index": i}))
+    return window
+
+def _shared(before, after) -> int:
+    previous = {id(chunk) for chunk in before.chunks}
+    return sum(1 for chunk in after.chunks if id(chunk) in previous)
+
+def test_front_insert_and_delete_keep_most_chunks_shared():
+    store = SnapshotStore(chunk_size=8)
+    window = _window(256)
+    first = store.take(window)
+
+    window.elements.insert(0, ContextElement(id="inserted", content="inserted", type=ContextType.USER))
+    second = store.take(window)
+    assert len(second.chunks) > 16
+    assert len(second.chunks) - _shared(first, second) <= 1
+
+    del window.elements[:2]
+    third = store.take(window)
+    assert len(third.chunks) - _shared(second, third) <= 2
+    assert [state.content for state in third.states] == [element.content for element in window.elements]
+
+def test_unchanged_elements_reuse_states():
+    store = SnapshotStore()
+    window = _window(50)
+    first = store.take(window)
+    window.elements[10].metadata["index"] = -1
+    second = store.take(window)
+
+    changed = [a is not b for a, b in zip(first.states, second.states)]
+    assert changed.count(True) == 1 and changed[10]
+    assert store.diff(first, second)["modified"][0]["changes"] == ["metadata"]
+
+def test_restore_keeps_token_limits_unless_requested():
+    store = SnapshotStore()
+    window = _window(5)
+    snapshot = store.take(window)
+    window.elements.pop()
+    window.max_tokens = 1234
+
+    store.restore(window, snapshot.id)
+    assert len(window.elements) == 5
+    assert window.max_tokens == 1234
+
+    store.restore(window, snapshot.id, restore_limits=True)
+    assert window.max_tokens == 10 ** 6
+
+    # 復元後のスナップショットは復元元の状態を共有する
+    after = store.take(window)
+    assert all(a is b for a, b in zip(snapshot.states, after.states))
@@ -0,0 +1,12 @@
+from context_models import ContextWindow, ContextElement, ContextType
+from context_stats import pack_window, structure_metrics
+
+def test_pack_window_accepts_priorities_outside_int8():
+    window = ContextWindow(max_tokens=100000)
+    for priority in (-1000, -129, 5, 128, 1000, 2 ** 70):
+        window.add_element(ContextElement(content="text", type=ContextType.USER, priority=priority))
+
+    packed = pack_window(window)
+
+    assert list(packed.priorities) == [-1000, -129, 5, 128, 1000, 2 ** 63 - 1]
+    assert structure_metrics(packed)["avg_priority"] > 1000
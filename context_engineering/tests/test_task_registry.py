@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+from context_models import OptimizationTask, OptimizationStatus
+from context_task_registry import OptimizationTaskRegistry, TaskRetentionPolicy
+
+START = datetime(2026, 1, 1)
+
+def _task(index: int) -> OptimizationTask:
+    return OptimizationTask(id=f"task-{index}", context_id="window", created_at=START + timedelta(seconds=index))
+
+def _finish(registry: OptimizationTaskRegistry, task: OptimizationTask, seconds: int):
+    task.status = OptimizationStatus.COMPLETED
+    task.completed_at = START + timedelta(seconds=seconds)
+    registry.collect(now=(START + timedelta(seconds=seconds)).timestamp())
+
+def test_archives_in_completion_order_and_lists_newest_first():
+    registry = OptimizationTaskRegistry(TaskRetentionPolicy(max_full_tasks=2))
+    tasks = [_task(i) for i in range(5)]
+    for task in tasks:
+        registry.add(task)
+
+    # 最初に作成したタスクが最後に終了する
+    for seconds, index in enumerate((1, 2, 3, 4, 0), start=10):
+        _finish(registry, tasks[index], seconds)
+
+    assert list(registry.archived) == ["task-1", "task-2", "task-3"]
+    assert set(registry.tasks) == {"task-4", "task-0"}
+    assert registry.get_stats()["finished_full_tasks"] == 2
+
+    listed = registry.list(include_archived=True)
+    assert [task.id for task in listed] == [f"task-{i}" for i in reversed(range(5))]
+    assert [task.id for task in registry.list()] == ["task-4", "task-0"]
+
+def test_collect_only_inspects_unfinished_tasks():
+    registry = OptimizationTaskRegistry(TaskRetentionPolicy(max_full_age_seconds=float("inf")))
+    for i in range(100):
+        task = _task(i)
+        registry.add(task, collect=False)
+        task.status = OptimizationStatus.COMPLETED
+        task.completed_at = task.created_at
+    registry.collect(now=START.timestamp())
+
+    pending = _task(100)
+    registry.add(pending)
+    assert list(registry._active) == ["task-100"]
+    assert len(registry._finished) == 100
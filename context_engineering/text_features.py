@@ -0,0 +1,286 @@
+import re
+import math
+import zlib
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Iterable, Optional, Hashable
+from collections import Counter
+
+# 英数字の単語、カタカナ語、漢字列をそれぞれ抽出（ひらがなは主に助詞・語尾、数字のみの語はIDや時刻のため除外）
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[\u30a0-\u30ff\uff66-\uff9f]+|[\u3400-\u4dbf\u4e00-\u9fff]+")
+_HIRAGANA_PATTERN = re.compile(r"[\u3040-\u309f]+")
+
+STOPWORDS = frozenset("""
+a an the and or but if then else of to in on at by for with from as is are was were be been being
+it its this that these those i you he she we they me him her us them my your our their
+do does did have has had not no so than too very can could will would should may might must
+""".split())
+
+# 文境界: 日本語の句点・感嘆符・疑問符と改行の直後、英語の終止符は後続が空白の場合のみ（小数点などは区切らない）
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[。．！？\n])|(?<=[.!?])(?=\s)")
+
+# 語彙（文字列またはハッシュ値）から重みへの疎ベクトル
+SparseVector = Dict[Hashable, float]
+
+def tokenize(text: str) -> List[str]:
+    """語彙トークン化（日本語は漢字バイグラム、英語は単語単位）"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if "\u3400" <= token[0] <= "\u9fff":
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        elif token not in STOPWORDS and len(token) > 1 and not token.isdigit():
+            tokens.append(token)
+
+    # ひらがなのみのテキストは文字バイグラムで代用
+    if not tokens:
+        for run in _HIRAGANA_PATTERN.findall(text):
+            tokens.extend(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+
+    return tokens
+
+def split_sentences(text: str) -> List[str]:
+    """文に分割（区切りの空白は後続の文に残るため、連結すると元の表記に戻る）"""
+    return [sentence for sentence in _SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+def hashed_char_ngrams(text: str, n_values=(3, 4), dimensions: int = 1 << 20) -> List[int]:
+    """文字n-gramを固定次元にハッシュ（言語に依存せず、プロセス間で安定）"""
+    normalized = re.sub(r"\s+", " ", text.lower()).strip()
+    mask = dimensions - 1
+    grams = []
+    for n in n_values:
+        if len(normalized) < n:
+            continue
+        grams.extend(
+            zlib.crc32(normalized[i:i + n].encode("utf-8")) & mask
+            for i in range(len(normalized) - n + 1)
+        )
+    if not grams and normalized:
+        grams.append(zlib.crc32(normalized.encode("utf-8")) & mask)
+    return grams
+
+class AnalysisCache:
+    """内容ごとのトークン列・文字n-gramのキャッシュ（同じタスクの目標間で解析結果を共有）"""
+
+    def __init__(self):
+        self._tokens: Dict[str, List[str]] = {}
+        self._char_ngrams: Dict[str, List[int]] = {}
+
+    def tokens(self, text: str) -> List[str]:
+        tokens = self._tokens.get(text)
+        if tokens is None:
+            tokens = self._tokens[text] = tokenize(text)
+        return tokens
+
+    def char_ngrams(self, text: str) -> List[int]:
+        grams = self._char_ngrams.get(text)
+        if grams is None:
+            grams = self._char_ngrams[text] = hashed_char_ngrams(text)
+        return grams
+
+def char_ngram_vectors(texts: List[str], cache: Optional[AnalysisCache] = None) -> List[SparseVector]:
+    """ハッシュ化文字n-gramのTF-IDFベクトル（要素の埋め込み表現）"""
+    extract = cache.char_ngrams if cache is not None else hashed_char_ngrams
+    return tfidf_vectors([extract(text) for text in texts])
+
+def normalize(vector: SparseVector) -> SparseVector:
+    """L2正規化"""
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if norm == 0:
+        return {}
+    return {term: weight / norm for term, weight in vector.items()}
+
+def tfidf_vectors(documents: List[List[Hashable]]) -> List[SparseVector]:
+    """トークン列からL2正規化済みTF-IDFベクトルを生成"""
+    document_count = len(documents)
+    document_frequency = Counter()
+    for tokens in documents:
+        document_frequency.update(set(tokens))
+
+    idf = {
+        term: math.log((1 + document_count) / (1 + df)) + 1.0
+        for term, df in document_frequency.items()
+    }
+
+    vectors = []
+    for tokens in documents:
+        counts = Counter(tokens)
+        vectors.append(normalize({
+            term: (1.0 + math.log(count)) * idf[term]
+            for term, count in counts.items()
+        }))
+    return vectors
+
+def cosine(a: SparseVector, b: SparseVector) -> float:
+    """正規化済み疎ベクトル同士のコサイン類似度"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(term, 0.0) for term, weight in a.items())
+
+def centroid(vectors: Iterable[SparseVector]) -> SparseVector:
+    """正規化済みセントロイド"""
+    total: Dict[str, float] = {}
+    for vector in vectors:
+        for term, weight in vector.items():
+            total[term] = total.get(term, 0.0) + weight
+    return normalize(total)
+
+def similarity_matrix(vectors: List[SparseVector], max_postings: Optional[int] = None) -> List[Dict[int, float]]:
+    """転置インデックスによる疎な類似度行列（共通語彙を持つペアのみ）
+
+    max_postings を指定すると出現文書数がそれを超える語彙（IDFが低く寄与の小さい語）を
+    無視する近似計算となり、大きな文書集合でも二乗オーダーにならない。
+    """
+    postings: Dict[Hashable, List[tuple]] = {}
+    for index, vector in enumerate(vectors):
+        for term, weight in vector.items():
+            postings.setdefault(term, []).append((index, weight))
+
+    rows: List[Dict[int, float]] = [dict() for _ in vectors]
+    for term_postings in postings.values():
+        if max_postings is not None and len(term_postings) > max_postings:
+            continue
+        for index, weight in term_postings:
+            row = rows[index]
+            for other, other_weight in term_postings:
+                if other != index:
+                    row[other] = row.get(other, 0.0) + weight * other_weight
+    return rows
+
+class BM25Index:
+    """トークン列の集合に対するBM25転置インデックス"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.document_count = len(documents)
+        self.lengths = [len(tokens) for tokens in documents]
+        average_length = sum(self.lengths) / self.document_count if self.document_count else 0.0
+
+        # 語彙 -> [(文書番号, 出現回数)]
+        self.postings: Dict[str, List[tuple]] = {}
+        for index, tokens in enumerate(documents):
+            for term, count in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((index, count))
+
+        self.idf = {
+            term: math.log(1.0 + (self.document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+        # 文書長による正規化項は文書ごとに事前計算
+        self.length_norms = [
+            k1 * (1.0 - b + b * length / average_length) if average_length else k1
+            for length in self.lengths
+        ]
+
+    def score(self, query_tokens: Iterable[str]) -> List[float]:
+        """全文書のBM25スコア（クエリ語のポスティングのみを走査）"""
+        scores = [0.0] * self.document_count
+        for term in set(query_tokens):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, count in self.postings[term]:
+                scores[index] += idf * count * (self.k1 + 1.0) / (count + self.length_norms[index])
+        return scores
+
+    def top_terms(self, limit: int = 10) -> List[str]:
+        """コーパス全体で出現回数×IDFの大きい語彙（文書集合の主要トピック）"""
+        weights = {
+            term: sum(count for _, count in postings) * self.idf[term]
+            for term, postings in self.postings.items()
+        }
+        return [term for term, _ in sorted(weights.items(), key=lambda x: (-x[1], x[0]))[:limit]]
+
+# SimHashのビットごとの重み合計を1つの多倍長整数で並列に加算するためのレーン幅
+_SIMHASH_LANE_BITS = 32
+_SIMHASH_LANE_MASK = (1 << _SIMHASH_LANE_BITS) - 1
+# 1バイトの各ビットを8レーンに展開した値
+_BYTE_LANES = tuple(
+    sum(((byte >> bit) & 1) << (bit * _SIMHASH_LANE_BITS) for bit in range(8))
+    for byte in range(256)
+)
+
+@lru_cache(maxsize=65536)
+def _feature_lanes(feature: str) -> int:
+    """特徴の64ビットハッシュを、ビットごとに1レーンずつ展開"""
+    value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    lanes = 0
+    for offset in range(8):
+        lanes |= _BYTE_LANES[(value >> (8 * offset)) & 0xFF] << (8 * offset * _SIMHASH_LANE_BITS)
+    return lanes
+
+def simhash_features(text: str) -> set:
+    """SimHashの特徴集合（数字を正規化した語彙と、語順の変化も捉える単語バイグラム）"""
+    tokens = tokenize(re.sub(r"\d+", "0", text))
+    features = set(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    if not features:
+        # 特徴のないテキストは正規化した全文を1つの特徴とする（完全一致のみ近傍になる）
+        features.add(re.sub(r"\s+", " ", text.lower().strip()))
+    return features
+
+def simhash(text: str) -> int:
+    """64ビットSimHash（数字は正規化するため、時刻やIDだけが異なるログは同じ指紋になる）
+
+    頻出語に支配されないよう各特徴の重みは1とする。一致しないビットの割合は
+    特徴集合のコサイン類似度 c に対して約 arccos(c) / π となる。
+    """
+    features = simhash_features(text)
+    accumulated = sum(_feature_lanes(feature) for feature in features)
+    fingerprint = 0
+    for bit in range(64):
+        # 多数決: このビットが立つ特徴が過半数なら1
+        if 2 * ((accumulated >> (bit * _SIMHASH_LANE_BITS)) & _SIMHASH_LANE_MASK) > len(features):
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def set_cosine(a: set, b: set) -> float:
+    """集合同士のコサイン類似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / math.sqrt(len(a) * len(b))
+
+class SimHashIndex:
+    """ハミング距離が max_distance 以下の指紋を探すバンド分割インデックス
+
+    64ビットを max_distance + 1 個のバンドに分けると、距離が max_distance 以下の指紋同士は
+    少なくとも1つのバンドが一致する（鳩の巣原理）ため、一致バンドのバケットだけを調べればよい。
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max(0, min(max_distance, 63))
+        band_count = self.max_distance + 1
+        self.bands = []
+        start = 0
+        for band in range(band_count):
+            width = 64 // band_count + (1 if band < 64 % band_count else 0)
+            self.bands.append((start, (1 << width) - 1))
+            start += width
+        # (バンド番号, バンドの値) -> [(登録順, キー, 指紋)]
+        self.buckets: Dict[tuple, List[tuple]] = {}
+        self.size = 0
+
+    def _keys(self, fingerprint: int):
+        return [(band, (fingerprint >> start) & mask) for band, (start, mask) in enumerate(self.bands)]
+
+    def find(self, fingerprint: int) -> List[Hashable]:
+        """距離が max_distance 以下の項目のキー（登録順）"""
+        matches = {}
+        for key in self._keys(fingerprint):
+            for order, item_key, other in self.buckets.get(key, ()):
+                if order not in matches and (fingerprint ^ other).bit_count() <= self.max_distance:
+                    matches[order] = item_key
+        return [matches[order] for order in sorted(matches)]
+
+    def add(self, item_key: Hashable, fingerprint: int):
+        for key in self._keys(fingerprint):
+            self.buckets.setdefault(key, []).append((self.size, item_key, fingerprint))
+        self.size += 1
+
+def top_terms(vector: SparseVector, limit: int = 5) -> List[str]:
+    """重みの大きい語彙を取得"""
+    return [term for term, _ in sorted(vector.items(), key=lambda x: (-x[1], x[0]))[:limit]]